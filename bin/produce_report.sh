@@ -1,6 +1,6 @@
 #!/usr/bin/env sh
 
-python -m openshift_metrics.merge /data/*.json \
+python -m openshift_metrics.merge /data/metrics-* \
     --invoice-file /tmp/invoice.csv \
     --pod-report-file /tmp/pod-report.csv \
     --upload-to-s3 \
@@ -0,0 +1,204 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+"""Resumable collection of metrics for long periods"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from openshift_metrics import utils
+from openshift_metrics.metrics_file import replace_metrics_file
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _write_json_atomically(data, path):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
+
+
+class Manifest:
+    """
+    Records which queries of each window and which windows of a backfill
+    are complete, so that an interrupted backfill can be resumed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r") as file:
+                self.data = json.load(file)
+        except FileNotFoundError:
+            self.data = {"windows": {}}
+
+    def _window(self, window: str) -> dict:
+        return self.data["windows"].setdefault(
+            window, {"queries": [], "output_file": None, "uploaded": False}
+        )
+
+    def is_query_done(self, window: str, query: str) -> bool:
+        with self._lock:
+            return query in self._window(window)["queries"]
+
+    def mark_query_done(self, window: str, query: str) -> None:
+        with self._lock:
+            self._window(window)["queries"].append(query)
+            _write_json_atomically(self.data, self.path)
+
+    def is_window_done(self, window: str) -> bool:
+        with self._lock:
+            return self._window(window)["output_file"] is not None
+
+    def is_window_uploaded(self, window: str) -> bool:
+        with self._lock:
+            return self._window(window)["uploaded"]
+
+    def mark_window_done(self, window: str, output_file: str, uploaded: bool = False) -> None:
+        with self._lock:
+            self._window(window)["output_file"] = output_file
+            self._window(window)["uploaded"] = uploaded
+            _write_json_atomically(self.data, self.path)
+
+
+class CheckpointedClient:
+    """
+    Wraps a PrometheusClient and saves the result of every query of a window,
+    returning the saved result instead of querying prometheus again when the
+    window is collected after a crash.
+
+    Only results with data are saved. An EmptyResultError can come from a
+    failed request as well as from a query without data, so those queries are
+    run again when the window is resumed.
+    """
+
+    def __init__(self, prom_client, manifest: Manifest, checkpoint_dir: str, window: str):
+        self.prom_client = prom_client
+        self.manifest = manifest
+        self.checkpoint_dir = checkpoint_dir
+        self.window = window
+
+    def _checkpoint_path(self, metric: str) -> str:
+        return os.path.join(self.checkpoint_dir, hashlib.sha256(metric.encode()).hexdigest() + ".json")
+
+    def _query(self, query_function, metric, start_date, end_date):
+        if self.manifest.is_query_done(self.window, metric):
+            with open(self._checkpoint_path(metric), "r") as file:
+                result = json.load(file)["result"]
+            logger.info(f"Using checkpointed result of {metric} for {self.window}")
+        else:
+            result = list(query_function(metric, start_date, end_date))
+            if result:
+                os.makedirs(self.checkpoint_dir, exist_ok=True)
+                _write_json_atomically({"query": metric, "result": result}, self._checkpoint_path(metric))
+                self.manifest.mark_query_done(self.window, metric)
+
+        if not result:
+            raise utils.EmptyResultError(f"Error retrieving metric: {metric}")
+        return result
+
+    def query_metric(self, metric, start_date, end_date):
+        return self._query(self.prom_client.query_metric, metric, start_date, end_date)
+
+    def iter_metric(self, metric, start_date, end_date):
+        return iter(self._query(self.prom_client.iter_metric, metric, start_date, end_date))
+
+
+class Backfill:
+    """
+    Collects metrics for a long period as one metrics file per window of
+    `window_days`, collecting up to `max_jobs` windows concurrently.
+
+    Progress is recorded in manifest.json in `backfill_dir`, so running the
+    same backfill again skips the windows and queries that are already done.
+    """
+
+    def __init__(
+        self,
+        backfill_dir: str,
+        collect_to_file,
+        window_days: int = 1,
+        max_jobs: int = 1,
+        file_extension: str = "json",
+    ):
+        self.backfill_dir = backfill_dir
+        self.file_extension = file_extension
+        self.collect_to_file = collect_to_file
+        self.window_days = window_days
+        self.max_jobs = max_jobs
+        os.makedirs(backfill_dir, exist_ok=True)
+        self.manifest = Manifest(os.path.join(backfill_dir, "manifest.json"))
+
+    def get_windows(self, start_date: str, end_date: str) -> List[Tuple[str, str]]:
+        """Splits the period into windows of window_days, the last one may be shorter"""
+        windows = []
+        window_start = datetime.strptime(start_date, "%Y-%m-%d")
+        end = datetime.strptime(end_date, "%Y-%m-%d")
+        while window_start <= end:
+            window_end = min(window_start + timedelta(days=self.window_days - 1), end)
+            windows.append((window_start.strftime("%Y-%m-%d"), window_end.strftime("%Y-%m-%d")))
+            window_start = window_end + timedelta(days=1)
+        return windows
+
+    def _collect_window(self, prom_client, start_date, end_date, bucket_name):
+        window = f"{start_date}/{end_date}"
+        output_file = os.path.join(self.backfill_dir, utils.get_metrics_file_name(start_date, end_date, self.file_extension))
+
+        if not self.manifest.is_window_done(window):
+            checkpoint_dir = os.path.join(self.backfill_dir, "checkpoints", f"{start_date}_{end_date}")
+            client = CheckpointedClient(prom_client, self.manifest, checkpoint_dir, window)
+
+            tmp_file = output_file + ".tmp"
+            self.collect_to_file(client, start_date, end_date, tmp_file)
+            replace_metrics_file(tmp_file, output_file)
+            self.manifest.mark_window_done(window, output_file)
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        else:
+            logger.info(f"Skipping {window}, already collected in {output_file}")
+
+        if bucket_name and not self.manifest.is_window_uploaded(window):
+            utils.upload_metrics_file_to_s3(
+                output_file, bucket_name, utils.get_metrics_s3_location(start_date, end_date, self.file_extension)
+            )
+            self.manifest.mark_window_done(window, output_file, uploaded=True)
+
+    def run(self, prom_client, start_date: str, end_date: str, bucket_name: str = None) -> List[str]:
+        """
+        Collects every window of the period and uploads the metrics files to
+        bucket_name if it is provided. Returns the windows that failed.
+        """
+        windows = self.get_windows(start_date, end_date)
+        failed_windows = []
+
+        def collect(window):
+            try:
+                self._collect_window(prom_client, *window, bucket_name)
+            except Exception:
+                logger.exception(f"Failed to collect metrics from {window[0]} to {window[1]}")
+                failed_windows.append(f"{window[0]}/{window[1]}")
+
+        with ThreadPoolExecutor(max_workers=max(self.max_jobs, 1)) as executor:
+            list(executor.map(collect, windows))
+
+        return sorted(failed_windows)
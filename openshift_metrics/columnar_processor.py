@@ -0,0 +1,505 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+"""Metrics processor that stores the merged metrics in columns"""
+
+import logging
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from openshift_metrics.metrics_processor import MetricInterval, MetricsProcessor
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Code of a label that isn't set
+NO_CODE = -1
+
+# Kinds of series
+SAMPLES = 0
+INTERVALS = 1
+
+# Labels of a series that are copied into each of its samples, in this order
+SERIES_LABELS = ("gpu_type", "gpu_resource", "node_model", "node")
+
+
+class Categories:
+    """
+    Assigns a code to each distinct value in the order they're first seen.
+    Codes are never reassigned, so categories can be shared by processors.
+    """
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def code(self, value) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self._codes[value] = code
+            self.values.append(value)
+        return code
+
+    def get_code(self, value, default: int = NO_CODE) -> int:
+        """Returns the code of value without adding it"""
+        return self._codes.get(value, default)
+
+    def label_code(self, value) -> int:
+        """Returns the code of a label, or NO_CODE if it's empty"""
+        return self.code(value) if value else NO_CODE
+
+    def remap(self, other: "Categories") -> np.ndarray:
+        """
+        Returns an array that maps the codes of other to codes of these
+        categories. Its last element is NO_CODE, so NO_CODE maps to itself.
+        """
+        return np.array([self.code(value) for value in other.values] + [NO_CODE], dtype=np.int32)
+
+    def __len__(self):
+        return len(self.values)
+
+
+class ColumnarMetricsProcessor(MetricsProcessor):
+    """
+    MetricsProcessor that keeps the merged metrics in one array per field
+    instead of a dict per sample.
+
+    Every series that is merged has an entry in the series arrays (its pod,
+    metric name, labels, kind and the offset of its first sample), and its
+    samples are appended to the sample arrays (timestamp, value and, for
+    intervals, duration). Pods, metric names, labels and values are stored as
+    codes into categories, so a sample takes 16 bytes no matter how many
+    labels its series has.
+
+    The metrics of a pod are only put back into the dict form of merged_data
+    while the pod is condensed, so the result is the same as MetricsProcessor.
+    """
+
+    def __init__(
+        self,
+        interval_minutes: int = 15,
+        gpu_mapping_file: str = "gpu_node_map.json",
+    ):
+        self.interval_minutes = interval_minutes
+        self.gpu_mapping = self._load_gpu_mapping(gpu_mapping_file)
+
+        self._pods = Categories()
+        self._metric_names = Categories()
+        self._labels = Categories()
+        self._values = Categories()
+        self._clear_arrays()
+
+    def _clear_arrays(self) -> None:
+        """Removes all the merged series"""
+        # One entry per pod
+        self._pod_classes = array("i")
+
+        # One entry per series
+        self._series_pods = array("i")
+        self._series_metrics = array("i")
+        self._series_kinds = array("b")
+        self._series_labels = {label: array("i") for label in SERIES_LABELS}
+        self._series_offsets = array("q", [0])
+
+        # One entry per sample
+        self._timestamps = array("q")
+        self._sample_values = array("i")
+        self._durations = array("i")
+
+    @property
+    def merged_data(self) -> Dict:
+        """The merged metrics in the form of MetricsProcessor.merged_data, built on every access"""
+        merged_data = {}
+        for pod_id, pod_dict in self._iter_pod_dicts():
+            namespace, pod = self._pods.values[pod_id]
+            merged_data.setdefault(namespace, {})[pod] = pod_dict
+        return merged_data
+
+    @property
+    def sample_count(self) -> int:
+        return len(self._timestamps)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the arrays, without the categories"""
+        arrays = [
+            self._pod_classes,
+            self._series_pods,
+            self._series_metrics,
+            self._series_kinds,
+            self._series_offsets,
+            self._timestamps,
+            self._sample_values,
+            self._durations,
+            *self._series_labels.values(),
+        ]
+        return sum(len(values) * values.itemsize for values in arrays)
+
+    def merge_metrics(self, metric_name, metric_list):
+        """Merge metrics (cpu, memory, gpu) by pod"""
+        metric_code = self._metric_names.code(metric_name)
+        timestamps = self._timestamps
+        sample_values = self._sample_values
+        durations = self._durations
+        value_code = self._values.code
+
+        for metric in metric_list:
+            pod_id = self._pods.code((metric["metric"]["namespace"], metric["metric"]["pod"]))
+            while len(self._pod_classes) <= pod_id:
+                self._pod_classes.append(NO_CODE)
+
+            if metric_name == "cpu_request":
+                class_name = metric["metric"].get("label_nerc_mghpcc_org_class")
+                if class_name is not None:
+                    self._pod_classes[pod_id] = self._labels.code(class_name)
+
+            gpu_type, gpu_resource, node_model = self._extract_gpu_info(metric_name, metric)
+            label_values = (gpu_type, gpu_resource, node_model, metric["metric"].get("node"))
+            for label, label_value in zip(SERIES_LABELS, label_values):
+                self._series_labels[label].append(self._labels.label_code(label_value))
+
+            self._series_pods.append(pod_id)
+            self._series_metrics.append(metric_code)
+
+            if "intervals" in metric:
+                self._series_kinds.append(INTERVALS)
+                for start_time, duration, metric_value in metric["intervals"]:
+                    timestamps.append(start_time)
+                    sample_values.append(value_code(metric_value))
+                    durations.append(duration)
+            else:
+                self._series_kinds.append(SAMPLES)
+                for epoch_time, metric_value in metric["values"]:
+                    timestamps.append(epoch_time)
+                    sample_values.append(value_code(metric_value))
+                durations.frombytes(bytes(durations.itemsize * (len(timestamps) - len(durations))))
+
+            self._series_offsets.append(len(timestamps))
+
+    def combine(self, other: "ColumnarMetricsProcessor") -> None:
+        """
+        Adds the metrics merged by other to the metrics of this processor, with
+        the same result as if they had been merged into this processor after
+        its own metrics. other shouldn't be used afterwards.
+        """
+        pod_map = np.array([self._pods.code(pod) for pod in other._pods.values], dtype=np.int32)
+        metric_map = self._metric_names.remap(other._metric_names)
+        label_map = self._labels.remap(other._labels)
+        value_map = self._values.remap(other._values)
+
+        while len(self._pod_classes) < len(self._pods):
+            self._pod_classes.append(NO_CODE)
+        for other_pod_id, class_code in enumerate(other._pod_classes):
+            if class_code != NO_CODE:
+                self._pod_classes[pod_map[other_pod_id]] = label_map[class_code]
+
+        _extend(self._series_pods, pod_map[_as_numpy(other._series_pods)])
+        _extend(self._series_metrics, metric_map[_as_numpy(other._series_metrics)])
+        _extend(self._series_kinds, _as_numpy(other._series_kinds))
+        for label, codes in self._series_labels.items():
+            _extend(codes, label_map[_as_numpy(other._series_labels[label])])
+        _extend(self._series_offsets, _as_numpy(other._series_offsets)[1:] + len(self._timestamps))
+
+        _extend(self._timestamps, _as_numpy(other._timestamps))
+        _extend(self._sample_values, value_map[_as_numpy(other._sample_values)])
+        _extend(self._durations, _as_numpy(other._durations))
+
+    def get_namespaces(self) -> List[str]:
+        """Returns the namespaces in the order they were first merged"""
+        pod_series_counts = np.bincount(_as_numpy(self._series_pods), minlength=len(self._pods))
+        return list(
+            dict.fromkeys(
+                namespace
+                for (namespace, _), series_count in zip(self._pods.values, pod_series_counts.tolist())
+                if series_count
+            )
+        )
+
+    def select_namespaces(self, namespaces: Iterable[str]) -> "ColumnarMetricsProcessor":
+        """Returns a processor with only the metrics of namespaces, which shares the categories of this one"""
+        namespaces = set(namespaces)
+        selected = ColumnarMetricsProcessor.__new__(ColumnarMetricsProcessor)
+        selected.interval_minutes = self.interval_minutes
+        selected.gpu_mapping = self.gpu_mapping
+        selected._pods = self._pods
+        selected._metric_names = self._metric_names
+        selected._labels = self._labels
+        selected._values = self._values
+
+        pod_mask = np.array([namespace in namespaces for namespace, _ in self._pods.values], dtype=bool)
+        series_pods = _as_numpy(self._series_pods)
+        series_mask = pod_mask[series_pods] if len(series_pods) else np.zeros(0, dtype=bool)
+        offsets = _as_numpy(self._series_offsets)
+        lengths = np.diff(offsets)
+        sample_mask = np.repeat(series_mask, lengths)
+
+        # Pods that aren't selected keep their code, but have no series
+        selected._pod_classes = array("i", self._pod_classes)
+        selected._series_pods = _to_array("i", series_pods[series_mask])
+        selected._series_metrics = _to_array("i", _as_numpy(self._series_metrics)[series_mask])
+        selected._series_kinds = _to_array("b", _as_numpy(self._series_kinds)[series_mask])
+        selected._series_labels = {
+            label: _to_array("i", _as_numpy(codes)[series_mask]) for label, codes in self._series_labels.items()
+        }
+        selected._series_offsets = _to_array("q", np.concatenate(([0], np.cumsum(lengths[series_mask]))))
+        selected._timestamps = _to_array("q", _as_numpy(self._timestamps)[sample_mask])
+        selected._sample_values = _to_array("i", _as_numpy(self._sample_values)[sample_mask])
+        selected._durations = _to_array("i", _as_numpy(self._durations)[sample_mask])
+        return selected
+
+    def _iter_condensed_pods(self, metrics_to_check: List[str], in_place: bool) -> Iterator[Tuple[str, str, Dict]]:
+        """
+        Yields the namespace, the pod and the condensed pod dict of each pod.
+
+        The samples of all pods are condensed at once with array operations,
+        except for pods with intervals which are condensed like in
+        MetricsProcessor. The result is the same as MetricsProcessor's. In
+        place, the arrays are released once the pods are condensed, and each
+        condensed pod is released once it has been yielded.
+        """
+        interval = self.interval_minutes * 60
+        series_pods = _as_numpy(self._series_pods)
+        series_lengths = np.diff(_as_numpy(self._series_offsets))
+
+        pods_with_intervals = np.zeros(len(self._pods), dtype=bool)
+        pods_with_intervals[series_pods[_as_numpy(self._series_kinds) == INTERVALS]] = True
+
+        sample_mask = np.repeat(~pods_with_intervals[series_pods], series_lengths)
+        del series_pods
+        condensed_pods = self._condense_samples(sample_mask, metrics_to_check, interval)
+        for pod_id, pod_dict in self._iter_pod_dicts(pods_with_intervals):
+            self._condense_pod_in_place(pod_dict, metrics_to_check, interval)
+            condensed_pods[pod_id] = pod_dict
+
+        if in_place:
+            self._clear_arrays()
+        # Pods are yielded by namespace, in the order they were first merged
+        pods_by_namespace = {}
+        for pod_id in sorted(condensed_pods):
+            namespace, pod = self._pods.values[pod_id]
+            pods_by_namespace.setdefault(namespace, []).append((pod_id, pod))
+        for namespace, pods in pods_by_namespace.items():
+            for pod_id, pod in pods:
+                yield namespace, pod, condensed_pods.pop(pod_id) if in_place else condensed_pods[pod_id]
+
+    def _release_pod(self, namespace: str, pod: str) -> None:
+        """The condensed pods aren't kept, so there's nothing to release"""
+
+    def _condense_samples(self, sample_mask: np.ndarray, metrics_to_check: List[str], interval: int) -> Dict[int, Dict]:
+        """
+        Condenses the samples in sample_mask and returns the condensed pod
+        dict of each pod id.
+
+        The samples are sorted by pod, time and the order they were merged, and
+        the samples of a pod at the same time are grouped into a row like the
+        dicts of merged_data, with a column of codes for each metric and label
+        where the sample merged last wins. A run of rows starts at the first row
+        of a pod, after a gap of more than an interval, or when a checked
+        column changes.
+        """
+        series_lengths = np.diff(_as_numpy(self._series_offsets))
+        sample_series = np.repeat(np.arange(len(series_lengths), dtype=np.int32), series_lengths)
+        timestamps = _as_numpy(self._timestamps)
+        if sample_mask.all():
+            samples = None
+        else:
+            samples = np.flatnonzero(sample_mask)
+            sample_series = sample_series[samples]
+            timestamps = timestamps[samples]
+
+        # The samples are sorted by a single key of the pod and the time, a
+        # stable sort keeps the samples of a row in the order they were merged
+        # and is much faster than a lexsort since the series are already sorted.
+        # Times that don't fit in the low 32 bits of the key are replaced with
+        # their rank among the distinct times.
+        min_time = int(timestamps.min()) if len(timestamps) else 0
+        distinct_times = None
+        if len(timestamps) and int(timestamps.max()) - min_time >= 2**32:
+            distinct_times, timestamps = np.unique(timestamps, return_inverse=True)
+            min_time = 0
+        key = _as_numpy(self._series_pods)[sample_series].astype(np.int64) << 32
+        key |= timestamps - min_time
+        del timestamps
+        order = np.argsort(key, kind="stable")
+        key = key[order]
+        sample_series = sample_series[order]
+        samples = order if samples is None else samples[order]
+        del order
+
+        new_row = np.ones(len(key), dtype=bool)
+        np.not_equal(key[1:], key[:-1], out=new_row[1:])
+        sample_rows = np.cumsum(new_row, dtype=np.int32 if len(new_row) < 2**31 else np.int64) - 1
+        row_keys = key[new_row]
+        del key
+        row_pods = (row_keys >> 32).astype(np.int32)
+        row_timestamps = (row_keys & 0xFFFFFFFF) + min_time
+        if distinct_times is not None:
+            row_timestamps = distinct_times[row_timestamps]
+        del row_keys
+        num_rows = len(row_pods)
+        # the last sample of each row
+        row_ends = np.empty_like(new_row)
+        row_ends[:-1] = new_row[1:]
+        row_ends[-1:] = True
+        row_ends = np.flatnonzero(row_ends)
+        del new_row
+
+        # Each column is the codes of a field in each row, and the values of the codes
+        columns = {}
+        series_metrics = _as_numpy(self._series_metrics)[sample_series]
+        sample_values = _as_numpy(self._sample_values)[samples]
+        del samples
+        for metric_code, metric_name in enumerate(self._metric_names.values):
+            is_metric = series_metrics == metric_code
+            columns[metric_name] = (
+                _last_in_rows(sample_rows[is_metric], sample_values[is_metric], num_rows),
+                self._values,
+            )
+        del series_metrics, sample_values
+        row_end_series = sample_series[row_ends]
+        for label, codes in self._series_labels.items():
+            codes = _as_numpy(codes)
+            has_label = codes != NO_CODE
+            if not has_label.any():
+                row_codes = np.full(num_rows, NO_CODE, dtype=np.int32)
+            elif has_label.all():
+                # every series has the label, so the last sample of the row has it
+                row_codes = codes[row_end_series]
+            else:
+                label_codes = codes[sample_series]
+                labeled = label_codes != NO_CODE
+                row_codes = _last_in_rows(sample_rows[labeled], label_codes[labeled], num_rows)
+            columns[label] = (row_codes, self._labels)
+        del sample_series, sample_rows
+
+        run_start = np.ones(num_rows, dtype=bool)
+        run_start[1:] = (row_pods[1:] != row_pods[:-1]) | (np.diff(row_timestamps) > interval)
+        for metric in metrics_to_check:
+            if metric not in columns:
+                continue
+            codes, categories = columns[metric]
+            # A missing metric is compared as 0
+            codes = np.where(codes == NO_CODE, categories.get_code(0), codes)
+            run_start[1:] |= codes[1:] != codes[:-1]
+
+        starts = np.flatnonzero(run_start)
+        ends = np.empty_like(starts)
+        ends[:-1] = starts[1:] - 1
+        ends[-1:] = num_rows - 1
+        durations = row_timestamps[ends] - row_timestamps[starts] + interval
+
+        start_columns = [
+            (name, codes[starts].tolist(), categories.values) for name, (codes, categories) in columns.items()
+        ]
+        condensed_pods = {}
+        for run, (pod_id, epoch_time, duration) in enumerate(
+            zip(row_pods[starts].tolist(), row_timestamps[starts].tolist(), durations.tolist())
+        ):
+            metric_dict = {
+                name: values[codes[run]] for name, codes, values in start_columns if codes[run] != NO_CODE
+            }
+            metric_dict["duration"] = duration
+
+            pod_dict = condensed_pods.get(pod_id)
+            if pod_dict is None:
+                pod_dict = condensed_pods[pod_id] = {"metrics": {}}
+                class_code = self._pod_classes[pod_id]
+                if class_code != NO_CODE:
+                    pod_dict["label_nerc_mghpcc_org_class"] = self._labels.values[class_code]
+            pod_dict["metrics"][epoch_time] = metric_dict
+        return condensed_pods
+
+    def _iter_pod_dicts(self, pod_mask: Optional[np.ndarray] = None) -> Iterator[Tuple[int, Dict]]:
+        """
+        Yields the id and the pod dict of every pod that has series (and is in
+        pod_mask), in the order the pods were first merged. The pod dicts are
+        built one at a time from the arrays.
+        """
+        series_pods = _as_numpy(self._series_pods)
+        pod_series = np.argsort(series_pods, kind="stable")
+        pod_ends = np.cumsum(np.bincount(series_pods, minlength=len(self._pods)))
+
+        pod_start = 0
+        for pod_id, pod_end in enumerate(pod_ends.tolist()):
+            if pod_end > pod_start and (pod_mask is None or pod_mask[pod_id]):
+                yield pod_id, self._pod_dict(pod_id, pod_series[pod_start:pod_end].tolist())
+            pod_start = pod_end
+
+    def _pod_dict(self, pod_id: int, series_ids: List[int]) -> Dict:
+        """Builds the dict of a pod as MetricsProcessor.merge_metrics would have"""
+        metrics_dict = {}
+        pod_dict = {"metrics": metrics_dict}
+        intervals = []
+        values = self._values.values
+        interval = self.interval_minutes * 60
+
+        for series_id in series_ids:
+            metric_name = self._metric_names.values[self._series_metrics[series_id]]
+            label_fields = {
+                label: self._labels.values[codes[series_id]]
+                for label, codes in self._series_labels.items()
+                if codes[series_id] != NO_CODE
+            }
+            first, last = self._series_offsets[series_id], self._series_offsets[series_id + 1]
+
+            # Samples merged after intervals of the pod take precedence over
+            # them, so they're intervals of one step, with their index as seq
+            # like the intervals
+            is_interval_series = self._series_kinds[series_id] == INTERVALS
+            if is_interval_series or intervals:
+                for sample in range(first, last):
+                    start_time = self._timestamps[sample]
+                    fields = {metric_name: values[self._sample_values[sample]], **label_fields}
+                    duration = self._durations[sample] if is_interval_series else interval
+                    intervals.append(MetricInterval(start_time, start_time + duration, fields, sample))
+                continue
+
+            for epoch_time, value_code in zip(self._timestamps[first:last], self._sample_values[first:last]):
+                metric_dict = metrics_dict.setdefault(epoch_time, {})
+                metric_dict[metric_name] = values[value_code]
+                metric_dict.update(label_fields)
+
+        class_code = self._pod_classes[pod_id]
+        if class_code != NO_CODE:
+            pod_dict["label_nerc_mghpcc_org_class"] = self._labels.values[class_code]
+        if intervals:
+            pod_dict["intervals"] = intervals
+        return pod_dict
+
+
+def _as_numpy(values: array) -> np.ndarray:
+    """Returns a numpy view of an array"""
+    return np.frombuffer(values, dtype=values.typecode) if len(values) else np.zeros(0, dtype=values.typecode)
+
+
+def _last_in_rows(rows: np.ndarray, codes: np.ndarray, num_rows: int) -> np.ndarray:
+    """
+    Returns the code of the last sample of each row, or NO_CODE for rows
+    without samples. The samples must be sorted by row.
+    """
+    result = np.full(num_rows, NO_CODE, dtype=np.int32)
+    last = np.ones(len(rows), dtype=bool)
+    last[:-1] = rows[1:] != rows[:-1]
+    result[rows[last]] = codes[last]
+    return result
+
+
+def _to_array(typecode: str, values: np.ndarray) -> array:
+    return array(typecode, values.astype(typecode).tobytes())
+
+
+def _extend(values: array, other: np.ndarray) -> None:
+    values.frombytes(other.astype(values.typecode).tobytes())
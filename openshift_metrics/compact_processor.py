@@ -0,0 +1,306 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+"""Metrics processor that stores the merged metrics as compact series objects"""
+
+import logging
+import sys
+from array import array
+from decimal import Decimal, InvalidOperation
+from itertools import repeat
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from openshift_metrics.metrics_processor import MetricInterval, MetricsProcessor
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Series:
+    """
+    The samples (or intervals) of one series, with the fields that are the
+    same for all of them stored once. Values are codes into the values of
+    the processor.
+    """
+
+    __slots__ = ("metric_name", "fields", "seq", "timestamps", "values", "durations")
+
+    def __init__(self, metric_name: str, fields: Dict, seq: int, intervals: bool = False):
+        self.metric_name = metric_name
+        self.fields = fields
+        # The seq of the first interval (see MetricInterval), or of all the
+        # samples of the series
+        self.seq = seq
+        self.timestamps = array("q")
+        self.values = array("i")
+        self.durations = array("q") if intervals else None
+
+
+class PodMetrics:
+    """The series merged for a pod"""
+
+    __slots__ = ("series", "class_name")
+
+    def __init__(self):
+        self.series = []
+        self.class_name = None
+
+
+class CompactMetricsProcessor(MetricsProcessor):
+    """
+    MetricsProcessor that keeps the series merged for each pod as Series
+    objects, instead of copying the fields of a series into a dict for
+    every sample.
+
+    merged_data maps namespace -> pod -> PodMetrics. Label strings are
+    interned and the fields of series with the same labels are shared. Each
+    distinct value is parsed into a Decimal once when it's merged, and the
+    condensed metrics have the Decimal values, so the reports don't parse
+    them again. Otherwise values are compared as they were merged, so the
+    metrics are condensed the same way as by MetricsProcessor.
+    """
+
+    def __init__(
+        self,
+        interval_minutes: int = 15,
+        merged_data: dict = None,
+        gpu_mapping_file: str = "gpu_node_map.json",
+    ):
+        super().__init__(interval_minutes, merged_data, gpu_mapping_file)
+        self._metric_names = set()
+        self._raw_values = []
+        self._decimal_values = []
+        self._value_codes = {}
+        self._fields = {}
+
+    def merge_metrics(self, metric_name, metric_list):
+        """Merge metrics (cpu, memory, gpu) by pod"""
+        metric_name = sys.intern(metric_name)
+        self._metric_names.add(metric_name)
+        value_codes = self._value_codes
+
+        for metric in metric_list:
+            pod = sys.intern(metric["metric"]["pod"])
+            namespace = sys.intern(metric["metric"]["namespace"])
+            node = metric["metric"].get("node")
+
+            pods = self.merged_data.setdefault(namespace, {})
+            pod_metrics = pods.get(pod)
+            if pod_metrics is None:
+                pod_metrics = pods[pod] = PodMetrics()
+
+            if metric_name == "cpu_request":
+                class_name = metric["metric"].get("label_nerc_mghpcc_org_class")
+                if class_name is not None:
+                    pod_metrics.class_name = sys.intern(class_name)
+
+            gpu_type, gpu_resource, node_model = self._extract_gpu_info(
+                metric_name, metric
+            )
+            fields = self._intern_fields(
+                {"gpu_type": gpu_type, "gpu_resource": gpu_resource, "node_model": node_model, "node": node}
+            )
+
+            if "intervals" in metric:
+                series = Series(metric_name, fields, self._interval_seq, intervals=True)
+                for start_time, duration, metric_value in metric["intervals"]:
+                    series.timestamps.append(start_time)
+                    series.durations.append(duration)
+                    code = value_codes.get(metric_value)
+                    series.values.append(self._add_value(metric_value) if code is None else code)
+                self._interval_seq += len(series.timestamps)
+            else:
+                series = Series(metric_name, fields, self._interval_seq)
+                for epoch_time, metric_value in metric["values"]:
+                    series.timestamps.append(epoch_time)
+                    code = value_codes.get(metric_value)
+                    series.values.append(self._add_value(metric_value) if code is None else code)
+                self._interval_seq += 1
+
+            pod_metrics.series.append(series)
+
+    def combine(self, other: "CompactMetricsProcessor") -> None:
+        """
+        Adds the metrics merged by other to the metrics of this processor, with
+        the same result as if they had been merged into this processor after
+        its own metrics. other shouldn't be used afterwards.
+        """
+        value_map = [self._value_code(value) for value in other._raw_values]
+        self._metric_names.update(other._metric_names)
+
+        for namespace, pods in other.merged_data.items():
+            namespace_dict = self.merged_data.setdefault(namespace, {})
+            for pod, other_pod_metrics in pods.items():
+                pod_metrics = namespace_dict.get(pod)
+                if pod_metrics is None:
+                    pod_metrics = namespace_dict[pod] = PodMetrics()
+                if other_pod_metrics.class_name is not None:
+                    pod_metrics.class_name = other_pod_metrics.class_name
+
+                for series in other_pod_metrics.series:
+                    series.fields = self._intern_fields(series.fields)
+                    series.values = array("i", [value_map[code] for code in series.values])
+                    series.seq += self._interval_seq
+                    pod_metrics.series.append(series)
+        self._interval_seq += other._interval_seq
+
+    def select_namespaces(self, namespaces: Iterable[str]) -> "CompactMetricsProcessor":
+        """Returns a processor with only the metrics of namespaces, which shares the data of this one"""
+        selected = CompactMetricsProcessor.__new__(CompactMetricsProcessor)
+        selected.__dict__.update(self.__dict__)
+        selected.merged_data = {
+            namespace: self.merged_data[namespace]
+            for namespace in namespaces
+            if namespace in self.merged_data
+        }
+        return selected
+
+    def _iter_condensed_pods(self, metrics_to_check: List[str], in_place: bool) -> Iterator[Tuple[str, str, Dict]]:
+        """
+        Yields the namespace, the pod and the condensed pod dict of each pod.
+        The samples of each pod are condensed straight from its series, except
+        for pods with intervals which are condensed like in MetricsProcessor.
+        In place, the series of each pod are replaced by the condensed pod dict.
+        """
+        interval = self.interval_minutes * 60
+        for namespace, pods in list(self.merged_data.items()):
+            for pod, pod_metrics in list(pods.items()):
+                if any(series.durations is not None for series in pod_metrics.series):
+                    new_pod_dict = self._pod_dict(pod_metrics)
+                    self._condense_pod_in_place(new_pod_dict, metrics_to_check, interval)
+                    for metric_dict in new_pod_dict["metrics"].values():
+                        for metric_name in self._metric_names.intersection(metric_dict):
+                            metric_dict[metric_name] = self._decimal_values[self._value_codes[metric_dict[metric_name]]]
+                else:
+                    new_pod_dict = {"metrics": self._condense_series(pod_metrics, metrics_to_check, interval)}
+                    if pod_metrics.class_name is not None:
+                        new_pod_dict["label_nerc_mghpcc_org_class"] = pod_metrics.class_name
+                if in_place:
+                    pods[pod] = new_pod_dict
+                yield namespace, pod, new_pod_dict
+
+    def _condense_series(self, pod_metrics: PodMetrics, metrics_to_check: List[str], interval: int) -> Dict:
+        """
+        Condenses the samples of the series of a pod. Each metric and field is
+        a column that maps the time of a sample to its value, where the series
+        merged last wins, like the dicts of MetricsProcessor's merged_data.
+        Metric columns have value codes.
+        """
+        columns = {}
+        for series in pod_metrics.series:
+            columns.setdefault(series.metric_name, {}).update(zip(series.timestamps, series.values))
+            for field_name, value in series.fields.items():
+                columns.setdefault(field_name, {}).update(dict.fromkeys(series.timestamps, value))
+
+        # A missing metric is compared as 0
+        zero_code = self._value_codes.get(0, -1)
+        checked_columns = [
+            (columns[metric], zero_code if metric in self._metric_names else 0)
+            for metric in metrics_to_check
+            if metric in columns
+        ]
+        epoch_times = sorted(set().union(*columns.values()))
+
+        checked_values = zip(
+            *(map(column.get, epoch_times, repeat(missing)) for column, missing in checked_columns)
+        ) if checked_columns else repeat(())
+
+        run_starts = []
+        start_epoch_time = previous_time = start_values = None
+        for epoch_time, values in zip(epoch_times, checked_values):
+            if values == start_values and epoch_time - previous_time <= interval:
+                previous_time = epoch_time
+                continue
+            if start_values is not None:
+                run_starts.append((start_epoch_time, previous_time - start_epoch_time + interval))
+            start_epoch_time = previous_time = epoch_time
+            start_values = values
+        if start_values is not None:
+            run_starts.append((start_epoch_time, previous_time - start_epoch_time + interval))
+
+        new_metrics_dict = {}
+        for start_epoch_time, duration in run_starts:
+            metric_dict = {}
+            for name, column in columns.items():
+                value = column.get(start_epoch_time)
+                if value is not None:
+                    metric_dict[name] = self._decimal_values[value] if name in self._metric_names else value
+            metric_dict["duration"] = duration
+            new_metrics_dict[start_epoch_time] = metric_dict
+        return new_metrics_dict
+
+    def _pod_dict(self, pod_metrics: PodMetrics) -> Dict:
+        """Builds the dict of a pod as MetricsProcessor.merge_metrics would have"""
+        metrics_dict = {}
+        pod_dict = {"metrics": metrics_dict}
+        intervals = []
+        raw_values = self._raw_values
+        interval = self.interval_minutes * 60
+
+        for series in pod_metrics.series:
+            metric_name = series.metric_name
+            if series.durations is not None:
+                for index, (start_time, duration, value_code) in enumerate(
+                    zip(series.timestamps, series.durations, series.values)
+                ):
+                    fields = {metric_name: raw_values[value_code], **series.fields}
+                    intervals.append(MetricInterval(start_time, start_time + duration, fields, series.seq + index))
+                continue
+
+            # Samples merged after intervals of the pod take precedence over them
+            if intervals:
+                for epoch_time, value_code in zip(series.timestamps, series.values):
+                    fields = {metric_name: raw_values[value_code], **series.fields}
+                    intervals.append(MetricInterval(epoch_time, epoch_time + interval, fields, series.seq))
+                continue
+
+            for epoch_time, value_code in zip(series.timestamps, series.values):
+                metric_dict = metrics_dict.setdefault(epoch_time, {})
+                metric_dict[metric_name] = raw_values[value_code]
+                metric_dict.update(series.fields)
+
+        if pod_metrics.class_name is not None:
+            pod_dict["label_nerc_mghpcc_org_class"] = pod_metrics.class_name
+        if intervals:
+            pod_dict["intervals"] = intervals
+        return pod_dict
+
+    def _value_code(self, value) -> int:
+        code = self._value_codes.get(value)
+        return self._add_value(value) if code is None else code
+
+    def _add_value(self, value) -> int:
+        """Adds a distinct value and returns its code"""
+        code = len(self._raw_values)
+        self._value_codes[value] = code
+        self._raw_values.append(value)
+        self._decimal_values.append(_to_decimal(value))
+        return code
+
+    def _intern_fields(self, fields: Dict) -> Dict:
+        """Returns a shared dict with the labels of fields that are set"""
+        key = tuple((name, value) for name, value in fields.items() if value)
+        interned = self._fields.get(key)
+        if interned is None:
+            interned = self._fields[key] = {
+                name: sys.intern(value) if isinstance(value, str) else value for name, value in key
+            }
+        return interned
+
+
+def _to_decimal(value):
+    """Parses a value like the reports do, or returns it as it is if it isn't a number"""
+    try:
+        return Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return value
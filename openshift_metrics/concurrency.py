@@ -0,0 +1,124 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+"""Adaptive limit on the number of concurrent requests to prometheus"""
+
+import logging
+import threading
+import time
+from datetime import datetime, UTC
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How long to wait after a throttled response without a Retry-After header
+DEFAULT_THROTTLE_DELAY = 3
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Returns the seconds to wait from a Retry-After header, which is either seconds or a date"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=UTC)
+    return max((retry_at - datetime.now(UTC)).total_seconds(), 0)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limits the number of requests in flight, adjusting the limit with AIMD:
+    it grows by one for every `limit` requests that succeed with normal
+    latency, and is cut in half when a request is throttled (429/503) or
+    multiplied by `latency_backoff` when a request is much slower than usual.
+
+    Throttled requests that include a Retry-After header hold back every
+    new request until that time has passed.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        latency_tolerance: float = 2.0,
+        latency_backoff: float = 0.9,
+    ):
+        self.max_limit = max(max_limit, 1)
+        self.min_limit = max(min(min_limit, self.max_limit), 1)
+        self.latency_tolerance = latency_tolerance
+        self.latency_backoff = latency_backoff
+        self._limit = float(self.max_limit)
+        self._in_flight = 0
+        self._waiting = 0
+        self._average_latency = None
+        self._not_before = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """Current number of requests allowed in flight"""
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of requests waiting for a slot"""
+        return self._waiting
+
+    def acquire(self) -> None:
+        """Waits until a request can be sent"""
+        with self._condition:
+            self._waiting += 1
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._waiting -= 1
+            self._in_flight += 1
+            delay = self._not_before - time.monotonic()
+
+        if delay > 0:
+            logger.info(f"Waiting {delay:.1f}s before sending the next request to prometheus")
+            time.sleep(delay)
+
+    def release(self, latency: Optional[float] = None, throttled: bool = False, retry_after: Optional[float] = None) -> None:
+        """Records the outcome of a request and frees its slot"""
+        with self._condition:
+            self._in_flight -= 1
+
+            if throttled:
+                self._limit = max(self._limit / 2, self.min_limit)
+                delay = retry_after if retry_after is not None else DEFAULT_THROTTLE_DELAY
+                self._not_before = max(self._not_before, time.monotonic() + delay)
+                logger.warning(f"Prometheus is throttling requests, limiting concurrency to {self.limit}")
+            elif latency is not None:
+                if self._average_latency is not None and latency > self._average_latency * self.latency_tolerance:
+                    self._limit = max(self._limit * self.latency_backoff, self.min_limit)
+                else:
+                    self._limit = min(self._limit + 1 / self._limit, self.max_limit)
+                if self._average_latency is None:
+                    self._average_latency = latency
+                else:
+                    self._average_latency = 0.8 * self._average_latency + 0.2 * latency
+
+            self._condition.notify_all()
@@ -0,0 +1,197 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+"""Metrics processor that spills the merged series to disk to stay within a memory budget"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import weakref
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from openshift_metrics.metrics_processor import MetricsProcessor
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_BUDGET_MB = 512
+
+# Rough size in memory of a sample of a parsed series
+ESTIMATED_SAMPLE_BYTES = 200
+
+
+class ExternalMetricsProcessor(MetricsProcessor):
+    """
+    MetricsProcessor that keeps the merged series on disk.
+
+    Series are buffered as they are merged, and whenever the buffer reaches
+    the memory budget it's sorted by pod and written to a run file. Each pod
+    gets a sort key the first time it's merged (the order of its namespace,
+    then its own order), so the order of the pods is the same as in
+    MetricsProcessor.merged_data.
+
+    To condense the metrics, the runs are merged by pod with an external
+    merge, and the series of each pod are merged in their original order into
+    a MetricsProcessor and condensed, so the result is the same as merging
+    everything in memory while only one pod is in memory at a time.
+    """
+
+    def __init__(
+        self,
+        interval_minutes: int = 15,
+        memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+        spill_dir: Optional[str] = None,
+        gpu_mapping_file: str = "gpu_node_map.json",
+    ):
+        super().__init__(interval_minutes, gpu_mapping_file=gpu_mapping_file)
+        self.memory_budget_bytes = memory_budget_mb * 2**20
+        self._namespace_keys = {}
+        self._pod_keys = {}
+        self._selected_namespaces = None
+        self._seq = 0
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._runs = []
+        self._spill_dir = tempfile.mkdtemp(prefix="metrics-runs-", dir=spill_dir)
+        self._owns_spill_dir = True
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self._spill_dir, True)
+
+    def __getstate__(self):
+        # The process that unpickles the processor takes over its runs
+        state = self.__dict__.copy()
+        del state["_finalizer"]
+        if self._owns_spill_dir:
+            self._finalizer.detach()
+            self._owns_spill_dir = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._finalizer = None
+        if self._owns_spill_dir:
+            self._finalizer = weakref.finalize(self, shutil.rmtree, self._spill_dir, True)
+
+    def merge_metrics(self, metric_name, metric_list):
+        """Merge metrics (cpu, memory, gpu) by pod"""
+        for metric in metric_list:
+            namespace = metric["metric"]["namespace"]
+            pod = metric["metric"]["pod"]
+            namespace_key = self._namespace_keys.setdefault(namespace, len(self._namespace_keys))
+            pod_key = self._pod_keys.setdefault((namespace, pod), len(self._pod_keys))
+
+            self._buffer.append((namespace_key, pod_key, self._seq, metric_name, metric))
+            self._seq += 1
+            samples = metric.get("values", metric.get("intervals", ()))
+            self._buffer_bytes += len(samples) * ESTIMATED_SAMPLE_BYTES
+            if self._buffer_bytes >= self.memory_budget_bytes:
+                self._spill()
+
+    def _spill(self) -> None:
+        """Writes the buffered series to a new run, sorted by pod"""
+        if not self._buffer:
+            return
+        self._buffer.sort(key=lambda record: record[:3])
+        fd, run_path = tempfile.mkstemp(dir=self._spill_dir, suffix=".jsonl")
+        with os.fdopen(fd, "w") as run_file:
+            for record in self._buffer:
+                run_file.write(json.dumps(record))
+                run_file.write("\n")
+        logger.info(f"Spilled {len(self._buffer)} series to {run_path}")
+        self._runs.append(run_path)
+        self._buffer = []
+        self._buffer_bytes = 0
+
+    def combine(self, other: "ExternalMetricsProcessor") -> None:
+        """
+        Adds the metrics merged by other to the metrics of this processor, with
+        the same result as if they had been merged into this processor after
+        its own metrics. The runs of other are rewritten with the keys of this
+        processor. other shouldn't be used afterwards.
+        """
+        namespace_keys = {
+            key: self._namespace_keys.setdefault(namespace, len(self._namespace_keys))
+            for namespace, key in other._namespace_keys.items()
+        }
+        pod_keys = {
+            key: self._pod_keys.setdefault(namespace_pod, len(self._pod_keys))
+            for namespace_pod, key in other._pod_keys.items()
+        }
+
+        other._spill()
+        self._spill()
+        for run_path in other._runs:
+            self._buffer = [
+                (namespace_keys[namespace_key], pod_keys[pod_key], seq + self._seq, metric_name, metric)
+                for namespace_key, pod_key, seq, metric_name, metric in _read_run(run_path)
+            ]
+            self._spill()
+        self._seq += other._seq
+
+    def get_namespaces(self) -> List[str]:
+        """Returns the namespaces in the order they were first merged"""
+        return [
+            namespace
+            for namespace in self._namespace_keys
+            if self._selected_namespaces is None or namespace in self._selected_namespaces
+        ]
+
+    def select_namespaces(self, namespaces: Iterable[str]) -> "ExternalMetricsProcessor":
+        """Returns a processor that reads only the metrics of namespaces from the runs of this one"""
+        self._spill()
+        selected = ExternalMetricsProcessor.__new__(ExternalMetricsProcessor)
+        selected.__dict__.update(self.__dict__)
+        selected._runs = list(self._runs)
+        selected._selected_namespaces = set(namespaces)
+        selected._owns_spill_dir = False
+        selected._finalizer = None
+        return selected
+
+    def _iter_condensed_pods(self, metrics_to_check: List[str], in_place: bool) -> Iterator[Tuple[str, str, Dict]]:
+        """
+        Yields the namespace, the pod and the condensed pod dict of each pod,
+        reading the series of one pod at a time from the runs. The runs are
+        kept, so the metrics can be condensed again.
+        """
+        namespaces = {key: namespace for namespace, key in self._namespace_keys.items()}
+
+        self._buffer.sort(key=lambda record: record[:3])
+        records = heapq.merge(
+            *(_read_run(run_path) for run_path in self._runs),
+            iter(self._buffer),
+            key=lambda record: record[:3],
+        )
+
+        pod_processor = MetricsProcessor(interval_minutes=self.interval_minutes)
+        pod_processor.gpu_mapping = self.gpu_mapping
+        for (namespace_key, _), pod_records in itertools.groupby(records, key=lambda record: record[:2]):
+            if self._selected_namespaces is not None and namespaces[namespace_key] not in self._selected_namespaces:
+                continue
+
+            pod_processor.merged_data = {}
+            pod_processor._interval_seq = 0
+            for _, _, _, metric_name, metric in pod_records:
+                pod_processor.merge_metrics(metric_name, [metric])
+            yield from pod_processor._iter_condensed_pods(metrics_to_check, in_place=True)
+
+    def _release_pod(self, namespace: str, pod: str) -> None:
+        """Pods are read from the runs when they're condensed, so there's nothing to release"""
+
+
+def _read_run(run_path: str) -> Iterator[Tuple]:
+    with open(run_path) as run_file:
+        for line in run_file:
+            yield tuple(json.loads(line))
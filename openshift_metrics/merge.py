@@ -6,17 +6,31 @@ import logging
 import os
 import argparse
 from datetime import datetime, UTC
-import json
-from typing import Tuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Tuple
 from decimal import Decimal
 import nerc_rates
 
-from openshift_metrics import utils, invoice
+from openshift_metrics import utils, invoice, sharded_report
 from openshift_metrics.metrics_processor import MetricsProcessor
+from openshift_metrics.columnar_processor import ColumnarMetricsProcessor
+from openshift_metrics.compact_processor import CompactMetricsProcessor
+from openshift_metrics.external_processor import DEFAULT_MEMORY_BUDGET_MB, ExternalMetricsProcessor
+from openshift_metrics.metrics_file import is_index_file, load_metrics_file
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# How the merged metrics are stored
+PROCESSOR_BACKENDS = {
+    "dict": MetricsProcessor,
+    "incremental": partial(MetricsProcessor, incremental=True),
+    "compact": CompactMetricsProcessor,
+    "columnar": ColumnarMetricsProcessor,
+    "external": ExternalMetricsProcessor,
+}
+
 def compare_dates(date_str1, date_str2):
     """Returns true is date1 is earlier than date2"""
     date1 = datetime.strptime(date_str1, "%Y-%m-%d")
@@ -38,6 +52,64 @@ def parse_timestamp_range(timestamp_range: str) -> Tuple[datetime, datetime]:
             "Timestamp range must be in the format 'YYYY-MM-DDTHH:MM:SS,YYYY-MM-DDTHH:MM:SS'"
         )
 
+def merge_files_sequentially(
+    files: List[str],
+    backend: str = "dict",
+    backend_options: Optional[Dict] = None,
+    namespaces: Optional[List[str]] = None,
+) -> Tuple[MetricsProcessor, List[Tuple[str, str]]]:
+    """
+    Merges the metrics of files in order, and returns the processor with the
+    start and end dates of each file. backend_options are passed to the
+    processor of the backend. With namespaces, only the metrics of those
+    namespaces are loaded.
+    """
+    processor = PROCESSOR_BACKENDS[backend](**(backend_options or {}))
+    file_dates = []
+    for file in files:
+        metrics_from_file = load_metrics_file(file, namespaces)
+        cpu_request_metrics = metrics_from_file["cpu_metrics"]
+        memory_request_metrics = metrics_from_file["memory_metrics"]
+        gpu_request_metrics = metrics_from_file.get("gpu_metrics", None)
+        processor.merge_metrics("cpu_request", cpu_request_metrics)
+        processor.merge_metrics("memory_request", memory_request_metrics)
+        if gpu_request_metrics is not None:
+            processor.merge_metrics("gpu_request", gpu_request_metrics)
+        file_dates.append((metrics_from_file["start_date"], metrics_from_file["end_date"]))
+    return processor, file_dates
+
+
+def merge_files(
+    files: List[str],
+    jobs: int = 1,
+    backend: str = "dict",
+    backend_options: Optional[Dict] = None,
+    namespaces: Optional[List[str]] = None,
+) -> Tuple[MetricsProcessor, List[Tuple[str, str]]]:
+    """
+    Merges the metrics of files like merge_files_sequentially. With more than
+    one job, consecutive files are parsed and merged by each worker process,
+    and the partial results are combined in the order of the files.
+    """
+    jobs = min(jobs, len(files))
+    if jobs <= 1:
+        return merge_files_sequentially(files, backend, backend_options, namespaces)
+
+    chunk_size = -(-len(files) // jobs)
+    chunks = [files[i:i + chunk_size] for i in range(0, len(files), chunk_size)]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        merge_chunk = partial(
+            merge_files_sequentially, backend=backend, backend_options=backend_options, namespaces=namespaces
+        )
+        partials = list(executor.map(merge_chunk, chunks))
+
+    processor, file_dates = partials[0]
+    for partial_processor, partial_file_dates in partials[1:]:
+        processor.combine(partial_processor)
+        file_dates.extend(partial_file_dates)
+    return processor, file_dates
+
+
 def main():
     """Reads the metrics from files and generates the reports"""
     parser = argparse.ArgumentParser()
@@ -69,36 +141,64 @@ def main():
     parser.add_argument("--rate-gpu-v100-su", type=Decimal)
     parser.add_argument("--rate-gpu-a100sxm4-su", type=Decimal)
     parser.add_argument("--rate-gpu-a100-su", type=Decimal)
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes that merge the metrics files and generate the reports",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=PROCESSOR_BACKENDS,
+        default="dict",
+        help=(
+            "How the merged metrics are stored in memory. incremental, compact and "
+            "columnar take much less memory for long periods, and external keeps them on disk"
+        ),
+    )
+    parser.add_argument(
+        "--namespaces",
+        type=lambda namespaces: namespaces.split(","),
+        help=(
+            "Comma separated namespaces to report on. Only their series are read from "
+            "metrics files that have an index"
+        ),
+    )
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=int,
+        default=DEFAULT_MEMORY_BUDGET_MB,
+        help="With --backend external, how many MB of series are buffered before they're spilled to disk",
+    )
+    parser.add_argument(
+        "--spill-dir",
+        help="With --backend external, the directory for the spilled series (the system temp directory by default)",
+    )
 
     args = parser.parse_args()
-    files = args.files
+    # Globs of a directory of metrics files may include their indexes
+    files = [file for file in args.files if not is_index_file(file)]
     ignore_hours = args.ignore_hours
 
     report_start_date = None
     report_end_date = None
 
-    processor = MetricsProcessor()
+    backend_options = {}
+    if args.backend == "external":
+        backend_options = {"memory_budget_mb": args.memory_budget_mb, "spill_dir": args.spill_dir}
 
-    for file in files:
-        with open(file, "r") as jsonfile:
-            metrics_from_file = json.load(jsonfile)
-            cpu_request_metrics = metrics_from_file["cpu_metrics"]
-            memory_request_metrics = metrics_from_file["memory_metrics"]
-            gpu_request_metrics = metrics_from_file.get("gpu_metrics", None)
-            processor.merge_metrics("cpu_request", cpu_request_metrics)
-            processor.merge_metrics("memory_request", memory_request_metrics)
-            if gpu_request_metrics is not None:
-                processor.merge_metrics("gpu_request", gpu_request_metrics)
-
-            if report_start_date is None:
-                report_start_date = metrics_from_file["start_date"]
-            elif compare_dates(metrics_from_file["start_date"], report_start_date):
-                report_start_date = metrics_from_file["start_date"]
-
-            if report_end_date is None:
-                report_end_date = metrics_from_file["end_date"]
-            elif compare_dates(report_end_date, metrics_from_file["end_date"]):
-                report_end_date = metrics_from_file["end_date"]
+    processor, file_dates = merge_files(files, args.jobs, args.backend, backend_options, args.namespaces)
+
+    for file_start_date, file_end_date in file_dates:
+        if report_start_date is None:
+            report_start_date = file_start_date
+        elif compare_dates(file_start_date, report_start_date):
+            report_start_date = file_start_date
+
+        if report_end_date is None:
+            report_end_date = file_end_date
+        elif compare_dates(report_end_date, file_end_date):
+            report_end_date = file_end_date
 
     logger.info(f"Generating report from {report_start_date} to {report_end_date}")
 
@@ -138,25 +238,32 @@ def main():
         logger.warning("The report spans multiple months")
         report_month += " to " + datetime.strftime(report_end_date, "%Y-%m")
 
-    condensed_metrics_dict = processor.condense_metrics(
-        ["cpu_request", "memory_request", "gpu_request", "gpu_type"]
-    )
-    utils.write_metrics_by_namespace(
-        condensed_metrics_dict=condensed_metrics_dict,
-        file_name=invoice_file,
-        report_month=report_month,
-        rates=rates,
-        ignore_hours=ignore_hours,
-    )
-    utils.write_metrics_by_classes(
-        condensed_metrics_dict=condensed_metrics_dict,
-        file_name=f"by-classes-{invoice_file}",
-        report_month=report_month,
-        rates=rates,
-        namespaces_with_classes=["rhods-notebooks"],
-        ignore_hours=ignore_hours,
-    )
-    utils.write_metrics_by_pod(condensed_metrics_dict, pod_report_file, ignore_hours)
+    metrics_to_check = ["cpu_request", "memory_request", "gpu_request", "gpu_type"]
+    namespaces_with_classes = ["rhods-notebooks"]
+    if args.jobs > 1:
+        sharded_report.write_reports(
+            processor,
+            jobs=args.jobs,
+            metrics_to_check=metrics_to_check,
+            invoice_file=invoice_file,
+            classes_invoice_file=f"by-classes-{invoice_file}",
+            pod_report_file=pod_report_file,
+            report_month=report_month,
+            rates=rates,
+            namespaces_with_classes=namespaces_with_classes,
+            ignore_hours=ignore_hours,
+        )
+    else:
+        utils.write_reports_from_intervals(
+            processor.iter_condensed_metrics(metrics_to_check, consume=True),
+            invoice_file=invoice_file,
+            classes_invoice_file=f"by-classes-{invoice_file}",
+            pod_report_file=pod_report_file,
+            report_month=report_month,
+            rates=rates,
+            namespaces_with_classes=namespaces_with_classes,
+            ignore_hours=ignore_hours,
+        )
 
     if args.upload_to_s3:
         bucket_name = os.environ.get("S3_INVOICE_BUCKET", "nerc-invoicing")
@@ -0,0 +1,735 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+"""Reading and writing of the metrics files"""
+
+import argparse
+import gc
+import gzip
+import io
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Spooled series are kept in memory until they take up this much space
+SPOOL_MAX_MEMORY_BYTES = 16 * 2**20
+
+# File extension of each output format
+METRICS_FILE_EXTENSIONS = {"json": "json", "binary": "bin"}
+# Extension added to the file extension of compressed metrics files
+COMPRESSION_EXTENSIONS = {"gzip": "gz", "zstd": "zst"}
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+BINARY_MAGIC = b"OSMB"
+BINARY_FORMAT_VERSION = 1
+
+STRING_RECORD = b"S"
+HEADER_RECORD = b"H"
+SECTION_RECORD = b"C"
+SERIES_RECORD = b"R"
+INTERVAL_SERIES_RECORD = b"I"
+END_RECORD = b"E"
+
+# Label values can be null when a node is missing GPU labels
+NONE_STRING_ID = 2**32 - 1
+
+DELTA_NUMBERS = 0
+FLOAT_NUMBERS = 1
+
+INT_VALUE = b"i"
+FLOAT_VALUE = b"f"
+STRING_VALUE = b"s"
+JSON_VALUE = b"j"
+
+# Stored instead of the typecode of the palette indices when there's a single value
+SAME_VALUE_INDICES = b"-"
+
+INDEX_FORMAT_VERSION = 1
+
+
+class SeriesSpool:
+    """
+    A section of series that is spooled to a temporary file one series at a
+    time, so that the series of a section don't all have to be kept in
+    memory while the rest of the metrics are collected.
+    """
+
+    def __init__(self):
+        self._file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY_BYTES, mode="w+")
+        self._count = 0
+
+    def append(self, series: Dict) -> None:
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(json.dumps(series))
+        self._file.write("\n")
+        self._count += 1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[Dict]:
+        self._file.seek(0)
+        for line in self._file:
+            yield json.loads(line)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MetricsWriter:
+    """
+    Writes a metrics file one series at a time, so that each section can be
+    written as soon as it's collected without keeping all of its series in
+    memory. The file has the same format as the JSON dump of the metrics dict.
+
+    The file is written to a temporary file that only replaces output_file
+    once every section has been written.
+
+    With write_index, an index of where the series of each namespace are in
+    each section is written next to the file (see get_index_file_name), so
+    that load_metrics_file can read only the series of some namespaces.
+    """
+
+    binary = False
+
+    def __init__(
+        self,
+        output_file: str,
+        start_date: str,
+        end_date: str,
+        compression: Optional[str] = None,
+        write_index: bool = True,
+    ):
+        self.output_file = output_file
+        self.start_date = start_date
+        self.end_date = end_date
+        self.compression = compression
+        self.write_index = write_index
+        self._lock = threading.Lock()
+        self._raw_file = None
+        self._file = None
+        self._tmp_path = None
+        # Offset in the uncompressed file of the next write
+        self._offset = 0
+        # section -> namespace -> [start, end] offsets of runs of series
+        self._index = {}
+
+    def __enter__(self):
+        logger.info(f"Writing metrics to {self.output_file}")
+        fd, self._tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.output_file)), suffix=".tmp"
+        )
+        self._raw_file = os.fdopen(fd, "wb")
+        self._file = _compressed_writer(self._raw_file, self.compression)
+        if not self.binary:
+            self._file = io.TextIOWrapper(self._file, encoding="utf-8")
+        self._write_header()
+        return self
+
+    def _write(self, data) -> None:
+        # JSON is written as ASCII, so its length is the number of bytes
+        self._file.write(data)
+        self._offset += len(data)
+
+    def _add_to_index(self, section: str, namespace: Optional[str], start: int, extend: bool) -> None:
+        """
+        Adds the series written from start to the current offset to the index
+        of its namespace, extending the last range of the namespace if the
+        previous series was of the same namespace
+        """
+        namespace_ranges = self._index[section].setdefault(namespace, [])
+        if extend:
+            namespace_ranges[-1][1] = self._offset
+        else:
+            namespace_ranges.append([start, self._offset])
+
+    def _write_header(self) -> None:
+        self._write(
+            f'{{"start_date": {json.dumps(self.start_date)}, "end_date": {json.dumps(self.end_date)}'
+        )
+
+    def _write_footer(self) -> None:
+        self._write("}")
+
+    def write_section(self, name: str, series: Iterable[Dict]) -> None:
+        """Writes the series of a section such as cpu_metrics, as they are iterated"""
+        with self._lock:
+            self._write(f", {json.dumps(name)}: [")
+            self._index[name] = {}
+            previous_namespace = None
+            for i, metric in enumerate(series):
+                if i > 0:
+                    self._write(", ")
+                start = self._offset
+                self._write(json.dumps(metric))
+                namespace = metric["metric"].get("namespace")
+                self._add_to_index(name, namespace, start, extend=i > 0 and namespace == previous_namespace)
+                previous_namespace = namespace
+            self._write("]")
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self._file.close()
+            self._raw_file.close()
+            os.remove(self._tmp_path)
+            return
+        self._write_footer()
+        self._file.close()
+        self._raw_file.close()
+        os.replace(self._tmp_path, self.output_file)
+        if self.write_index:
+            self._write_index_file()
+        else:
+            # An index of the file that was replaced would be wrong
+            try:
+                os.remove(get_index_file_name(self.output_file))
+            except FileNotFoundError:
+                pass
+
+    def _write_index_file(self) -> None:
+        """
+        Writes the index of the file. Offsets are in the uncompressed file, and
+        the size of the file is kept to tell if the index is out of date.
+        """
+        index = {
+            "version": INDEX_FORMAT_VERSION,
+            "binary": self.binary,
+            "file_size": os.path.getsize(self.output_file),
+            "start_date": self.start_date,
+            "end_date": self.end_date,
+            "sections": self._index,
+        }
+        if self.binary:
+            index["strings"] = list(self._string_ids)
+
+        index_file = get_index_file_name(self.output_file)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(index_file)), suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            json.dump(index, file)
+        os.replace(tmp_path, index_file)
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("zstd compression requires the zstandard package")
+
+
+def _compressed_writer(raw_file, compression: Optional[str]):
+    """Wraps raw_file so that what's written to it is compressed, without closing raw_file"""
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw_file, mode="wb", compresslevel=6)
+    if compression == "zstd":
+        _require_zstandard()
+        return zstandard.ZstdCompressor().stream_writer(raw_file, closefd=False)
+    if compression is not None:
+        raise ValueError(f"Unknown compression {compression}")
+    return raw_file
+
+
+def _decompress(data: bytes) -> bytes:
+    """Decompresses data if it's gzip or zstd compressed"""
+    if data.startswith(GZIP_MAGIC):
+        return gzip.decompress(data)
+    if data.startswith(ZSTD_MAGIC):
+        _require_zstandard()
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+            return reader.read()
+    return data
+
+
+def _to_little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+class BinaryMetricsWriter(MetricsWriter):
+    """
+    Writes a metrics file in the binary format, which is made of records
+    that each start with a tag byte:
+
+    - S: a string, which gets the next id of the string table of the file
+    - H: the start and end dates, as string ids
+    - C: the start of a section (e.g. cpu_metrics), as a string id
+    - R: a series of the current section
+    - I: a series of the current section condensed into intervals
+    - E: the end of the file
+
+    Strings are only added to the string table the first time they are
+    used. A series has its labels as pairs of string ids, its timestamps as
+    the first timestamp and runs of equal deltas, and its values as a
+    palette of typed values (integers, floats, or strings) with the index
+    of each sample in the palette, unless they all have the same value.
+    Interval series are stored the same way, with their durations encoded
+    like the timestamps. Values are read back as the exact strings they
+    were written as.
+    """
+
+    binary = True
+
+    def __init__(
+        self,
+        output_file: str,
+        start_date: str,
+        end_date: str,
+        compression: Optional[str] = None,
+        write_index: bool = True,
+    ):
+        super().__init__(output_file, start_date, end_date, compression, write_index)
+        self._string_ids = {}
+
+    def _string_id(self, string: Optional[str]) -> int:
+        if string is None:
+            return NONE_STRING_ID
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            string_id = len(self._string_ids)
+            self._string_ids[string] = string_id
+            encoded = string.encode()
+            self._write(STRING_RECORD + struct.pack("<I", len(encoded)) + encoded)
+        return string_id
+
+    def _write_header(self) -> None:
+        self._write(BINARY_MAGIC + struct.pack("<B", BINARY_FORMAT_VERSION))
+        start_id = self._string_id(self.start_date)
+        end_id = self._string_id(self.end_date)
+        self._write(HEADER_RECORD + struct.pack("<II", start_id, end_id))
+
+    def _write_footer(self) -> None:
+        self._write(END_RECORD)
+
+    def write_section(self, name: str, series: Iterable[Dict]) -> None:
+        with self._lock:
+            self._write(SECTION_RECORD + struct.pack("<I", self._string_id(name)))
+            self._index[name] = {}
+            previous_namespace = None
+            for i, metric in enumerate(series):
+                # Strings are written right before the first series that uses
+                # them, so they're part of its range
+                start = self._offset
+                self._write_series(metric)
+                namespace = metric["metric"].get("namespace")
+                self._add_to_index(name, namespace, start, extend=i > 0 and namespace == previous_namespace)
+                previous_namespace = namespace
+
+    def _write_series(self, metric: Dict) -> None:
+        label_ids = array("I")
+        for key, value in metric["metric"].items():
+            label_ids.append(self._string_id(key))
+            label_ids.append(self._string_id(value))
+        labels_bytes = struct.pack("<I", len(metric["metric"])) + _to_little_endian(label_ids)
+
+        if "intervals" in metric:
+            starts = [interval[0] for interval in metric["intervals"]]
+            durations = [interval[1] for interval in metric["intervals"]]
+            values = [interval[2] for interval in metric["intervals"]]
+            self._write(
+                INTERVAL_SERIES_RECORD
+                + labels_bytes
+                + self._encode_numbers(starts)
+                + self._encode_numbers(durations)
+                + self._encode_values(values)
+            )
+            return
+
+        timestamps = [sample[0] for sample in metric["values"]]
+        values = [sample[1] for sample in metric["values"]]
+        self._write(
+            SERIES_RECORD
+            + labels_bytes
+            + self._encode_numbers(timestamps)
+            + self._encode_values(values)
+        )
+
+    @staticmethod
+    def _encode_numbers(numbers: List) -> bytes:
+        """Encodes timestamps or durations as the first number and runs of equal deltas"""
+        if not all(type(number) is int for number in numbers):
+            return (
+                struct.pack("<BI", FLOAT_NUMBERS, len(numbers))
+                + _to_little_endian(array("d", numbers))
+            )
+
+        runs = array("q")
+        for previous, current in zip(numbers, numbers[1:]):
+            delta = current - previous
+            if runs and runs[-2] == delta:
+                runs[-1] += 1
+            else:
+                runs.extend((delta, 1))
+        first = numbers[0] if numbers else 0
+        return (
+            struct.pack("<BIqI", DELTA_NUMBERS, len(numbers), first, len(runs) // 2)
+            + _to_little_endian(runs)
+        )
+
+    def _encode_values(self, values: List) -> bytes:
+        palette = {}
+        indices = array("I")
+        for value in values:
+            key = (type(value), value)
+            index = palette.get(key)
+            if index is None:
+                index = palette[key] = len(palette)
+            indices.append(index)
+
+        encoded = bytearray(struct.pack("<I", len(palette)))
+        for _, value in palette:
+            encoded += self._encode_value(value)
+
+        if len(palette) <= 1:
+            # every sample has the same value, so there's no need for indices
+            return bytes(encoded + SAME_VALUE_INDICES)
+        elif len(palette) <= 2**8:
+            typecode = "B"
+        elif len(palette) <= 2**16:
+            typecode = "H"
+        else:
+            typecode = "I"
+        encoded += typecode.encode() + _to_little_endian(array(typecode, indices))
+        return bytes(encoded)
+
+    def _encode_value(self, value) -> bytes:
+        if isinstance(value, str):
+            try:
+                if str(int(value)) == value and -(2**63) <= int(value) < 2**63:
+                    return INT_VALUE + struct.pack("<q", int(value))
+            except ValueError:
+                pass
+            try:
+                if repr(float(value)) == value:
+                    return FLOAT_VALUE + struct.pack("<d", float(value))
+            except ValueError:
+                pass
+            return STRING_VALUE + struct.pack("<I", self._string_id(value))
+        # anything that isn't a string is kept as its JSON
+        return JSON_VALUE + struct.pack("<I", self._string_id(json.dumps(value)))
+
+
+def _read_binary_metrics(data: bytes) -> Dict:
+    """Reads the metrics dict from the contents of a binary metrics file"""
+    version = data[len(BINARY_MAGIC)]
+    if version != BINARY_FORMAT_VERSION:
+        raise ValueError(f"Unsupported metrics file version {version}")
+
+    view = memoryview(data)
+    offset = len(BINARY_MAGIC) + 1
+    strings = []
+    metrics_dict = {}
+    section = None
+
+    def string(string_id):
+        return None if string_id == NONE_STRING_ID else strings[string_id]
+
+    while True:
+        if offset >= len(data):
+            raise ValueError("Truncated metrics file")
+        tag = data[offset:offset + 1]
+        offset += 1
+
+        if tag == STRING_RECORD:
+            (length,) = struct.unpack_from("<I", data, offset)
+            offset += 4
+            strings.append(str(view[offset:offset + length], "utf-8"))
+            offset += length
+        elif tag == HEADER_RECORD:
+            start_id, end_id = struct.unpack_from("<II", data, offset)
+            offset += 8
+            metrics_dict["start_date"] = string(start_id)
+            metrics_dict["end_date"] = string(end_id)
+        elif tag == SECTION_RECORD:
+            (name_id,) = struct.unpack_from("<I", data, offset)
+            offset += 4
+            section = metrics_dict[string(name_id)] = []
+        elif tag in (SERIES_RECORD, INTERVAL_SERIES_RECORD):
+            metric, offset = _read_series(data, view, offset, string, intervals=tag == INTERVAL_SERIES_RECORD)
+            section.append(metric)
+        elif tag == END_RECORD:
+            return metrics_dict
+        else:
+            raise ValueError(f"Invalid record {tag!r} in metrics file")
+
+
+def _read_series(data: bytes, view: memoryview, offset: int, string, intervals: bool) -> Tuple[Dict, int]:
+    (num_labels,) = struct.unpack_from("<I", data, offset)
+    offset += 4
+    label_ids = _from_little_endian("I", view[offset:offset + num_labels * 8])
+    offset += num_labels * 8
+    labels = {
+        string(label_ids[i]): string(label_ids[i + 1]) for i in range(0, len(label_ids), 2)
+    }
+
+    timestamps, offset = _read_numbers(data, view, offset)
+    if intervals:
+        durations, offset = _read_numbers(data, view, offset)
+    values, offset = _read_values(data, view, offset, len(timestamps), string)
+
+    if intervals:
+        return {"metric": labels, "intervals": [list(interval) for interval in zip(timestamps, durations, values)]}, offset
+    return {"metric": labels, "values": [[timestamp, value] for timestamp, value in zip(timestamps, values)]}, offset
+
+
+def _read_numbers(data: bytes, view: memoryview, offset: int) -> Tuple[List, int]:
+    """Reads numbers written by BinaryMetricsWriter._encode_numbers"""
+    kind, count = struct.unpack_from("<BI", data, offset)
+    offset += 5
+    if kind == FLOAT_NUMBERS:
+        numbers = _from_little_endian("d", view[offset:offset + count * 8]).tolist()
+        return numbers, offset + count * 8
+
+    first, num_runs = struct.unpack_from("<qI", data, offset)
+    offset += 12
+    runs = _from_little_endian("q", view[offset:offset + num_runs * 16])
+    offset += num_runs * 16
+    numbers = [first] if count else []
+    current = first
+    for i in range(0, len(runs), 2):
+        delta, run_length = runs[i], runs[i + 1]
+        if delta == 0:
+            numbers.extend([current] * run_length)
+        else:
+            numbers.extend(range(current + delta, current + delta * run_length + (1 if delta > 0 else -1), delta))
+            current += delta * run_length
+    return numbers, offset
+
+
+def _read_values(data: bytes, view: memoryview, offset: int, count: int, string) -> Tuple[List, int]:
+    """Reads values written by BinaryMetricsWriter._encode_values"""
+    (palette_size,) = struct.unpack_from("<I", data, offset)
+    offset += 4
+    palette = []
+    for _ in range(palette_size):
+        value_type = data[offset:offset + 1]
+        if value_type == INT_VALUE:
+            palette.append(str(struct.unpack_from("<q", data, offset + 1)[0]))
+        elif value_type == FLOAT_VALUE:
+            palette.append(repr(struct.unpack_from("<d", data, offset + 1)[0]))
+        elif value_type == STRING_VALUE:
+            palette.append(string(struct.unpack_from("<I", data, offset + 1)[0]))
+        else:
+            palette.append(json.loads(string(struct.unpack_from("<I", data, offset + 1)[0])))
+        offset += 9 if value_type in (INT_VALUE, FLOAT_VALUE) else 5
+
+    typecode = data[offset:offset + 1]
+    offset += 1
+    if typecode == SAME_VALUE_INDICES:
+        return [palette[0]] * count if palette else [], offset
+
+    item_size = array(typecode.decode()).itemsize
+    indices = _from_little_endian(typecode.decode(), view[offset:offset + count * item_size])
+    return [palette[index] for index in indices], offset + count * item_size
+
+
+def load_metrics_file(path: str, namespaces: Optional[Iterable[str]] = None) -> Dict:
+    """
+    Reads the metrics dict from a metrics file in either format, compressed or
+    not. With namespaces, only the series of those namespaces are read, using
+    the index of the file if it has an up to date one.
+    """
+    if namespaces is not None:
+        namespaces = set(namespaces)
+        index = _load_index(path)
+        if index is not None:
+            return _load_indexed_namespaces(path, index, namespaces)
+        logger.warning(f"{path} has no up to date index, reading all of it")
+
+    with open(path, "rb") as file:
+        data = _decompress(file.read())
+
+    # Millions of samples are created and none of them can be garbage, so
+    # the garbage collector only slows loading down.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if data.startswith(BINARY_MAGIC):
+            metrics_dict = _read_binary_metrics(data)
+        else:
+            metrics_dict = json.loads(data)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    if namespaces is not None:
+        for key, value in metrics_dict.items():
+            if key not in ("start_date", "end_date"):
+                metrics_dict[key] = [metric for metric in value if metric["metric"].get("namespace") in namespaces]
+    return metrics_dict
+
+
+def get_index_file_name(path: str) -> str:
+    """
+    Returns the name of the index file of a metrics file (or of its S3 key).
+    It's hidden, so globs of metrics files like metrics-* or *.json don't
+    match it.
+    """
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.idx")
+
+
+def is_index_file(path: str) -> bool:
+    name = os.path.basename(path)
+    return name.startswith(".") and name.endswith(".idx")
+
+
+def replace_metrics_file(src: str, dst: str) -> None:
+    """Moves a metrics file to dst like os.replace, along with its index"""
+    os.replace(src, dst)
+    try:
+        os.replace(get_index_file_name(src), get_index_file_name(dst))
+    except FileNotFoundError:
+        # An index of the file that was replaced would be wrong
+        try:
+            os.remove(get_index_file_name(dst))
+        except FileNotFoundError:
+            pass
+
+
+def _load_index(path: str) -> Optional[Dict]:
+    """Returns the index of a metrics file, or None if it has none or it's out of date"""
+    try:
+        with open(get_index_file_name(path)) as file:
+            index = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if index.get("version") != INDEX_FORMAT_VERSION or index.get("file_size") != os.path.getsize(path):
+        return None
+    return index
+
+
+def _load_indexed_namespaces(path: str, index: Dict, namespaces: Set[str]) -> Dict:
+    """
+    Reads the series of namespaces from the ranges of the index. Uncompressed
+    files are memory mapped, so only the pages of those ranges are read.
+    """
+    metrics_dict = {"start_date": index["start_date"], "end_date": index["end_date"]}
+    with open(path, "rb") as file:
+        if file.read(max(len(GZIP_MAGIC), len(ZSTD_MAGIC))).startswith((GZIP_MAGIC, ZSTD_MAGIC)):
+            file.seek(0)
+            data = _decompress(file.read())
+        else:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if index["file_size"] else b""
+
+    try:
+        strings = index.get("strings")
+        for section, namespace_ranges in index["sections"].items():
+            # The series are read in the order of the file, like without the index
+            ranges = sorted(
+                tuple(byte_range)
+                for namespace in namespaces.intersection(namespace_ranges)
+                for byte_range in namespace_ranges[namespace]
+            )
+            if index["binary"]:
+                metrics_dict[section] = [
+                    metric for start, end in ranges for metric in _read_binary_range(data, start, end, strings)
+                ]
+            else:
+                metrics_dict[section] = [
+                    metric for start, end in ranges for metric in json.loads(b"[" + data[start:end] + b"]")
+                ]
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+    return metrics_dict
+
+
+def _read_binary_range(data, start: int, end: int, strings: List[str]) -> List[Dict]:
+    """Reads the series records from start to end, skipping the string records between them"""
+    def string(string_id):
+        return None if string_id == NONE_STRING_ID else strings[string_id]
+
+    series = []
+    view = memoryview(data)
+    try:
+        offset = start
+        while offset < end:
+            tag = data[offset:offset + 1]
+            offset += 1
+            if tag == STRING_RECORD:
+                (length,) = struct.unpack_from("<I", data, offset)
+                offset += 4 + length
+            elif tag in (SERIES_RECORD, INTERVAL_SERIES_RECORD):
+                metric, offset = _read_series(data, view, offset, string, intervals=tag == INTERVAL_SERIES_RECORD)
+                series.append(metric)
+            else:
+                raise ValueError(f"Invalid record {tag!r} in the indexed range of the metrics file")
+    finally:
+        view.release()
+    return series
+
+
+def get_metrics_writer(output_format: str):
+    """Returns the writer class for the output format"""
+    return BinaryMetricsWriter if output_format == "binary" else MetricsWriter
+
+
+def get_metrics_file_extension(output_format: str, compression: Optional[str] = None) -> str:
+    """Returns the file extension of metrics files, e.g. json.gz"""
+    extension = METRICS_FILE_EXTENSIONS[output_format]
+    if compression:
+        extension += "." + COMPRESSION_EXTENSIONS[compression]
+    return extension
+
+
+def main():
+    """Converts a metrics file to JSON or to the binary format"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_file")
+    parser.add_argument("output_file")
+    parser.add_argument("--output-format", choices=list(METRICS_FILE_EXTENSIONS), default="json")
+    parser.add_argument("--compression", choices=list(COMPRESSION_EXTENSIONS))
+    args = parser.parse_args()
+
+    metrics_dict = load_metrics_file(args.input_file)
+    sections = {key: value for key, value in metrics_dict.items() if key not in ("start_date", "end_date")}
+    writer_class = get_metrics_writer(args.output_format)
+    with writer_class(
+        args.output_file, metrics_dict["start_date"], metrics_dict["end_date"], args.compression
+    ) as writer:
+        for name, series in sections.items():
+            writer.write_section(name, series)
+
+
+if __name__ == "__main__":
+    main()
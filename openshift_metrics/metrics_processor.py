@@ -1,5 +1,7 @@
 import json
-from typing import List, Dict
+import re
+from dataclasses import dataclass, field
+from typing import List, Dict, Iterable, Iterator, Tuple
 from collections import namedtuple
 import logging
 
@@ -8,6 +10,24 @@ logger = logging.getLogger(__name__)
 
 GPU_UNKNOWN_TYPE = "GPU_UNKNOWN_TYPE"
 GPUInfo = namedtuple("GPUInfo", ["gpu_type", "gpu_resource", "node_model"])
+# The metrics of a pod from start (inclusive) to end (exclusive). Where intervals
+# overlap, the fields of the one merged last (highest seq) take precedence.
+MetricInterval = namedtuple("MetricInterval", ["start", "end", "fields", "seq"])
+# A condensed interval of the metrics of a pod, where metrics includes the duration
+CondensedInterval = namedtuple("CondensedInterval", ["start", "metrics", "class_name"])
+GPU_RESOURCE_PATTERN = re.compile(r"nvidia.com.*")
+
+
+@dataclass
+class _IncrementalPodState:
+    """What's needed to extend the intervals of a pod while merging incrementally"""
+
+    # [index in the pod intervals, seq up to which it can be extended] of
+    # the last interval of each series
+    open_intervals: Dict[Tuple, List[int]] = field(default_factory=dict)
+    # The latest seq of each value of each field in the pod intervals
+    value_seqs: Dict[str, Dict] = field(default_factory=dict)
+    last_seq: int = -1
 
 
 class MetricsProcessor:
@@ -18,9 +38,13 @@ class MetricsProcessor:
         interval_minutes: int = 15,
         merged_data: dict = None,
         gpu_mapping_file: str = "gpu_node_map.json",
+        incremental: bool = False,
     ):
         self.interval_minutes = interval_minutes
         self.merged_data = merged_data if merged_data is not None else {}
+        self.incremental = incremental
+        self._interval_seq = 0
+        self._incremental_pods = {}
         self.gpu_mapping = self._load_gpu_mapping(gpu_mapping_file)
 
     def merge_metrics(self, metric_name, metric_list):
@@ -42,6 +66,38 @@ class MetricsProcessor:
                 metric_name, metric
             )
 
+            fields = {}
+            if gpu_type:
+                fields["gpu_type"] = gpu_type
+            if gpu_resource:
+                fields["gpu_resource"] = gpu_resource
+            if node_model:
+                fields["node_model"] = node_model
+            if node:
+                fields["node"] = node
+
+            # Series that were condensed by the collector are kept as intervals
+            if "intervals" in metric:
+                for start_time, duration, metric_value in metric["intervals"]:
+                    self._add_interval(
+                        namespace, pod, start_time, start_time + duration, {metric_name: metric_value, **fields}
+                    )
+                continue
+
+            if self.incremental:
+                self._merge_values_as_intervals(namespace, pod, metric_name, metric["values"], fields)
+                continue
+
+            # Samples merged after intervals of the pod must take precedence over
+            # them, so they get a seq as intervals of one step
+            if "intervals" in self.merged_data[namespace][pod]:
+                interval = self.interval_minutes * 60
+                for epoch_time, metric_value in metric["values"]:
+                    self._add_interval(
+                        namespace, pod, epoch_time, epoch_time + interval, {metric_name: metric_value, **fields}
+                    )
+                continue
+
             for epoch_time, metric_value in metric["values"]:
 
                 self.merged_data[namespace][pod]["metrics"].setdefault(epoch_time, {})
@@ -66,6 +122,133 @@ class MetricsProcessor:
                         "node"
                     ] = node
 
+    def _add_interval(self, namespace: str, pod: str, start: int, end: int, fields: Dict) -> int:
+        """Adds an interval to the metrics of the pod, and returns its index in the pod intervals"""
+        pod_intervals = self.merged_data[namespace][pod].setdefault("intervals", [])
+        pod_intervals.append(MetricInterval(start, end, fields, self._interval_seq))
+
+        if self.incremental:
+            pod_state = self._incremental_pods.setdefault((namespace, pod), _IncrementalPodState())
+            for field_name, value in fields.items():
+                pod_state.value_seqs.setdefault(field_name, {})[value] = self._interval_seq
+            pod_state.last_seq = self._interval_seq
+
+        self._interval_seq += 1
+        return len(pod_intervals) - 1
+
+    def _merge_values_as_intervals(
+        self, namespace: str, pod: str, metric_name: str, values: Iterable, fields: Dict
+    ) -> None:
+        """
+        Merges the samples of a series into the intervals of the pod as they
+        come. Each sample is an interval of one step, which extends the last
+        interval of the series if it has the same value and follows it without
+        a gap, so only the intervals are kept rather than every sample.
+
+        An interval keeps its seq when it's extended, so it's only extended
+        if no interval merged after it has a different value for any of its
+        fields. Otherwise a new interval is started, and condensing gives the
+        same result as merging every sample.
+        """
+        interval = self.interval_minutes * 60
+        pod_intervals = self.merged_data[namespace][pod].setdefault("intervals", [])
+        pod_state = self._incremental_pods.setdefault((namespace, pod), _IncrementalPodState())
+        series_key = (metric_name, *fields.items())
+
+        open_intervals = pod_state.open_intervals
+        for epoch_time, metric_value in values:
+            open_interval = open_intervals.get(series_key)
+            if open_interval is not None:
+                index, extendable_seq = open_interval
+                start, end, interval_fields, seq = pod_intervals[index]
+                if (
+                    end - interval <= epoch_time <= end
+                    and interval_fields[metric_name] == metric_value
+                    and (
+                        extendable_seq == pod_state.last_seq
+                        or not self._is_overridden(pod_state, pod_intervals[index])
+                    )
+                ):
+                    open_interval[1] = pod_state.last_seq
+                    if epoch_time + interval > end:
+                        pod_intervals[index] = MetricInterval(start, epoch_time + interval, interval_fields, seq)
+                    continue
+
+            index = self._add_interval(
+                namespace, pod, epoch_time, epoch_time + interval, {metric_name: metric_value, **fields}
+            )
+            open_intervals[series_key] = [index, pod_state.last_seq]
+
+    @staticmethod
+    def _is_overridden(pod_state: _IncrementalPodState, metric_interval: MetricInterval) -> bool:
+        """Checks if an interval merged after metric_interval has a different value for any of its fields"""
+        return any(
+            seq > metric_interval.seq and other_value != value
+            for field_name, value in metric_interval.fields.items()
+            for other_value, seq in pod_state.value_seqs[field_name].items()
+        )
+
+    def combine(self, other: "MetricsProcessor") -> None:
+        """
+        Adds the metrics merged by other to the metrics of this processor, with
+        the same result as if they had been merged into this processor after
+        its own metrics. other shouldn't be used afterwards.
+        """
+        # The samples of other were merged before its intervals, and after
+        # the intervals of this processor, so they get the seq in between
+        samples_seq = self._interval_seq
+        seq_offset = samples_seq + 1
+        interval = self.interval_minutes * 60
+        for namespace, pods in other.merged_data.items():
+            namespace_dict = self.merged_data.setdefault(namespace, {})
+            for pod, other_pod_dict in pods.items():
+                pod_dict = namespace_dict.setdefault(pod, {"metrics": {}})
+
+                class_name = other_pod_dict.get("label_nerc_mghpcc_org_class")
+                if class_name is not None:
+                    pod_dict["label_nerc_mghpcc_org_class"] = class_name
+
+                metrics_dict = pod_dict["metrics"]
+                if "intervals" in pod_dict:
+                    pod_dict["intervals"].extend(
+                        MetricInterval(epoch_time, epoch_time + interval, metric_dict, samples_seq)
+                        for epoch_time, metric_dict in other_pod_dict["metrics"].items()
+                    )
+                else:
+                    for epoch_time, metric_dict in other_pod_dict["metrics"].items():
+                        if epoch_time in metrics_dict:
+                            metrics_dict[epoch_time].update(metric_dict)
+                        else:
+                            metrics_dict[epoch_time] = metric_dict
+
+                if "intervals" in other_pod_dict:
+                    pod_dict.setdefault("intervals", []).extend(
+                        interval._replace(seq=interval.seq + seq_offset)
+                        for interval in other_pod_dict["intervals"]
+                    )
+        self._interval_seq = seq_offset + other._interval_seq
+        # The intervals of other aren't tracked, so new samples start new intervals
+        self._incremental_pods.clear()
+
+    def get_namespaces(self) -> List[str]:
+        """Returns the namespaces in the order they were first merged"""
+        return list(self.merged_data)
+
+    def select_namespaces(self, namespaces: Iterable[str]) -> "MetricsProcessor":
+        """Returns a processor with only the metrics of namespaces, which shares the data of this one"""
+        selected = MetricsProcessor(
+            interval_minutes=self.interval_minutes,
+            merged_data={
+                namespace: self.merged_data[namespace]
+                for namespace in namespaces
+                if namespace in self.merged_data
+            },
+            incremental=self.incremental,
+        )
+        selected.gpu_mapping = self.gpu_mapping
+        selected._interval_seq = self._interval_seq
+        return selected
+
     def _extract_gpu_info(self, metric_name: str, metric: Dict) -> GPUInfo:
         """Extract GPU related info"""
         gpu_type = None
@@ -96,65 +279,182 @@ class MetricsProcessor:
             logger.warning("Could not load gpu-node map file: %s", file_path)
             return {}
 
-    def condense_metrics(self, metrics_to_check: List[str]) -> Dict:
+    def condense_metrics(self, metrics_to_check: List[str], in_place: bool = False) -> Dict:
         """
         Checks if the value of metrics is the same, and removes redundant
         metrics while updating the duration. If there's a gap in the reported
         metrics then don't count that as part of duration.
+
+        With in_place, the raw metrics of each pod are replaced by its condensed
+        metrics as soon as the pod is condensed, reusing the dicts of the
+        samples that start an interval, so the raw samples are released pod by
+        pod instead of being copied. The processor can't be used afterwards.
         """
-        interval = self.interval_minutes * 60
         condensed_dict = {}
+        for namespace, pod, pod_dict in self._iter_condensed_pods(metrics_to_check, in_place):
+            condensed_dict.setdefault(namespace, {})[pod] = pod_dict
+        return condensed_dict
 
-        for namespace, pods in self.merged_data.items():
+    def iter_condensed_metrics(
+        self, metrics_to_check: List[str], consume: bool = False
+    ) -> Iterator[Tuple[str, str, CondensedInterval]]:
+        """
+        Condenses the metrics like condense_metrics, one pod at a time, and
+        yields (namespace, pod, interval) for each of its intervals in the same
+        order. With consume, the pods are condensed in place and removed once
+        their intervals have been yielded, so neither the raw nor the condensed
+        metrics are kept, and the processor can't be used afterwards.
+        """
+        for namespace, pod, pod_dict in self._iter_condensed_pods(metrics_to_check, consume):
+            class_name = pod_dict.get("label_nerc_mghpcc_org_class")
+            for start_time, metric_dict in pod_dict["metrics"].items():
+                yield namespace, pod, CondensedInterval(start_time, metric_dict, class_name)
+            if consume:
+                self._release_pod(namespace, pod)
+
+    def _iter_condensed_pods(self, metrics_to_check: List[str], in_place: bool) -> Iterator[Tuple[str, str, Dict]]:
+        """Yields the namespace, the pod and the condensed pod dict of each pod"""
+        interval = self.interval_minutes * 60
+        for namespace, pods in list(self.merged_data.items()):
+            for pod, pod_dict in list(pods.items()):
+                if in_place:
+                    self._condense_pod_in_place(pod_dict, metrics_to_check, interval)
+                    yield namespace, pod, pod_dict
+                else:
+                    yield namespace, pod, self._condense_pod(pod_dict, metrics_to_check, interval)
+
+    def _release_pod(self, namespace: str, pod: str) -> None:
+        """Removes a pod that has been condensed in place"""
+        pods = self.merged_data[namespace]
+        del pods[pod]
+        if not pods:
+            del self.merged_data[namespace]
+
+    def _condense_pod(
+        self, pod_dict: Dict, metrics_to_check: List[str], interval: int
+    ) -> Dict:
+        """Returns a copy of the pod dict with its metrics condensed"""
+        new_pod_dict = pod_dict.copy()
+        self._condense_pod_in_place(new_pod_dict, metrics_to_check, interval, copy=True)
+        return new_pod_dict
+
+    def _condense_pod_in_place(
+        self, pod_dict: Dict, metrics_to_check: List[str], interval: int, copy: bool = False
+    ) -> None:
+        """Replaces the metrics of the pod dict by its condensed metrics"""
+        if pod_dict.get("intervals"):
+            pod_dict["metrics"] = self._condense_intervals(
+                pod_dict, metrics_to_check, interval
+            )
+            del pod_dict["intervals"]
+        else:
+            pod_dict["metrics"] = self._condense_pod_metrics(
+                pod_dict["metrics"], metrics_to_check, interval, copy
+            )
 
-            condensed_dict.setdefault(namespace, {})
+    def _condense_pod_metrics(
+        self, metrics_dict: Dict, metrics_to_check: List[str], interval: int, copy: bool = True
+    ) -> Dict:
+        """
+        Condenses the samples of a pod, keyed by epoch time. Without copy, the
+        dicts of the samples that start an interval are reused.
+        """
+        new_metrics_dict = {}
+        epoch_times_list = sorted(metrics_dict.keys())
 
-            for pod, pod_dict in pods.items():
+        start_epoch_time = epoch_times_list[0]
 
-                metrics_dict = pod_dict["metrics"]
-                new_metrics_dict = {}
-                epoch_times_list = sorted(metrics_dict.keys())
+        start_metric_dict = metrics_dict[start_epoch_time]
+        if copy:
+            start_metric_dict = start_metric_dict.copy()
 
-                start_epoch_time = epoch_times_list[0]
+        for i in range(1, len(epoch_times_list)):
+            current_time = epoch_times_list[i]
+            previous_time = epoch_times_list[i - 1]
 
-                start_metric_dict = metrics_dict[start_epoch_time].copy()
+            metrics_changed = self._are_metrics_different(
+                metrics_dict[start_epoch_time],
+                metrics_dict[current_time],
+                metrics_to_check,
+            )
 
-                for i in range(1, len(epoch_times_list)):
-                    current_time = epoch_times_list[i]
-                    previous_time = epoch_times_list[i - 1]
+            pod_was_stopped = self._was_pod_stopped(
+                current_time=current_time,
+                previous_time=previous_time,
+                interval=interval,
+            )
 
-                    metrics_changed = self._are_metrics_different(
-                        metrics_dict[start_epoch_time],
-                        metrics_dict[current_time],
-                        metrics_to_check,
-                    )
+            if metrics_changed or pod_was_stopped:
+                duration = previous_time - start_epoch_time + interval
+                start_metric_dict["duration"] = duration
+                new_metrics_dict[start_epoch_time] = start_metric_dict
 
-                    pod_was_stopped = self._was_pod_stopped(
-                        current_time=current_time,
-                        previous_time=previous_time,
-                        interval=interval,
-                    )
+                # Reset start_epoch_time and start_metric_dict
+                start_epoch_time = current_time
+                start_metric_dict = metrics_dict[start_epoch_time]
+                if copy:
+                    start_metric_dict = start_metric_dict.copy()
 
-                    if metrics_changed or pod_was_stopped:
-                        duration = previous_time - start_epoch_time + interval
-                        start_metric_dict["duration"] = duration
-                        new_metrics_dict[start_epoch_time] = start_metric_dict
+        # Final block after the loop
+        duration = epoch_times_list[-1] - start_epoch_time + interval
+        start_metric_dict["duration"] = duration
+        new_metrics_dict[start_epoch_time] = start_metric_dict
 
-                        # Reset start_epoch_time and start_metric_dict
-                        start_epoch_time = current_time
-                        start_metric_dict = metrics_dict[start_epoch_time].copy()
+        return new_metrics_dict
 
-                # Final block after the loop
-                duration = epoch_times_list[-1] - start_epoch_time + interval
-                start_metric_dict["duration"] = duration
-                new_metrics_dict[start_epoch_time] = start_metric_dict
+    def _condense_intervals(
+        self, pod_dict: Dict, metrics_to_check: List[str], interval: int
+    ) -> Dict:
+        """
+        Condenses the intervals of a pod, together with any samples of the pod
+        which are treated as intervals of one step. The samples were merged
+        before any interval of the pod (later samples are merged as intervals),
+        so the intervals take precedence over them. The time is split at every
+        start and end of an interval, and consecutive pieces are joined while
+        the metrics are the same and there's no gap between them.
+        """
+        pieces = [
+            MetricInterval(epoch_time, epoch_time + interval, fields, -1)
+            for epoch_time, fields in pod_dict["metrics"].items()
+        ]
+        pieces.extend(pod_dict["intervals"])
+        pieces.sort(key=lambda piece: piece.start)
+        boundaries = sorted({piece.start for piece in pieces} | {piece.end for piece in pieces})
+
+        new_metrics_dict = {}
+        active = []
+        next_piece = 0
+        run_start = run_end = run_metric_dict = None
+
+        for piece_start, piece_end in zip(boundaries, boundaries[1:]):
+            active = [piece for piece in active if piece.end > piece_start]
+            while next_piece < len(pieces) and pieces[next_piece].start == piece_start:
+                active.append(pieces[next_piece])
+                next_piece += 1
+            if not active:
+                continue
 
-                # Update the pod dict with the condensed data
-                new_pod_dict = pod_dict.copy()
-                new_pod_dict["metrics"] = new_metrics_dict
-                condensed_dict[namespace][pod] = new_pod_dict
+            metric_dict = {}
+            for piece in sorted(active, key=lambda piece: (piece.seq, piece.start)):
+                metric_dict.update(piece.fields)
 
-        return condensed_dict
+            if (
+                run_metric_dict is not None
+                and run_end == piece_start
+                and not self._are_metrics_different(run_metric_dict, metric_dict, metrics_to_check)
+            ):
+                run_end = piece_end
+                continue
+
+            if run_metric_dict is not None:
+                run_metric_dict["duration"] = run_end - run_start
+                new_metrics_dict[run_start] = run_metric_dict
+            run_start, run_end, run_metric_dict = piece_start, piece_end, metric_dict
+
+        if run_metric_dict is not None:
+            run_metric_dict["duration"] = run_end - run_start
+            new_metrics_dict[run_start] = run_metric_dict
+        return new_metrics_dict
 
     @staticmethod
     def _are_metrics_different(
@@ -177,18 +477,50 @@ class MetricsProcessor:
         return (current_time - previous_time) > interval
 
     @staticmethod
-    def insert_node_labels(node_labels: list, resource_request_metrics: list) -> list:
-        """Inserts node labels into resource_request_metrics"""
+    def split_resource_requests(resource_request_metrics: Iterable, new_section=list) -> Tuple[list, list, list]:
+        """
+        Splits kube_pod_resource_request series into cpu (cores), memory (bytes)
+        and gpu (nvidia.com resources) request metrics.
+
+        Each section is created with new_section, which can be any container
+        with an append method (e.g. to spool the series to disk).
+        """
+        cpu_request_metrics = new_section()
+        memory_request_metrics = new_section()
+        gpu_request_metrics = new_section()
+        for metric in resource_request_metrics:
+            unit = metric["metric"].get("unit")
+            if unit == "cores":
+                cpu_request_metrics.append(metric)
+            elif unit == "bytes":
+                memory_request_metrics.append(metric)
+            if GPU_RESOURCE_PATTERN.fullmatch(metric["metric"].get("resource", "")):
+                gpu_request_metrics.append(metric)
+        return cpu_request_metrics, memory_request_metrics, gpu_request_metrics
+
+    @staticmethod
+    def insert_node_labels(node_labels: list, resource_request_metrics: Iterable) -> list:
+        """
+        Inserts node labels into resource_request_metrics, which can be
+        any iterable of metrics (e.g. a stream of series)
+        """
+        return list(MetricsProcessor.iter_with_node_labels(node_labels, resource_request_metrics))
+
+    @staticmethod
+    def iter_with_node_labels(node_labels: list, resource_request_metrics: Iterable) -> Iterator[Dict]:
+        """Like insert_node_labels, but inserts the labels into each metric as it's iterated"""
         node_label_dict = {}
         for node_label in node_labels:
             node = node_label["metric"]["node"]
             gpu = node_label["metric"].get("label_nvidia_com_gpu_product")
             machine = node_label["metric"].get("label_nvidia_com_gpu_machine")
             node_label_dict[node] = {"gpu": gpu, "machine": machine}
+
         for pod in resource_request_metrics:
             node = pod["metric"]["node"]
             if node not in node_label_dict:
                 logger.warning("Could not find labels for node: %s", node)
+                yield pod
                 continue
             pod["metric"]["label_nvidia_com_gpu_product"] = node_label_dict[node].get(
                 "gpu"
@@ -196,11 +528,19 @@ class MetricsProcessor:
             pod["metric"]["label_nvidia_com_gpu_machine"] = node_label_dict[node].get(
                 "machine"
             )
-        return resource_request_metrics
+            yield pod
 
     @staticmethod
-    def insert_pod_labels(pod_labels: list, resource_request_metrics: list) -> list:
-        """Inserts `label_nerc_mghpcc_org_class` label into resource_request_metrics"""
+    def insert_pod_labels(pod_labels: list, resource_request_metrics: Iterable) -> list:
+        """
+        Inserts `label_nerc_mghpcc_org_class` label into resource_request_metrics,
+        which can be any iterable of metrics (e.g. a stream of series)
+        """
+        return list(MetricsProcessor.iter_with_pod_labels(pod_labels, resource_request_metrics))
+
+    @staticmethod
+    def iter_with_pod_labels(pod_labels: list, resource_request_metrics: Iterable) -> Iterator[Dict]:
+        """Like insert_pod_labels, but inserts the label into each metric as it's iterated"""
         pod_label_dict = {}
         for pod_label in pod_labels:
             pod_name = pod_label["metric"]["pod"]
@@ -209,9 +549,8 @@ class MetricsProcessor:
 
         for pod in resource_request_metrics:
             pod_name = pod["metric"]["pod"]
-            if pod_name not in pod_label_dict:
-                continue
-            pod["metric"]["label_nerc_mghpcc_org_class"] = pod_label_dict[pod_name].get(
-                "class"
-            )
-        return resource_request_metrics
+            if pod_name in pod_label_dict:
+                pod["metric"]["label_nerc_mghpcc_org_class"] = pod_label_dict[pod_name].get(
+                    "class"
+                )
+            yield pod
@@ -0,0 +1,262 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+"""SQLite store of condensed metrics that can be queried by namespace and time"""
+
+import argparse
+import logging
+import os
+import sqlite3
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from openshift_metrics import utils
+from openshift_metrics.metrics_file import load_metrics_file
+from openshift_metrics.metrics_processor import CondensedInterval, MetricsProcessor
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+METRICS_TO_CHECK = ["cpu_request", "memory_request", "gpu_request", "gpu_type"]
+
+# Keys of a condensed metric dict that are stored, each in its own column
+METRIC_COLUMNS = (
+    "cpu_request",
+    "memory_request",
+    "gpu_request",
+    "gpu_type",
+    "gpu_resource",
+    "node",
+    "node_model",
+)
+
+# Metrics file sections and the metric they're merged as
+FILE_SECTIONS = {
+    "cpu_metrics": "cpu_request",
+    "memory_metrics": "memory_request",
+    "gpu_metrics": "gpu_request",
+}
+
+# Metric columns have no type, so values are returned as they were stored
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS intervals (
+    namespace TEXT NOT NULL,
+    pod TEXT NOT NULL,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER NOT NULL,
+    class_name TEXT,
+    {", ".join(METRIC_COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS intervals_by_namespace ON intervals (namespace, start_time);
+CREATE INDEX IF NOT EXISTS intervals_by_time ON intervals (start_time);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    start_date TEXT,
+    end_date TEXT
+);
+"""
+
+
+class MetricsStore:
+    """
+    Stores condensed intervals in an SQLite database, one row per interval
+    with its namespace, pod, start and end time, class label and metrics.
+
+    Intervals are added in bulk, from MetricsProcessor.iter_condensed_metrics
+    or from metrics files, and can then be queried by namespace and time
+    range without merging the metrics files again. The query results have
+    the shape of MetricsProcessor.condense_metrics, so they can be passed to
+    the write_metrics_by_* functions of utils.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_intervals(self, condensed_intervals: Iterable[Tuple[str, str, CondensedInterval]]) -> int:
+        """
+        Adds the (namespace, pod, interval) tuples of
+        MetricsProcessor.iter_condensed_metrics in a single transaction, and
+        returns how many intervals were added
+        """
+        with self._connection:
+            return self._insert_intervals(condensed_intervals)
+
+    def _insert_intervals(self, condensed_intervals: Iterable[Tuple[str, str, CondensedInterval]]) -> int:
+        """Inserts the intervals in the current transaction"""
+        placeholders = ", ".join("?" * (5 + len(METRIC_COLUMNS)))
+        cursor = self._connection.executemany(
+            f"INSERT INTO intervals VALUES ({placeholders})",
+            (self._interval_row(namespace, pod, interval) for namespace, pod, interval in condensed_intervals),
+        )
+        logger.info(f"Added {cursor.rowcount} intervals to {self.path}")
+        return cursor.rowcount
+
+    @staticmethod
+    def _interval_row(namespace: str, pod: str, interval: CondensedInterval) -> Tuple:
+        metrics = interval.metrics
+        values = []
+        for column in METRIC_COLUMNS:
+            value = metrics.get(column)
+            # sqlite can't store Decimals, and their string parses back to the same Decimal
+            values.append(str(value) if isinstance(value, Decimal) else value)
+        return (namespace, pod, interval.start, interval.start + metrics["duration"], interval.class_name, *values)
+
+    def ingest_files(self, files: List[str], interval_minutes: int = 15) -> int:
+        """
+        Merges and condenses the metrics files like merge.py and adds their
+        intervals. Files already in the store are skipped, whatever path they
+        are given by. The files ingested together are condensed together, so an
+        interval that spans files ingested separately is stored as one interval
+        per ingestion. Files with dates that overlap the dates of a file in the
+        store raise a ValueError, since their intervals would overlap.
+
+        The intervals and the files are added in a single transaction, so a
+        failed ingestion can be run again without adding intervals twice.
+        """
+        ingested = {path for path, in self._connection.execute("SELECT path FROM files")}
+        files = [file for file in map(os.path.realpath, files) if file not in ingested]
+        if not files:
+            return 0
+
+        processor = MetricsProcessor(interval_minutes, incremental=True)
+        file_rows = []
+        for file in files:
+            metrics_from_file = load_metrics_file(file)
+            start_date, end_date = metrics_from_file["start_date"], metrics_from_file["end_date"]
+            overlapping = self._connection.execute(
+                "SELECT path FROM files WHERE start_date <= ? AND end_date >= ? LIMIT 1", (end_date, start_date)
+            ).fetchone()
+            if overlapping:
+                raise ValueError(f"The dates of {file} overlap the dates of {overlapping[0]}, already in {self.path}")
+            for section, metric_name in FILE_SECTIONS.items():
+                if section in metrics_from_file:
+                    processor.merge_metrics(metric_name, metrics_from_file[section])
+            file_rows.append((file, start_date, end_date))
+
+        with self._connection:
+            count = self._insert_intervals(processor.iter_condensed_metrics(METRICS_TO_CHECK, consume=True))
+            self._connection.executemany("INSERT INTO files VALUES (?, ?, ?)", file_rows)
+        return count
+
+    def get_namespaces(self) -> List[str]:
+        """Returns the namespaces in the order they were first added"""
+        return [
+            namespace
+            for namespace, in self._connection.execute(
+                "SELECT namespace FROM intervals GROUP BY namespace ORDER BY MIN(rowid)"
+            )
+        ]
+
+    def get_date_range(self) -> Tuple[Optional[str], Optional[str]]:
+        """Returns the first start date and the last end date of the ingested files"""
+        return self._connection.execute("SELECT MIN(start_date), MAX(end_date) FROM files").fetchone()
+
+    def iter_intervals(
+        self,
+        namespaces: Optional[Iterable[str]] = None,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Iterator[Tuple[str, str, CondensedInterval]]:
+        """
+        Yields the (namespace, pod, interval) tuples of the namespaces that
+        overlap the [start, end) epoch time range, in the order they were
+        added. Intervals are clipped to the time range.
+        """
+        conditions = []
+        parameters = []
+        if namespaces is not None:
+            namespaces = list(namespaces)
+            if not namespaces:
+                return
+            conditions.append(f"namespace IN ({', '.join('?' * len(namespaces))})")
+            parameters.extend(namespaces)
+        if start is not None:
+            conditions.append("end_time > ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("start_time < ?")
+            parameters.append(end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        rows = self._connection.execute(
+            f"SELECT namespace, pod, start_time, end_time, class_name, {', '.join(METRIC_COLUMNS)} "
+            f"FROM intervals {where} ORDER BY rowid",
+            parameters,
+        )
+        for namespace, pod, interval_start, interval_end, class_name, *values in rows:
+            if start is not None:
+                interval_start = max(interval_start, start)
+            if end is not None:
+                interval_end = min(interval_end, end)
+            metrics = {column: value for column, value in zip(METRIC_COLUMNS, values) if value is not None}
+            metrics["duration"] = interval_end - interval_start
+            yield namespace, pod, CondensedInterval(interval_start, metrics, class_name)
+
+    def query(
+        self,
+        namespaces: Optional[Iterable[str]] = None,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Dict:
+        """
+        Returns the intervals of iter_intervals as a condensed metrics dict,
+        like MetricsProcessor.condense_metrics returns. Raises a ValueError if
+        two intervals of a pod start at the same time, rather than keep only one.
+        """
+        condensed_dict = {}
+        for namespace, pod, interval in self.iter_intervals(namespaces, start, end):
+            pod_dict = condensed_dict.setdefault(namespace, {}).setdefault(pod, {"metrics": {}})
+            if interval.start in pod_dict["metrics"]:
+                raise ValueError(f"Pod {namespace}/{pod} has overlapping intervals at {interval.start}")
+            pod_dict["metrics"][interval.start] = interval.metrics
+            if interval.class_name is not None:
+                pod_dict["label_nerc_mghpcc_org_class"] = interval.class_name
+        return condensed_dict
+
+
+def main():
+    """Ingests metrics files into a store, or writes the pod report of a query"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True, help="Path of the SQLite database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Add metrics files to the store")
+    ingest_parser.add_argument("files", nargs="+")
+
+    query_parser = subparsers.add_parser("query", help="Write the pod report of the stored intervals")
+    query_parser.add_argument("--namespace", action="append", dest="namespaces", help="Can be repeated")
+    query_parser.add_argument("--start", type=int, help="Epoch time of the start of the range")
+    query_parser.add_argument("--end", type=int, help="Epoch time of the end of the range")
+    query_parser.add_argument("--output-file", default="pod-report.csv")
+
+    args = parser.parse_args()
+    with MetricsStore(args.db) as store:
+        if args.command == "ingest":
+            store.ingest_files(args.files)
+        else:
+            utils.write_metrics_by_pod(store.query(args.namespaces, args.start, args.end), args.output_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,25 +14,224 @@
 """Collect and save metrics from prometheus"""
 
 import argparse
+import asyncio
 from datetime import datetime, timedelta
+import functools
 import os
 import sys
-import json
 import logging
 
+import requests
+
 from openshift_metrics import utils
-from openshift_metrics.prometheus_client import PrometheusClient
+from openshift_metrics.prometheus_client import PrometheusClient, ChangePointClient, values_to_intervals
+from openshift_metrics.query_cache import QueryCache
+from openshift_metrics.backfill import Backfill
 from openshift_metrics.metrics_processor import MetricsProcessor
+from openshift_metrics.metrics_file import (
+    COMPRESSION_EXTENSIONS,
+    METRICS_FILE_EXTENSIONS,
+    SeriesSpool,
+    get_metrics_file_extension,
+    get_metrics_writer,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-CPU_REQUEST = 'kube_pod_resource_request{unit="cores", node!=""} unless on(pod, namespace) kube_pod_status_unschedulable'
-MEMORY_REQUEST = 'kube_pod_resource_request{unit="bytes", node!=""} unless on(pod, namespace) kube_pod_status_unschedulable'
-GPU_REQUEST = 'kube_pod_resource_request{resource=~"nvidia.com.*", node!=""} unless on(pod, namespace) kube_pod_status_unschedulable'
+# CPU (cores), memory (bytes) and GPU requests are retrieved with a single query
+# so that the unless join is only evaluated once, and split up afterwards.
+RESOURCE_REQUEST = (
+    '(kube_pod_resource_request{unit=~"cores|bytes", node!=""} '
+    'or kube_pod_resource_request{resource=~"nvidia.com.*", node!=""}) '
+    'unless on(pod, namespace) kube_pod_status_unschedulable'
+)
 KUBE_NODE_LABELS = 'kube_node_labels{label_nvidia_com_gpu_product!=""}'
 KUBE_POD_LABELS = 'kube_pod_labels{label_nerc_mghpcc_org_class!=""}'
 
+# Resource requests with the pod class and node GPU labels joined by prometheus.
+# Pods and nodes without those labels are matched by the series from
+# kube_pod_labels/kube_node_labels without them, so that they aren't dropped.
+# At steps where a pod or node has no label series at all, the join has no
+# sample, so each join falls back to the requests it was joined from, like the
+# requests that are joined locally.
+POD_CLASS_LABELS = (
+    f'group by (namespace, pod, label_nerc_mghpcc_org_class) ({KUBE_POD_LABELS}) '
+    'or on(namespace, pod) group by (namespace, pod) (kube_pod_labels)'
+)
+NODE_GPU_LABELS = (
+    'group by (node, label_nvidia_com_gpu_product, label_nvidia_com_gpu_machine) '
+    f'({KUBE_NODE_LABELS}) '
+    'or on(node) group by (node) (kube_node_labels)'
+)
+RESOURCE_REQUEST_WITH_POD_LABELS = (
+    f'({RESOURCE_REQUEST}) '
+    f'* on(namespace, pod) group_left(label_nerc_mghpcc_org_class) ({POD_CLASS_LABELS}) '
+    f'or ignoring(label_nerc_mghpcc_org_class) ({RESOURCE_REQUEST})'
+)
+RESOURCE_REQUEST_WITH_LABELS = (
+    f'({RESOURCE_REQUEST_WITH_POD_LABELS}) '
+    '* on(node) group_left(label_nvidia_com_gpu_product, label_nvidia_com_gpu_machine) '
+    f'({NODE_GPU_LABELS}) '
+    'or ignoring(label_nvidia_com_gpu_product, label_nvidia_com_gpu_machine) '
+    f'({RESOURCE_REQUEST_WITH_POD_LABELS})'
+)
+
+
+async def collect_metrics_async(prom_client, report_start_date, report_end_date, write_section, server_side_joins=False):
+    """
+    Queries all the metrics for the period concurrently, and calls
+    write_section(name, series) for each section of the metrics dict as soon
+    as the queries it depends on have completed.
+
+    The series of a section are passed as an iterable that reads them back
+    from disk one at a time.
+    """
+    if server_side_joins:
+        try:
+            await _collect_requests_with_server_side_joins(
+                prom_client, report_start_date, report_end_date, write_section
+            )
+            return
+        except (
+            utils.EmptyResultError,
+            utils.QueryLimitError,
+            utils.PartialResponseError,
+            requests.RequestException,
+        ) as e:
+            logger.warning(f"Joining labels in prometheus failed ({e}), joining them locally instead")
+
+    await _collect_requests_with_client_side_joins(
+        prom_client, report_start_date, report_end_date, write_section
+    )
+
+
+async def _collect_requests_with_server_side_joins(prom_client, report_start_date, report_end_date, write_section):
+    """Queries the resource requests with the pod and node labels already joined by prometheus"""
+    cpu_request_metrics, memory_request_metrics, gpu_request_metrics = await asyncio.to_thread(
+        _query_resource_requests, prom_client, RESOURCE_REQUEST_WITH_LABELS, report_start_date, report_end_date
+    )
+
+    with cpu_request_metrics, memory_request_metrics, gpu_request_metrics:
+        await asyncio.to_thread(write_section, "cpu_metrics", cpu_request_metrics)
+        await asyncio.to_thread(write_section, "memory_metrics", memory_request_metrics)
+        if gpu_request_metrics:
+            await asyncio.to_thread(write_section, "gpu_metrics", gpu_request_metrics)
+        else:
+            logger.info(f"No GPU metrics found for the period {report_start_date} to {report_end_date}")
+
+
+async def _collect_requests_with_client_side_joins(prom_client, report_start_date, report_end_date, write_section):
+    """
+    Queries the resource requests and the pod and node labels at the same
+    time, and joins them as soon as both sides of a join have arrived.
+    """
+    # The node labels are queried before knowing whether there are GPU
+    # requests, it's a small query and this way it doesn't wait for the
+    # requests query.
+    pod_labels_task = asyncio.create_task(
+        asyncio.to_thread(_query_labels, prom_client, KUBE_POD_LABELS, report_start_date, report_end_date)
+    )
+    node_labels_task = asyncio.create_task(
+        asyncio.to_thread(_query_labels, prom_client, KUBE_NODE_LABELS, report_start_date, report_end_date)
+    )
+
+    try:
+        # The request metrics are streamed from prometheus, split as each
+        # series is parsed, and spooled to disk until they are written.
+        cpu_request_metrics, memory_request_metrics, gpu_request_metrics = await asyncio.to_thread(
+            _query_resource_requests, prom_client, RESOURCE_REQUEST, report_start_date, report_end_date
+        )
+
+        with cpu_request_metrics, memory_request_metrics, gpu_request_metrics:
+            await asyncio.to_thread(write_section, "memory_metrics", memory_request_metrics)
+
+            pod_labels = await pod_labels_task
+            if not pod_labels:
+                logger.info(f"No pod labels found for the period {report_start_date} to {report_end_date}")
+            await asyncio.to_thread(
+                write_section, "cpu_metrics", MetricsProcessor.iter_with_pod_labels(pod_labels, cpu_request_metrics)
+            )
+
+            # because if nobody requests a GPU then we will get an empty set
+            if gpu_request_metrics:
+                node_labels = await node_labels_task
+                if node_labels:
+                    await asyncio.to_thread(
+                        write_section,
+                        "gpu_metrics",
+                        MetricsProcessor.iter_with_node_labels(node_labels, gpu_request_metrics),
+                    )
+                else:
+                    logger.info(f"No GPU node labels found for the period {report_start_date} to {report_end_date}")
+            else:
+                logger.info(f"No GPU metrics found for the period {report_start_date} to {report_end_date}")
+    finally:
+        # the label queries can't be interrupted, but they shouldn't outlive the collection
+        await asyncio.gather(pod_labels_task, node_labels_task, return_exceptions=True)
+
+
+def _query_labels(prom_client, metric, report_start_date, report_end_date):
+    """Returns the label series of metric, or an empty list if there aren't any"""
+    try:
+        return prom_client.query_metric(metric, report_start_date, report_end_date)
+    except utils.EmptyResultError:
+        return []
+
+
+def _query_resource_requests(prom_client, metric, report_start_date, report_end_date):
+    """
+    Returns the cpu, memory and gpu requests spooled to disk, which must
+    include cpu and memory requests
+    """
+    sections = MetricsProcessor.split_resource_requests(
+        prom_client.iter_metric(metric, report_start_date, report_end_date), new_section=SeriesSpool
+    )
+    cpu_request_metrics, memory_request_metrics, _ = sections
+    try:
+        if not cpu_request_metrics:
+            raise utils.EmptyResultError("Error retrieving CPU requests")
+        if not memory_request_metrics:
+            raise utils.EmptyResultError("Error retrieving memory requests")
+    except utils.EmptyResultError:
+        for section in sections:
+            section.close()
+        raise
+    return sections
+
+
+def collect_metrics_to_file(
+    prom_client,
+    report_start_date,
+    report_end_date,
+    output_file,
+    server_side_joins=False,
+    output_format="json",
+    intervals_step_min=None,
+    compression=None,
+    write_index=True,
+):
+    """
+    Queries all the metrics for the period and writes each section to
+    output_file as it's collected. If intervals_step_min is given, the series
+    are written as [start, duration, value] intervals of that step. With
+    write_index, the index of the namespaces is written next to the file.
+    """
+    writer_class = get_metrics_writer(output_format)
+    with writer_class(output_file, report_start_date, report_end_date, compression, write_index) as writer:
+        if intervals_step_min is not None:
+            def write_section(name, series):
+                writer.write_section(name, (values_to_intervals(metric, intervals_step_min) for metric in series))
+        else:
+            write_section = writer.write_section
+
+        asyncio.run(
+            collect_metrics_async(
+                prom_client, report_start_date, report_end_date, write_section, server_side_joins
+            )
+        )
+
+
 def main():
     """This method kick starts the process of collecting and saving the metrics"""
 
@@ -57,6 +256,87 @@ def main():
         action="store_true"
     )
     parser.add_argument("--output-file")
+    parser.add_argument(
+        "--output-format",
+        choices=list(METRICS_FILE_EXTENSIONS),
+        default="json",
+        help="Write the metrics file as JSON or in the compact binary format",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=list(COMPRESSION_EXTENSIONS),
+        help="Compress the metrics file with gzip or zstd (which needs the zstandard package)",
+    )
+    parser.add_argument(
+        "--no-index",
+        action="store_false",
+        dest="write_index",
+        help="Don't write the index of the namespaces of the metrics file next to it",
+    )
+    parser.add_argument(
+        "--query-window-hours",
+        type=int,
+        default=24,
+        help="Split each query into windows of this many hours",
+    )
+    parser.add_argument(
+        "--query-workers",
+        type=int,
+        default=4,
+        help="Number of query windows to retrieve concurrently",
+    )
+    parser.add_argument(
+        "--min-query-window-minutes",
+        type=int,
+        help="Windows that exceed the limits of prometheus are split in half down to this size",
+    )
+    parser.add_argument(
+        "--namespace-shards",
+        type=int,
+        default=1,
+        help="Split windows that still exceed the limits of prometheus into this many queries by namespace",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Cache query results in this directory and reuse them in later runs",
+        default=os.getenv("OPENSHIFT_METRICS_CACHE_DIR"),
+    )
+    parser.add_argument(
+        "--cache-max-size-mb",
+        type=int,
+        help="Remove the least recently used query results when the cache grows past this size",
+    )
+    parser.add_argument(
+        "--server-side-joins",
+        action="store_true",
+        help="Join the pod and node labels to the requests in prometheus instead of locally",
+    )
+    parser.add_argument(
+        "--change-points",
+        action="store_true",
+        help="Only retrieve the samples where requests start, change or stop from prometheus",
+    )
+    parser.add_argument(
+        "--intervals",
+        action="store_true",
+        help="Write the series condensed into [start, duration, value] intervals instead of a sample every step",
+    )
+    parser.add_argument(
+        "--backfill-dir",
+        help="Write one metrics file per window in this directory and resume from its manifest",
+    )
+    parser.add_argument(
+        "--backfill-window-days",
+        type=int,
+        default=1,
+        help="Number of days in each backfill window",
+    )
+    parser.add_argument(
+        "--backfill-jobs",
+        type=int,
+        default=1,
+        help="Number of backfill windows to collect concurrently",
+    )
 
     args = parser.parse_args()
     if not args.openshift_url:
@@ -69,63 +349,81 @@ def main():
     report_length = (datetime.strptime(report_end_date, "%Y-%m-%d") - datetime.strptime(report_start_date, "%Y-%m-%d"))
     assert report_length.days >= 0, "report_start_date cannot be after report_end_date"
 
+    file_extension = get_metrics_file_extension(args.output_format, args.compression)
     if args.output_file:
         output_file = args.output_file
-    elif report_start_date == report_end_date:
-        output_file = f"metrics-{report_start_date}.json"
     else:
-        output_file = f"metrics-{report_start_date}-to-{report_end_date}.json"
+        output_file = utils.get_metrics_file_name(report_start_date, report_end_date, file_extension)
 
-    logger.info(f"Generating report starting {report_start_date} and ending {report_end_date} in {output_file}")
-
-    token = os.environ.get("OPENSHIFT_TOKEN")
-    prom_client = PrometheusClient(openshift_url, token)
+    if args.backfill_dir:
+        logger.info(f"Backfilling metrics starting {report_start_date} and ending {report_end_date} in {args.backfill_dir}")
+    else:
+        logger.info(f"Generating report starting {report_start_date} and ending {report_end_date} in {output_file}")
 
-    metrics_dict = {}
-    metrics_dict["start_date"] = report_start_date
-    metrics_dict["end_date"] = report_end_date
+    cache = None
+    if args.cache_dir:
+        max_size_bytes = args.cache_max_size_mb * 2**20 if args.cache_max_size_mb else None
+        cache = QueryCache(args.cache_dir, max_size_bytes)
 
-    cpu_request_metrics = prom_client.query_metric(
-        CPU_REQUEST, report_start_date, report_end_date
+    token = os.environ.get("OPENSHIFT_TOKEN")
+    prom_client = PrometheusClient(
+        openshift_url,
+        token,
+        window_hours=args.query_window_hours,
+        max_workers=args.query_workers,
+        cache=cache,
+        min_window_minutes=args.min_query_window_minutes,
+        namespace_shards=args.namespace_shards,
     )
 
-    try:
-        pod_labels = prom_client.query_metric(KUBE_POD_LABELS, report_start_date, report_end_date)
-        metrics_dict["cpu_metrics"] = MetricsProcessor.insert_pod_labels(pod_labels, cpu_request_metrics)
-    except utils.EmptyResultError:
-        logger.info(f"No pod labels found for the period {report_start_date} to {report_end_date}")
-        metrics_dict["cpu_metrics"] = cpu_request_metrics
-
-    memory_request_metrics = prom_client.query_metric(
-        MEMORY_REQUEST, report_start_date, report_end_date
+    # The metrics files still have a sample every step when only the change
+    # points are retrieved, unless they are written as intervals.
+    collection_client = prom_client
+    if args.change_points:
+        collection_client = ChangePointClient(prom_client, expand_intervals=not args.intervals)
+    collect_to_file = functools.partial(
+        collect_metrics_to_file,
+        server_side_joins=args.server_side_joins,
+        output_format=args.output_format,
+        intervals_step_min=prom_client.step_min if args.intervals else None,
+        compression=args.compression,
+        write_index=args.write_index,
     )
-    metrics_dict["memory_metrics"] = memory_request_metrics
 
-    # because if nobody requests a GPU then we will get an empty set
-    try:
-        gpu_request_metrics = prom_client.query_metric(
-            GPU_REQUEST, report_start_date, report_end_date
+    if args.backfill_dir:
+        bucket_name = None
+        if args.upload_to_s3:
+            bucket_name = os.environ.get("S3_METRICS_BUCKET", "openshift_metrics")
+        backfill = Backfill(
+            args.backfill_dir,
+            collect_to_file,
+            window_days=args.backfill_window_days,
+            max_jobs=args.backfill_jobs,
+            file_extension=file_extension,
         )
-        node_labels = prom_client.query_metric(KUBE_NODE_LABELS, report_start_date, report_end_date)
-        metrics_dict["gpu_metrics"] = MetricsProcessor.insert_node_labels(node_labels, gpu_request_metrics)
-    except utils.EmptyResultError:
-        logger.info(f"No GPU metrics found for the period {report_start_date} to {report_end_date}")
-        pass
-
-    month_year = datetime.strptime(report_start_date, "%Y-%m-%d").strftime("%Y-%m")
-
-    if report_start_date == report_end_date:
-        s3_location = f"data_{month_year}/metrics-{report_start_date}.json"
+        failed_windows = backfill.run(collection_client, report_start_date, report_end_date, bucket_name)
     else:
-        s3_location = f"data_{month_year}/metrics-{report_start_date}-to-{report_end_date}.json"
+        collect_to_file(collection_client, report_start_date, report_end_date, output_file)
 
-    with open(output_file, "w") as file:
-        logger.info(f"Writing metrics to {output_file}")
-        json.dump(metrics_dict, file)
+    stats = prom_client.connection_stats()
+    logger.info(
+        f"Made {stats['requests']} requests over {stats['connections']} connections "
+        f"({stats['reused']} reused), ending with a concurrency limit of {stats['concurrency_limit']}"
+    )
+    logger.info(
+        f"Received {stats['compressed_bytes']} bytes from prometheus, "
+        f"{stats['uncompressed_bytes']} bytes uncompressed"
+    )
+    prom_client.close()
 
-    if args.upload_to_s3:
+    if args.backfill_dir and failed_windows:
+        sys.exit(f"Backfill failed for {', '.join(failed_windows)}, run it again to resume")
+
+    if args.upload_to_s3 and not args.backfill_dir:
         bucket_name = os.environ.get("S3_METRICS_BUCKET", "openshift_metrics")
-        utils.upload_to_s3(output_file, bucket_name, s3_location)
+        utils.upload_metrics_file_to_s3(
+            output_file, bucket_name, utils.get_metrics_s3_location(report_start_date, report_end_date, file_extension)
+        )
 
 if __name__ == "__main__":
     main()
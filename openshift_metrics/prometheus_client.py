@@ -1,45 +1,655 @@
 import requests
 import time
 import logging
+import codecs
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, UTC
 
 from urllib3.util.retry import Retry
+from urllib3.util.request import ACCEPT_ENCODING
 from requests.adapters import HTTPAdapter
-from openshift_metrics.utils import EmptyResultError
+from openshift_metrics.utils import EmptyResultError, QueryLimitError, PartialResponseError
+from openshift_metrics.metrics_file import SeriesSpool
+from openshift_metrics.query_cache import QueryCache
+from openshift_metrics.concurrency import AdaptiveConcurrencyLimiter, parse_retry_after
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+RESULT_ARRAY_START = re.compile(r'"result"\s*:\s*\[')
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Errors returned by prometheus/thanos when a query needs too many resources,
+# these queries are split into smaller ones instead of being retried.
+QUERY_LIMIT_ERRORS = [
+    "exceeded maximum resolution",
+    "would load too many samples",
+    "too many samples",
+]
+# Partial responses are split at most this many times, since warnings that
+# aren't caused by the size of the query come back for every part.
+MAX_PARTIAL_RESPONSE_SPLITS = 2
+# Thanos returns partial responses with warnings unless this is false
+PARTIAL_RESPONSE = "false"
+NAMESPACE_FIRST_CHARACTERS = "0123456789abcdefghijklmnopqrstuvwxyz"
+# Metrics with a namespace label. When a query is split by namespace, the
+# namespace matcher of each shard is added to the selectors of these metrics
+# only, so other selectors (e.g. kube_node_labels) still match all their series.
+NAMESPACED_METRICS = ("kube_pod_resource_request", "kube_pod_labels")
+NAMESPACED_SELECTOR = re.compile(r"\b(" + "|".join(NAMESPACED_METRICS) + r")\b(?:\{([^}]*)\})?")
+
+# Samples of `query` where a series starts (it had no sample one step before),
+# changes value or ends (it had a sample one step before but doesn't anymore).
+# The value one step before is retrieved with a one point subquery.
+PREVIOUS_STEP_QUERY = "last_over_time(({query})[1m:{step_min}m] offset {step_min}m)"
+CHANGE_POINTS_QUERY = (
+    'label_replace(({query}) unless ' + PREVIOUS_STEP_QUERY + ', "change_point", "start", "", "") '
+    'or label_replace(({query}) != ' + PREVIOUS_STEP_QUERY + ', "change_point", "change", "", "") '
+    'or label_replace(' + PREVIOUS_STEP_QUERY + ' unless ({query}), "change_point", "end", "", "")'
+)
+
+
+class QueryRangeStream:
+    """
+    Incrementally parses a query_range response body and yields one series of
+    `data.result` at a time, so that neither the whole body nor the whole parsed
+    response are held in memory. Everything else in the response (status,
+    warnings) is available in `envelope` once all the series have been read.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.envelope = None
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._exhausted = False
+
+    def _read_more(self) -> bool:
+        """Appends the next chunk to the buffer, returns False at the end of the stream"""
+        if self._exhausted:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self._exhausted = True
+            self._buffer += self._text_decoder.decode(b"", final=True)
+            return False
+        if isinstance(chunk, bytes):
+            chunk = self._text_decoder.decode(chunk)
+        self._buffer += chunk
+        return True
+
+    def _read_all(self) -> str:
+        while self._read_more():
+            pass
+        return self._buffer
+
+    def __iter__(self):
+        decoder = json.JSONDecoder()
+
+        match = RESULT_ARRAY_START.search(self._buffer)
+        while match is None:
+            if not self._read_more():
+                # no result array, e.g. an error response
+                self.envelope = json.loads(self._buffer)
+                return
+            match = RESULT_ARRAY_START.search(self._buffer)
+
+        prefix = self._buffer[:match.end() - 1]
+        # position is where the next series starts in the buffer, the series
+        # before it are only trimmed when a chunk is read, not after each series
+        position = match.end()
+
+        while True:
+            while position < len(self._buffer) and self._buffer[position] in " \t\r\n,":
+                position += 1
+
+            if position == len(self._buffer):
+                self._buffer = ""
+                position = 0
+                if not self._read_more():
+                    raise ValueError("Response ended before the end of the result array")
+                continue
+
+            if self._buffer[position] == "]":
+                self._buffer = self._buffer[position + 1:]
+                self.envelope = json.loads(prefix + "[]" + self._read_all())
+                return
+
+            try:
+                series, end = decoder.raw_decode(self._buffer, position)
+            except json.JSONDecodeError:
+                # the series isn't complete yet
+                self._buffer = self._buffer[position:]
+                position = 0
+                if not self._read_more():
+                    raise
+                continue
+
+            yield series
+            position = end
+
+
 class PrometheusClient:
-    def __init__(self, prometheus_url: str, token: str, step_min: int=15):
+    def __init__(
+        self,
+        prometheus_url: str,
+        token: str,
+        step_min: int=15,
+        window_hours: int=24,
+        max_workers: int=4,
+        pool_size: int=None,
+        max_retries: int=3,
+        backoff_factor: float=1,
+        cache: QueryCache=None,
+        min_window_minutes: int=None,
+        namespace_shards: int=1,
+    ):
         self.prometheus_url = prometheus_url
         self.token = token
         self.step_min = step_min
+        self.window_hours = window_hours
+        self.max_workers = max_workers
+        self.cache = cache
+        self.min_window_minutes = min_window_minutes if min_window_minutes is not None else step_min
+        self.namespace_shards = namespace_shards
+        self.limiter = AdaptiveConcurrencyLimiter(max_workers)
+        self._transfer_lock = threading.Lock()
+        self._compressed_bytes = 0
+        self._uncompressed_bytes = 0
+        self.session = self._create_session(
+            pool_size if pool_size is not None else max_workers,
+            max_retries,
+            backoff_factor,
+        )
 
-    def query_metric(self, metric, start_date, end_date):
-        """Queries metric from the provided prometheus_url"""
-        data = None
-        headers = {"Authorization": f"Bearer {self.token}"}
-        day_url_vars = f"start={start_date}T00:00:00Z&end={end_date}T23:59:59Z"
-        url = f"{self.prometheus_url}/api/v1/query_range?query={metric}&{day_url_vars}&step={self.step_min}m"
+    def _create_session(self, pool_size, max_retries, backoff_factor):
+        """
+        Creates the session that is shared by every query so that connections
+        are kept alive and reused across queries and windows.
 
-        retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+        Throttled responses (429/503) aren't retried by the session, so that the
+        concurrency limiter sees them.
+        """
+        retries = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[500, 502, 504],
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=max(pool_size, 1),
+            max_retries=retries,
+        )
         session = requests.Session()
-        session.mount("https://", HTTPAdapter(max_retries=retries))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        # ask for every encoding urllib3 can decode (gzip and deflate, plus
+        # br and zstd when brotli and zstandard are installed)
+        session.headers.update({
+            "Authorization": f"Bearer {self.token}",
+            "Accept-Encoding": ACCEPT_ENCODING,
+        })
+        return session
 
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def connection_stats(self):
+        """
+        Returns the number of requests made, connections opened and connections
+        reused, the current concurrency limit and queue depth, and the bytes
+        of the responses as transferred and once decompressed
+        """
+        num_requests = 0
+        num_connections = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                num_requests += pool.num_requests
+                num_connections += pool.num_connections
+        return {
+            "requests": num_requests,
+            "connections": num_connections,
+            "reused": max(num_requests - num_connections, 0),
+            "concurrency_limit": self.limiter.limit,
+            "queue_depth": self.limiter.queue_depth,
+            "compressed_bytes": self._compressed_bytes,
+            "uncompressed_bytes": self._uncompressed_bytes,
+        }
+
+    def query_metric(self, metric, start_date, end_date):
+        """
+        Queries metric from the provided prometheus_url.
+
+        The range is split into windows of `window_hours` that are queried
+        concurrently, and the series from every window are stitched back
+        together by their label set.
+        """
         logger.info(f"Retrieving metric: {metric}")
 
-        for _ in range(3):
-            response = session.get(url, headers=headers, verify=True)
+        windows = self._get_windows(start_date, end_date)
+        if len(windows) == 1 or self.max_workers <= 1:
+            window_results = [self._query_window(metric, *window) for window in windows]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                window_results = list(
+                    executor.map(lambda window: self._query_window(metric, *window), windows)
+                )
+
+        if len(window_results) == 1:
+            data = window_results[0]
+        else:
+            data = self._stitch_windows(window_results)
+        if not data:
+            raise EmptyResultError(f"Error retrieving metric: {metric}")
+        return data
 
-            if response.status_code != 200:
-                print(f"{response.status_code} Response: {response.reason}")
+    def iter_metric(self, metric, start_date, end_date):
+        """
+        Queries metric like `query_metric`, but yields the series one at a time.
+        Windows are retrieved one after the other and a series that spans
+        multiple windows is yielded once per window.
+
+        The warnings of a partial response come after its series, so the series
+        of a window are spooled to disk as they are parsed and only yielded once
+        the whole response has been read. A partial response is discarded and
+        its window is split like in `query_metric`.
+        """
+        logger.info(f"Retrieving metric: {metric}")
+
+        found_data = False
+        for window in self._get_windows(start_date, end_date):
+            if self.cache is not None:
+                window_series = self._query_window(metric, *window)
             else:
-                data = response.json()["data"]["result"]
-                if data:
-                    break
-                logger.warning("Empty result set")
-            time.sleep(3)
+                window_series = self._stream_window(metric, *window)
+            for series in window_series:
+                found_data = True
+                yield series
 
-        if not data:
+        if not found_data:
             raise EmptyResultError(f"Error retrieving metric: {metric}")
+
+    def _query_window(self, metric, start_time, end_time, sharded=False, partial_splits=0):
+        """
+        Runs a query_range request for a single window, returns [] if there's no data.
+        Windows that are in the cache aren't requested again.
+
+        If the query exceeds the limits of prometheus or it returns a partial
+        response, the window is split in half and each half is queried separately.
+        `partial_splits` is the number of times the window was already split
+        because of a partial response.
+        """
+        if self.cache is not None:
+            data = self.cache.get(self._cache_source(), metric, self.step_min, start_time, end_time)
+            if data is not None:
+                logger.debug(f"Using cached window {start_time} to {end_time}")
+                return data
+
+        try:
+            data = list(self._iter_window(metric, start_time, end_time))
+        except (QueryLimitError, PartialResponseError) as e:
+            parts = self._split_window(metric, start_time, end_time, sharded, partial_splits, e)
+            data = self._stitch_windows([self._query_window(*part) for part in parts])
+
+        if self.cache is not None:
+            self.cache.put(self._cache_source(), metric, self.step_min, start_time, end_time, data)
         return data
+
+    def _stream_window(self, metric, start_time, end_time, sharded=False, partial_splits=0):
+        """
+        Streams the series of a single window through a spool, and yields them
+        once the response is complete. Windows are split like in `_query_window`.
+        """
+        with SeriesSpool() as spool:
+            try:
+                for series in self._iter_window(metric, start_time, end_time):
+                    spool.append(series)
+            except (QueryLimitError, PartialResponseError) as e:
+                parts = self._split_window(metric, start_time, end_time, sharded, partial_splits, e)
+            else:
+                yield from spool
+                return
+
+        for part in parts:
+            yield from self._stream_window(*part)
+
+    def _cache_source(self):
+        """The endpoint and the parameters other than the window that the cached results depend on"""
+        return f"{self.prometheus_url}/api/v1/query_range?partial_response={PARTIAL_RESPONSE}"
+
+    def _iter_window(self, metric, start_time, end_time):
+        """Streams the series of a query_range request for a single window"""
+        url_vars = f"start={self._format_time(start_time)}&end={self._format_time(end_time)}"
+        url = (
+            f"{self.prometheus_url}/api/v1/query_range?query={metric}&{url_vars}"
+            f"&step={self.step_min}m&partial_response={PARTIAL_RESPONSE}"
+        )
+
+        logger.debug(f"Retrieving window {url_vars}")
+        return self._iter_request(url, metric)
+
+    def _split_window(self, metric, start_time, end_time, sharded, partial_splits, error):
+        """
+        Splits a window that prometheus couldn't answer in half, down to
+        `min_window_minutes`. Past that, the query is split by namespace if
+        `namespace_shards` is more than 1. Returns the (metric, start_time,
+        end_time, sharded, partial_splits) arguments of each part.
+
+        A partial response is split at most MAX_PARTIAL_RESPONSE_SPLITS times.
+        """
+        if isinstance(error, PartialResponseError):
+            if partial_splits >= MAX_PARTIAL_RESPONSE_SPLITS:
+                raise error
+            partial_splits += 1
+
+        step = self.step_min * 60
+        min_window = max((self.min_window_minutes * 60 // step) * step, step)
+        num_steps = (end_time - start_time) // step + 1
+
+        if (num_steps // 2) * step >= min_window:
+            middle_time = start_time + (num_steps // 2) * step
+            logger.warning(f"Splitting window {start_time} to {end_time} of {metric}: {error}")
+            return [
+                (metric, start_time, middle_time - 1, sharded, partial_splits),
+                (metric, middle_time, end_time, sharded, partial_splits),
+            ]
+
+        if self.namespace_shards > 1 and not sharded:
+            shard_queries = [self._shard_query(metric, pattern) for pattern in self._namespace_shard_patterns()]
+            if None not in shard_queries:
+                logger.warning(f"Splitting window {start_time} to {end_time} of {metric} by namespace: {error}")
+                return [(shard_query, start_time, end_time, True, partial_splits) for shard_query in shard_queries]
+            logger.warning(f"Can't split {metric} by namespace, it has no selector of {NAMESPACED_METRICS}")
+
+        raise error
+
+    def _namespace_shard_patterns(self):
+        """Splits the characters that namespaces start with into namespace_shards regexes"""
+        shard_size = -(-len(NAMESPACE_FIRST_CHARACTERS) // self.namespace_shards)
+        return [
+            f"[{NAMESPACE_FIRST_CHARACTERS[i:i + shard_size]}].*"
+            for i in range(0, len(NAMESPACE_FIRST_CHARACTERS), shard_size)
+        ]
+
+    @staticmethod
+    def _shard_query(metric, pattern):
+        """
+        Adds a namespace matcher to the selectors of NAMESPACED_METRICS in the
+        query. Returns None if the query has none of them, since each shard
+        would then return the same series.
+        """
+        def add_matcher(match):
+            labels = (match.group(2) or "").strip()
+            matchers = f'namespace=~"{pattern}"' + (f", {labels}" if labels else "")
+            return f"{match.group(1)}{{{matchers}}}"
+
+        sharded_metric, count = NAMESPACED_SELECTOR.subn(add_matcher, metric)
+        return sharded_metric if count else None
+
+    def query_instant(self, metric, epoch_time):
+        """Queries the value of metric at epoch_time, returns [] if there's no data"""
+        url = f"{self.prometheus_url}/api/v1/query?query={metric}&time={self._format_time(epoch_time)}"
+        return list(self._iter_request(url, metric))
+
+    def _iter_request(self, url, metric):
+        """Sends a query request, retrying failed and empty responses, and streams its series"""
+        for _ in range(3):
+            self.limiter.acquire()
+            request_start = time.monotonic()
+            # the latency is the time to the headers, but the slot is held until
+            # the body has been read or the stream is closed
+            outcome = {}
+            try:
+                response = self.session.get(url, verify=True, stream=True)
+                throttled = response.status_code in (429, 503)
+                outcome = {
+                    "latency": time.monotonic() - request_start,
+                    "throttled": throttled,
+                    "retry_after": parse_retry_after(response.headers.get("Retry-After")) if throttled else None,
+                }
+
+                if throttled:
+                    # the limiter waits before the next request is sent
+                    print(f"{response.status_code} Response: {response.reason}")
+                    continue
+                elif response.status_code != 200:
+                    print(f"{response.status_code} Response: {response.reason}")
+                    error = self._get_error(response)
+                    if any(limit_error in error for limit_error in QUERY_LIMIT_ERRORS):
+                        raise QueryLimitError(error)
+                else:
+                    found_data = False
+                    chunks = self._count_uncompressed_bytes(response.iter_content(chunk_size=STREAM_CHUNK_SIZE))
+                    stream = QueryRangeStream(chunks)
+                    try:
+                        for series in stream:
+                            found_data = True
+                            yield series
+                    finally:
+                        with self._transfer_lock:
+                            # bytes read from the connection, before they were decoded
+                            self._compressed_bytes += response.raw.tell()
+                        response.close()
+                    if stream.envelope.get("warnings"):
+                        raise PartialResponseError("; ".join(stream.envelope["warnings"]))
+                    if found_data:
+                        return
+                    logger.warning("Empty result set")
+            finally:
+                self.limiter.release(**outcome)
+            time.sleep(3)
+
+        if response.status_code != 200:
+            raise EmptyResultError(f"Error retrieving metric: {metric}")
+
+    def _count_uncompressed_bytes(self, chunks):
+        for chunk in chunks:
+            with self._transfer_lock:
+                self._uncompressed_bytes += len(chunk)
+            yield chunk
+
+    @staticmethod
+    def _get_error(response) -> str:
+        """Returns the error message from a failed response"""
+        try:
+            error = response.json()["error"]
+        except Exception:
+            return ""
+        return error if isinstance(error, str) else ""
+
+    def query_metric_intervals(self, metric, start_date, end_date):
+        """
+        Queries metric like `query_metric`, but instead of a sample every step only
+        retrieves the samples where each series starts, changes value or stops.
+
+        Returns the series with "intervals" of [start, duration, value] instead of
+        "values", which are the same intervals that condensing the samples of each
+        series would produce.
+        """
+        step = self.step_min * 60
+        range_start, range_end = self._get_range(start_date, end_date)
+        last_step = range_start + (range_end - range_start) // step * step
+
+        change_points = []
+        try:
+            change_points = self.query_metric(
+                CHANGE_POINTS_QUERY.format(query=metric, step_min=self.step_min), start_date, end_date
+            )
+        except EmptyResultError:
+            pass
+        initial_series = self.query_instant(metric, range_start)
+
+        if not change_points and not initial_series:
+            raise EmptyResultError(f"Error retrieving metric: {metric}")
+
+        return self._change_points_to_intervals(
+            initial_series, change_points, range_start, last_step, step
+        )
+
+    @staticmethod
+    def _change_points_to_intervals(initial_series, change_points, range_start, last_step, step):
+        """
+        Rebuilds the intervals of every series from their value at the start of
+        the range and the samples where they start, change or stop.
+        """
+        def series_key(labels):
+            return tuple(
+                sorted(
+                    (key, value) for key, value in labels.items()
+                    if key not in ("__name__", "change_point")
+                )
+            )
+
+        events_by_series = {}
+        for series in initial_series:
+            key = series_key(series["metric"])
+            events_by_series.setdefault(key, []).append((range_start, "start", series["value"][1]))
+        for series in change_points:
+            key = series_key(series["metric"])
+            change_point = series["metric"]["change_point"]
+            events = events_by_series.setdefault(key, [])
+            for epoch_time, value in series["values"]:
+                events.append((epoch_time, change_point, value))
+
+        result = []
+        for key, events in events_by_series.items():
+            intervals = []
+            start_time = None
+            start_value = None
+            for epoch_time, change_point, value in sorted(events, key=lambda event: event[0]):
+                if change_point == "start":
+                    # series that started at the start of the range are also in initial_series
+                    if start_time is None:
+                        start_time, start_value = epoch_time, value
+                elif change_point == "change":
+                    if start_time is not None and epoch_time > start_time:
+                        intervals.append([start_time, epoch_time - start_time, start_value])
+                    start_time, start_value = epoch_time, value
+                elif start_time is not None:
+                    # "end" is reported one step after the last sample of the series
+                    intervals.append([start_time, epoch_time - start_time, start_value])
+                    start_time = None
+
+            if start_time is not None:
+                intervals.append([start_time, last_step + step - start_time, start_value])
+            if intervals:
+                result.append({"metric": dict(key), "intervals": intervals})
+        return result
+
+    def _get_windows(self, start_date, end_date):
+        """
+        Splits the days from start_date to end_date (inclusive) into windows of
+        epoch times. Each window is a multiple of the step so that the samples
+        returned are the same as the ones from a single query over the whole range.
+
+        Windows are aligned to multiples of the window size since the epoch,
+        shifted onto the steps of the range, so that overlapping ranges with
+        the same steps are split into the same windows.
+        """
+        step = self.step_min * 60
+        window_size = max(step, (self.window_hours * 3600 // step) * step)
+        range_start, range_end = self._get_range(start_date, end_date)
+        offset = range_start % step
+
+        windows = []
+        window_start = range_start
+        while window_start <= range_end:
+            window_end = ((window_start - offset) // window_size + 1) * window_size + offset - 1
+            windows.append((window_start, min(window_end, range_end)))
+            window_start = window_end + 1
+        return windows
+
+    @staticmethod
+    def _get_range(start_date, end_date):
+        """Returns the epoch times of the start of start_date and the end of end_date"""
+        range_start = int(datetime.strptime(start_date, "%Y-%m-%d").replace(tzinfo=UTC).timestamp())
+        range_end = int(
+            (datetime.strptime(end_date, "%Y-%m-%d").replace(tzinfo=UTC) + timedelta(days=1)).timestamp()
+        ) - 1
+        return range_start, range_end
+
+    @staticmethod
+    def _format_time(epoch_time: int) -> str:
+        return datetime.fromtimestamp(epoch_time, UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    @staticmethod
+    def _stitch_windows(window_results):
+        """Joins the values of series with the same labels across windows"""
+        series_by_labels = {}
+        for result in window_results:
+            for series in result:
+                labels = tuple(sorted(series["metric"].items()))
+                if labels in series_by_labels:
+                    series_by_labels[labels]["values"].extend(series["values"])
+                else:
+                    series_by_labels[labels] = series
+        return list(series_by_labels.values())
+
+
+def intervals_to_values(series, step_min):
+    """Expands the [start, duration, value] intervals of series into a sample every step"""
+    step = step_min * 60
+    values = []
+    for start_time, duration, value in series["intervals"]:
+        values.extend([epoch_time, value] for epoch_time in range(start_time, start_time + duration, step))
+    return {"metric": series["metric"], "values": values}
+
+
+def values_to_intervals(series, step_min):
+    """
+    Condenses the samples of series into [start, duration, value] intervals.
+    An interval ends when the value changes or when there's a gap of more
+    than a step between samples, like in MetricsProcessor.condense_metrics.
+    """
+    if "intervals" in series:
+        return series
+    step = step_min * 60
+    intervals = []
+    for epoch_time, value in series["values"]:
+        if intervals:
+            interval = intervals[-1]
+            previous_time = interval[0] + interval[1] - step
+            if value == interval[2] and epoch_time - previous_time <= step:
+                interval[1] = epoch_time - interval[0] + step
+                continue
+        intervals.append([epoch_time, step, value])
+    return {"metric": series["metric"], "intervals": intervals}
+
+
+class ChangePointClient:
+    """
+    Wraps a PrometheusClient so that queries only retrieve the samples where
+    series start, change or stop. The series are returned with a sample every
+    step like the ones from PrometheusClient, or as their [start, duration, value]
+    intervals if expand_intervals is False.
+    """
+
+    def __init__(self, prom_client: PrometheusClient, expand_intervals: bool = True):
+        self.prom_client = prom_client
+        self.expand_intervals = expand_intervals
+
+    def _series(self, series):
+        if self.expand_intervals:
+            return intervals_to_values(series, self.prom_client.step_min)
+        return series
+
+    def query_metric(self, metric, start_date, end_date):
+        return [
+            self._series(series)
+            for series in self.prom_client.query_metric_intervals(metric, start_date, end_date)
+        ]
+
+    def iter_metric(self, metric, start_date, end_date):
+        for series in self.prom_client.query_metric_intervals(metric, start_date, end_date):
+            yield self._series(series)
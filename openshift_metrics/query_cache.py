@@ -0,0 +1,163 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+"""On-disk cache for the results of prometheus queries"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import List, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Windows that ended recently may still be missing samples, so they aren't cached
+CACHE_MIN_AGE_SECONDS = 3600
+
+
+class QueryCache:
+    """
+    Stores the result of a query for a window of time, keyed by the source of
+    the results (the prometheus endpoint and the request parameters that
+    change them), the query, the step and the start and end of the window.
+
+    Each source and each query of a source get their own directory, so that
+    a query can be invalidated on its own. When the cache grows past
+    `max_size_bytes`, the least recently used windows are removed.
+    """
+
+    def __init__(self, cache_dir: str, max_size_bytes: Optional[int] = None):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _dir_name(key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _path(self, source: str, query: str, step_min: int, start_time: int, end_time: int) -> str:
+        return os.path.join(
+            self.cache_dir,
+            self._dir_name(source),
+            self._dir_name(query),
+            f"{step_min}m-{start_time}-{end_time}.json",
+        )
+
+    def get(self, source: str, query: str, step_min: int, start_time: int, end_time: int) -> Optional[List]:
+        """Returns the cached series for the window, or None if it isn't cached"""
+        path = self._path(source, query, step_min, start_time, end_time)
+        try:
+            with open(path, "r") as file:
+                series = json.load(file)["result"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another client since it was read
+            pass
+        return series
+
+    def put(self, source: str, query: str, step_min: int, start_time: int, end_time: int, series: List) -> None:
+        """Caches the series for the window if the window is old enough to be complete"""
+        if not series or end_time > time.time() - CACHE_MIN_AGE_SECONDS:
+            return
+
+        path = self._path(source, query, step_min, start_time, end_time)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            json.dump({"source": source, "query": query, "step": step_min, "result": series}, file)
+        os.replace(tmp_path, path)
+
+        if self.max_size_bytes is not None:
+            self.evict(self.max_size_bytes)
+
+    def _query_dirs(self, query: Optional[str] = None):
+        """Yields the directories of query for every source, or of every query"""
+        for source_dir in os.scandir(self.cache_dir):
+            if not source_dir.is_dir():
+                continue
+            for query_dir in os.scandir(source_dir.path):
+                if query_dir.is_dir() and (query is None or query_dir.name == self._dir_name(query)):
+                    yield query_dir
+
+    def _entries(self):
+        for query_dir in self._query_dirs():
+            for entry in os.scandir(query_dir.path):
+                if entry.name.endswith(".json"):
+                    yield entry
+
+    def size(self) -> int:
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def evict(self, max_size_bytes: int) -> None:
+        """Removes the least recently used windows until the cache fits in max_size_bytes"""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+            total_size = sum(entry.stat().st_size for entry in entries)
+            for entry in entries:
+                if total_size <= max_size_bytes:
+                    break
+                total_size -= entry.stat().st_size
+                os.remove(entry.path)
+                logger.debug(f"Evicted {entry.path} from the query cache")
+
+    def invalidate(self, query: Optional[str] = None) -> None:
+        """
+        Removes every cached window of query for every source, or the whole
+        cache if no query is given
+        """
+        if query is not None:
+            for query_dir in list(self._query_dirs(query)):
+                shutil.rmtree(query_dir.path, ignore_errors=True)
+            return
+        for query_dir in os.scandir(self.cache_dir):
+            if query_dir.is_dir():
+                shutil.rmtree(query_dir.path, ignore_errors=True)
+
+
+def main():
+    """Invalidates the query cache"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory of the query cache",
+        default=os.getenv("OPENSHIFT_METRICS_CACHE_DIR"),
+    )
+    parser.add_argument(
+        "--query",
+        help="Only invalidate the cached results of this query",
+    )
+    args = parser.parse_args()
+    if not args.cache_dir:
+        parser.error("Must specify --cache-dir or set OPENSHIFT_METRICS_CACHE_DIR in your environment")
+
+    cache = QueryCache(args.cache_dir)
+    cache.invalidate(args.query)
+    if args.query:
+        logger.info(f"Invalidated cached results of {args.query} in {args.cache_dir}")
+    else:
+        logger.info(f"Invalidated all cached results in {args.cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
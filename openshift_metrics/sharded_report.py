@@ -0,0 +1,122 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+"""Condensing of metrics and generation of the reports in parallel by namespace"""
+
+import logging
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from openshift_metrics import utils
+from openshift_metrics.metrics_processor import MetricsProcessor
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# The rows of each report for a namespace
+ReportRows = namedtuple("ReportRows", ["invoice", "classes", "pod"])
+
+
+def shard_namespaces(namespaces: List[str], num_shards: int) -> List[List[str]]:
+    """Splits the namespaces into shards by a hash of their name that is stable across processes"""
+    shards = [[] for _ in range(num_shards)]
+    for namespace in namespaces:
+        shards[zlib.crc32(namespace.encode()) % num_shards].append(namespace)
+    return shards
+
+
+def _report_shard(
+    processor: MetricsProcessor,
+    metrics_to_check: List[str],
+    report_month: str,
+    rates,
+    namespace_annotations: Dict,
+    namespaces_with_classes: List[str],
+    ignore_hours=None,
+) -> Dict[str, ReportRows]:
+    """Condenses the metrics of a shard of namespaces and returns the report rows of each namespace"""
+    condensed_metrics_dict = processor.condense_metrics(metrics_to_check)
+
+    rows_by_namespace = {}
+    for namespace, pods in condensed_metrics_dict.items():
+        namespace_dict = {namespace: pods}
+        rows_by_namespace[namespace] = ReportRows(
+            invoice=utils.get_invoice_rows_by_namespace(
+                namespace_dict, report_month, rates, namespace_annotations, ignore_hours
+            ),
+            classes=utils.get_invoice_rows_by_classes(
+                namespace_dict, report_month, rates, namespaces_with_classes, ignore_hours
+            ),
+            pod=utils.get_pod_rows(namespace_dict, ignore_hours),
+        )
+    return rows_by_namespace
+
+
+def write_reports(
+    processor: MetricsProcessor,
+    jobs: int,
+    metrics_to_check: List[str],
+    invoice_file: str,
+    classes_invoice_file: str,
+    pod_report_file: str,
+    report_month: str,
+    rates,
+    namespaces_with_classes: List[str],
+    ignore_hours=None,
+) -> None:
+    """
+    Condenses the merged metrics of processor and writes the invoice, the
+    invoice by classes and the pod report, like write_metrics_by_namespace,
+    write_metrics_by_classes and write_metrics_by_pod.
+
+    Namespaces are independent, so they are split into a shard per job that
+    is condensed and aggregated in its own process. The rows are then written
+    in the order of the namespaces, so the reports are the same as when
+    they're generated in a single process.
+    """
+    namespace_annotations = utils.get_namespace_attributes()
+    namespaces = processor.get_namespaces()
+    shards = shard_namespaces(namespaces, jobs)
+
+    rows_by_namespace = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(
+                _report_shard,
+                processor.select_namespaces(shard),
+                metrics_to_check,
+                report_month,
+                rates,
+                namespace_annotations,
+                namespaces_with_classes,
+                ignore_hours,
+            )
+            for shard in shards
+            if shard
+        ]
+        for future in futures:
+            rows_by_namespace.update(future.result())
+
+    invoice_rows = [utils.INVOICE_HEADERS]
+    classes_rows = [utils.INVOICE_HEADERS]
+    pod_rows = [utils.POD_REPORT_HEADERS]
+    for namespace in namespaces:
+        invoice_rows.extend(rows_by_namespace[namespace].invoice)
+        classes_rows.extend(rows_by_namespace[namespace].classes)
+        pod_rows.extend(rows_by_namespace[namespace].pod)
+
+    utils.csv_writer(invoice_rows, invoice_file)
+    utils.csv_writer(classes_rows, classes_invoice_file)
+    utils.csv_writer(pod_rows, pod_report_file)
@@ -0,0 +1,138 @@
+import json
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from openshift_metrics.backfill import Backfill
+from openshift_metrics.metrics_file import MetricsWriter, get_index_file_name, load_metrics_file
+from openshift_metrics.utils import EmptyResultError
+
+
+def collect_to_file(prom_client, start_date, end_date, output_file):
+    metrics_dict = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "cpu_metrics": prom_client.query_metric("cpu", start_date, end_date),
+        "memory_metrics": list(prom_client.iter_metric("memory", start_date, end_date)),
+    }
+    try:
+        metrics_dict["gpu_metrics"] = prom_client.query_metric("gpu", start_date, end_date)
+    except EmptyResultError:
+        pass
+    with open(output_file, "w") as file:
+        json.dump(metrics_dict, file)
+
+
+class TestBackfill(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_windows(self):
+        backfill = Backfill(self.tmp_dir.name, collect_to_file, window_days=3)
+        self.assertEqual(
+            backfill.get_windows("2024-02-27", "2024-03-05"),
+            [
+                ("2024-02-27", "2024-02-29"),
+                ("2024-03-01", "2024-03-03"),
+                ("2024-03-04", "2024-03-05"),
+            ],
+        )
+
+    def test_resume_after_failure(self):
+        def query_metric(metric, start_date, end_date):
+            if metric == "gpu":
+                raise EmptyResultError()
+            return [metric]
+
+        prom_client = mock.Mock()
+        prom_client.query_metric.side_effect = query_metric
+        prom_client.iter_metric.side_effect = [
+            ConnectionError,
+            iter(["memory"]),
+            iter(["memory"]),
+        ]
+
+        backfill = Backfill(self.tmp_dir.name, collect_to_file, max_jobs=2)
+        failed_windows = backfill.run(prom_client, "2024-03-01", "2024-03-02")
+        self.assertEqual(len(failed_windows), 1)
+        self.assertEqual(prom_client.query_metric.call_count, 3)
+
+        backfill = Backfill(self.tmp_dir.name, collect_to_file, max_jobs=2)
+        self.assertEqual(backfill.run(prom_client, "2024-03-01", "2024-03-02"), [])
+        # only the queries of the window that failed are run again
+        self.assertEqual(prom_client.query_metric.call_count, 4)
+        self.assertEqual(prom_client.iter_metric.call_count, 3)
+
+        for day in ["2024-03-01", "2024-03-02"]:
+            with open(os.path.join(self.tmp_dir.name, f"metrics-{day}.json")) as file:
+                self.assertEqual(
+                    json.load(file),
+                    {
+                        "start_date": day,
+                        "end_date": day,
+                        "cpu_metrics": ["cpu"],
+                        "memory_metrics": ["memory"],
+                    },
+                )
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, "checkpoints", "2024-03-01_2024-03-01")))
+
+        # everything is done, so nothing is queried
+        Backfill(self.tmp_dir.name, collect_to_file).run(prom_client, "2024-03-01", "2024-03-02")
+        self.assertEqual(prom_client.query_metric.call_count, 4)
+
+    def test_empty_result_is_queried_again(self):
+        # the first cpu query fails after its retries, which raises EmptyResultError too
+        prom_client = mock.Mock()
+        prom_client.query_metric.side_effect = [EmptyResultError(), ["cpu"], EmptyResultError()]
+        prom_client.iter_metric.side_effect = lambda *args: iter(["memory"])
+
+        backfill = Backfill(self.tmp_dir.name, collect_to_file)
+        self.assertEqual(backfill.run(prom_client, "2024-03-01", "2024-03-01"), ["2024-03-01/2024-03-01"])
+        self.assertFalse(backfill.manifest.is_query_done("2024-03-01/2024-03-01", "cpu"))
+
+        backfill = Backfill(self.tmp_dir.name, collect_to_file)
+        self.assertEqual(backfill.run(prom_client, "2024-03-01", "2024-03-01"), [])
+        self.assertEqual(prom_client.query_metric.call_count, 3)
+        with open(os.path.join(self.tmp_dir.name, "metrics-2024-03-01.json")) as file:
+            self.assertEqual(json.load(file)["cpu_metrics"], ["cpu"])
+
+    @mock.patch("openshift_metrics.utils.upload_to_s3")
+    def test_upload(self, mock_upload):
+        prom_client = mock.Mock()
+        prom_client.query_metric.return_value = ["data"]
+        prom_client.iter_metric.side_effect = lambda *args: iter(["data"])
+
+        backfill = Backfill(self.tmp_dir.name, collect_to_file)
+        backfill.run(prom_client, "2024-03-01", "2024-03-01", "bucket")
+        backfill.run(prom_client, "2024-03-01", "2024-03-01", "bucket")
+        mock_upload.assert_called_once_with(
+            os.path.join(self.tmp_dir.name, "metrics-2024-03-01.json"),
+            "bucket",
+            "data_2024-03/metrics-2024-03-01.json",
+        )
+
+    @mock.patch("openshift_metrics.utils.upload_to_s3")
+    def test_index_is_moved_and_uploaded(self, mock_upload):
+        def collect_with_index(prom_client, start_date, end_date, output_file):
+            with MetricsWriter(output_file, start_date, end_date) as writer:
+                writer.write_section("cpu_metrics", prom_client.query_metric("cpu", start_date, end_date))
+
+        series = {"metric": {"pod": "pod1", "namespace": "ns1"}, "values": [[0, "1"]]}
+        prom_client = mock.Mock()
+        prom_client.query_metric.return_value = [series]
+
+        Backfill(self.tmp_dir.name, collect_with_index).run(prom_client, "2024-03-01", "2024-03-01", "bucket")
+        output_file = os.path.join(self.tmp_dir.name, "metrics-2024-03-01.json")
+        self.assertEqual(
+            sorted(os.listdir(self.tmp_dir.name)),
+            sorted(["manifest.json", "checkpoints", "metrics-2024-03-01.json", ".metrics-2024-03-01.json.idx"]),
+        )
+        self.assertEqual(load_metrics_file(output_file, ["ns1"])["cpu_metrics"], [series])
+        mock_upload.assert_has_calls([
+            mock.call(output_file, "bucket", "data_2024-03/metrics-2024-03-01.json"),
+            mock.call(get_index_file_name(output_file), "bucket", "data_2024-03/.metrics-2024-03-01.json.idx"),
+        ])
@@ -0,0 +1,170 @@
+import pickle
+import random
+from unittest import TestCase
+
+from openshift_metrics.columnar_processor import ColumnarMetricsProcessor
+from openshift_metrics.metrics_processor import MetricsProcessor
+from openshift_metrics.prometheus_client import values_to_intervals
+
+METRICS_TO_CHECK = ["cpu_request", "memory_request", "gpu_request", "gpu_type"]
+
+
+def random_series(rng, namespace, pod, metric_labels, start=0, step=900):
+    values = []
+    epoch_time = start
+    while epoch_time < start + 96 * step:
+        if rng.random() < 0.1:
+            epoch_time += rng.choice([-3, 2, 3, 10]) * step
+        values.append([epoch_time, rng.choice(["1", "1", "1", "2", "0.5"])])
+        epoch_time += step
+    return {"metric": {"pod": pod, "namespace": namespace, "node": "wrk-1", **metric_labels}, "values": values}
+
+
+def random_files(rng, num_files, with_intervals=False):
+    """Returns the sections of metrics files with overlapping series of a few pods"""
+    files = []
+    for file_index in range(num_files):
+        file = {"cpu_request": [], "memory_request": [], "gpu_request": []}
+        for namespace, pod in [("ns1", "pod1"), ("ns1", "pod2"), ("ns2", "pod1"), ("ns3", "pod3")]:
+            start = file_index * 48 * 900
+            class_labels = {"label_nerc_mghpcc_org_class": rng.choice(["student", "staff", None])}
+            file["cpu_request"].append(random_series(rng, namespace, pod, class_labels, start))
+            file["memory_request"].append(random_series(rng, namespace, pod, {}, start))
+            if pod == "pod1":
+                gpu_labels = {"resource": "nvidia.com/gpu", "label_nvidia_com_gpu_product": rng.choice(["A100", "V100"])}
+                file["gpu_request"].append(random_series(rng, namespace, pod, gpu_labels, start))
+        if with_intervals and file_index % 2:
+            file = {
+                metric_name: [values_to_intervals(series, 15) for series in metric_list]
+                for metric_name, metric_list in file.items()
+            }
+        files.append(file)
+    return files
+
+
+def merge(processor, files):
+    for file in files:
+        for metric_name, metric_list in file.items():
+            processor.merge_metrics(metric_name, metric_list)
+    return processor
+
+
+class TestColumnarMetricsProcessor(TestCase):
+
+    def test_same_as_dict_processor(self):
+        rng = random.Random(18)
+        for _ in range(5):
+            files = random_files(rng, 3)
+            expected = merge(MetricsProcessor(), files)
+            columnar = merge(ColumnarMetricsProcessor(), files)
+
+            self.assertEqual(columnar.merged_data, expected.merged_data)
+            self.assertEqual(columnar.get_namespaces(), expected.get_namespaces())
+            condensed = columnar.condense_metrics(METRICS_TO_CHECK)
+            self.assertEqual(condensed, expected.condense_metrics(METRICS_TO_CHECK))
+            self.assertEqual(list(condensed), list(expected.condense_metrics(METRICS_TO_CHECK)))
+
+    def test_same_as_dict_processor_with_intervals(self):
+        rng = random.Random(19)
+        for _ in range(5):
+            files = random_files(rng, 3, with_intervals=True)
+            expected = merge(MetricsProcessor(), files)
+            columnar = merge(ColumnarMetricsProcessor(), files)
+            self.assertEqual(columnar.condense_metrics(METRICS_TO_CHECK), expected.condense_metrics(METRICS_TO_CHECK))
+
+    def test_combine(self):
+        files = random_files(random.Random(20), 6, with_intervals=True)
+        sequential = merge(ColumnarMetricsProcessor(), files)
+        combined = merge(ColumnarMetricsProcessor(), files[:2])
+        combined.combine(merge(ColumnarMetricsProcessor(), files[2:3]))
+        combined.combine(merge(ColumnarMetricsProcessor(), files[3:]))
+
+        self.assertEqual(combined.merged_data, sequential.merged_data)
+        self.assertEqual(
+            combined.condense_metrics(METRICS_TO_CHECK), sequential.condense_metrics(METRICS_TO_CHECK)
+        )
+
+    def test_select_namespaces(self):
+        files = random_files(random.Random(21), 2, with_intervals=True)
+        columnar = merge(ColumnarMetricsProcessor(), files)
+        condensed = columnar.condense_metrics(METRICS_TO_CHECK)
+
+        selected = pickle.loads(pickle.dumps(columnar.select_namespaces(["ns3", "ns1"])))
+        self.assertEqual(selected.get_namespaces(), ["ns1", "ns3"])
+        self.assertEqual(
+            selected.condense_metrics(METRICS_TO_CHECK),
+            {"ns1": condensed["ns1"], "ns3": condensed["ns3"]},
+        )
+
+    def test_memory_per_sample(self):
+        columnar = merge(ColumnarMetricsProcessor(), random_files(random.Random(22), 10))
+        self.assertLessEqual(columnar.nbytes / columnar.sample_count, 20)
+
+
+class TestVectorizedCondense(TestCase):
+
+    def test_missing_metric_is_zero(self):
+        cpu = {"metric": {"pod": "pod1", "namespace": "ns1"}, "values": [[0, "1"], [900, "1"], [1800, "1"], [2700, "1"]]}
+        memory = {"metric": {"pod": "pod1", "namespace": "ns1"}, "values": [[900, 0], [1800, "0"]]}
+        for processor_class in (MetricsProcessor, ColumnarMetricsProcessor):
+            processor = processor_class()
+            processor.merge_metrics("cpu_request", [cpu])
+            processor.merge_metrics("memory_request", [memory])
+            self.assertEqual(
+                processor.condense_metrics(["cpu_request", "memory_request"]),
+                {
+                    "ns1": {
+                        "pod1": {
+                            "metrics": {
+                                0: {"cpu_request": "1", "duration": 1800},
+                                1800: {"cpu_request": "1", "memory_request": "0", "duration": 900},
+                                2700: {"cpu_request": "1", "duration": 900},
+                            }
+                        }
+                    }
+                },
+            )
+
+    def test_pods_with_and_without_intervals(self):
+        rng = random.Random(23)
+        files = random_files(rng, 2)
+        files.append(
+            {
+                "cpu_request": [values_to_intervals(random_series(rng, "ns2", "pod1", {}, 96 * 900), 15)],
+                "memory_request": [random_series(rng, "ns4", "pod4", {}, 96 * 900)],
+            }
+        )
+        expected = merge(MetricsProcessor(), files).condense_metrics(METRICS_TO_CHECK)
+        condensed = merge(ColumnarMetricsProcessor(), files).condense_metrics(METRICS_TO_CHECK)
+        self.assertEqual(condensed, expected)
+        self.assertEqual(list(condensed), list(expected))
+        self.assertEqual({namespace: list(pods) for namespace, pods in condensed.items()},
+                         {namespace: list(pods) for namespace, pods in expected.items()})
+
+    def test_times_far_apart(self):
+        rng = random.Random(25)
+        files = random_files(rng, 2)
+        files.append({"cpu_request": [random_series(rng, "ns1", "pod1", {}, 2**33)]})
+        expected = merge(MetricsProcessor(), files).condense_metrics(METRICS_TO_CHECK)
+        self.assertEqual(merge(ColumnarMetricsProcessor(), files).condense_metrics(METRICS_TO_CHECK), expected)
+
+    def test_empty(self):
+        self.assertEqual(ColumnarMetricsProcessor().condense_metrics(METRICS_TO_CHECK), {})
+
+    def test_condense_in_place(self):
+        files = random_files(random.Random(24), 3, with_intervals=True)
+        expected = merge(MetricsProcessor(), files).condense_metrics(METRICS_TO_CHECK)
+
+        columnar = merge(ColumnarMetricsProcessor(), files)
+        self.assertEqual(columnar.condense_metrics(METRICS_TO_CHECK, in_place=True), expected)
+        self.assertEqual(columnar.sample_count, 0)
+
+        columnar = merge(ColumnarMetricsProcessor(), files)
+        self.assertEqual(
+            [(namespace, pod, interval.start, interval.metrics)
+             for namespace, pod, interval in columnar.iter_condensed_metrics(METRICS_TO_CHECK, consume=True)],
+            [(namespace, pod, start_time, metric_dict)
+             for namespace, pods in expected.items()
+             for pod, pod_dict in pods.items()
+             for start_time, metric_dict in pod_dict["metrics"].items()],
+        )
@@ -0,0 +1,121 @@
+import os
+import pickle
+import random
+import tempfile
+from decimal import Decimal
+from unittest import TestCase, mock
+
+from openshift_metrics import invoice, utils
+from openshift_metrics.compact_processor import CompactMetricsProcessor, PodMetrics, Series
+from openshift_metrics.metrics_processor import MetricsProcessor
+from openshift_metrics.tests.test_columnar_processor import METRICS_TO_CHECK, merge, random_files
+
+RATES = invoice.Rates(
+    cpu=Decimal("0.013"),
+    gpu_a100=Decimal("1.803"),
+    gpu_a100sxm4=Decimal("2.078"),
+    gpu_v100=Decimal("1.214"),
+)
+
+
+def with_decimal_values(condensed_metrics_dict):
+    """Returns the condensed metrics of MetricsProcessor with the values parsed like CompactMetricsProcessor's"""
+    for pods in condensed_metrics_dict.values():
+        for pod_dict in pods.values():
+            for metric_dict in pod_dict["metrics"].values():
+                for metric_name in ("cpu_request", "memory_request", "gpu_request"):
+                    if metric_name in metric_dict:
+                        metric_dict[metric_name] = Decimal(metric_dict[metric_name])
+    return condensed_metrics_dict
+
+
+class TestCompactMetricsProcessor(TestCase):
+
+    def test_same_as_dict_processor(self):
+        rng = random.Random(21)
+        for test_index in range(10):
+            files = random_files(rng, 3, with_intervals=bool(test_index % 2))
+            expected = merge(MetricsProcessor(), files).condense_metrics(METRICS_TO_CHECK)
+            condensed = merge(CompactMetricsProcessor(), files).condense_metrics(METRICS_TO_CHECK)
+            self.assertEqual(condensed, with_decimal_values(expected))
+
+    def test_missing_metric_is_zero(self):
+        cpu = {"metric": {"pod": "pod1", "namespace": "ns1"}, "values": [[0, "1"], [900, "1"], [1800, "1"]]}
+        memory = {"metric": {"pod": "pod1", "namespace": "ns1"}, "values": [[900, 0], [1800, "0"]]}
+        processor = CompactMetricsProcessor()
+        processor.merge_metrics("cpu_request", [cpu])
+        processor.merge_metrics("memory_request", [memory])
+        self.assertEqual(
+            processor.condense_metrics(["cpu_request", "memory_request"]),
+            {
+                "ns1": {
+                    "pod1": {
+                        "metrics": {
+                            0: {"cpu_request": Decimal(1), "duration": 1800},
+                            1800: {"cpu_request": Decimal(1), "memory_request": Decimal(0), "duration": 900},
+                        }
+                    }
+                }
+            },
+        )
+
+    def test_shares_labels(self):
+        processor = CompactMetricsProcessor()
+        for metric_name in ("cpu_request", "memory_request"):
+            processor.merge_metrics(
+                metric_name,
+                [
+                    {"metric": {"pod": f"pod{i}", "namespace": "ns1", "node": "wrk-1"}, "values": [[0, "1"]]}
+                    for i in range(3)
+                ],
+            )
+        pods = processor.merged_data["ns1"]
+        self.assertIsInstance(pods["pod0"], PodMetrics)
+        all_series = [series for pod_metrics in pods.values() for series in pod_metrics.series]
+        self.assertEqual(len(all_series), 6)
+        self.assertTrue(all(series.fields is all_series[0].fields for series in all_series))
+        self.assertFalse(hasattr(all_series[0], "__dict__"))
+        self.assertIsInstance(all_series[0], Series)
+
+    def test_combine(self):
+        files = random_files(random.Random(22), 6, with_intervals=True)
+        sequential = merge(CompactMetricsProcessor(), files)
+        combined = merge(CompactMetricsProcessor(), files[:2])
+        combined.combine(pickle.loads(pickle.dumps(merge(CompactMetricsProcessor(), files[2:3]))))
+        combined.combine(merge(CompactMetricsProcessor(), files[3:]))
+        self.assertEqual(
+            combined.condense_metrics(METRICS_TO_CHECK), sequential.condense_metrics(METRICS_TO_CHECK)
+        )
+
+    @mock.patch("openshift_metrics.utils.get_namespace_attributes")
+    def test_same_reports(self, mock_gna):
+        mock_gna.return_value = {}
+        files = random_files(random.Random(23), 3)
+        expected = merge(MetricsProcessor(), files).condense_metrics(METRICS_TO_CHECK)
+        condensed = merge(CompactMetricsProcessor(), files).condense_metrics(METRICS_TO_CHECK)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for condensed_metrics_dict, name in ((expected, "expected"), (condensed, "compact")):
+                utils.write_metrics_by_namespace(
+                    condensed_metrics_dict, os.path.join(tmp_dir, f"{name}-invoice"), "2024-01", RATES
+                )
+                utils.write_metrics_by_pod(condensed_metrics_dict, os.path.join(tmp_dir, f"{name}-pod"))
+
+            for report in ("invoice", "pod"):
+                with open(os.path.join(tmp_dir, f"expected-{report}")) as expected_file:
+                    with open(os.path.join(tmp_dir, f"compact-{report}")) as compact_file:
+                        self.assertEqual(compact_file.read(), expected_file.read())
+
+    def test_condense_in_place(self):
+        files = random_files(random.Random(24), 3, with_intervals=True)
+        expected = with_decimal_values(merge(MetricsProcessor(), files).condense_metrics(METRICS_TO_CHECK))
+
+        processor = merge(CompactMetricsProcessor(), files)
+        condensed = processor.condense_metrics(METRICS_TO_CHECK, in_place=True)
+        self.assertEqual(condensed, expected)
+        self.assertIs(processor.merged_data["ns1"]["pod1"], condensed["ns1"]["pod1"])
+
+        processor = merge(CompactMetricsProcessor(), files)
+        intervals = list(processor.iter_condensed_metrics(METRICS_TO_CHECK, consume=True))
+        self.assertEqual(len(intervals), sum(len(pod_dict["metrics"]) for pods in expected.values() for pod_dict in pods.values()))
+        self.assertEqual(processor.merged_data, {})
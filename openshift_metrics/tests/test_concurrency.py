@@ -0,0 +1,78 @@
+import threading
+from datetime import datetime, timedelta, UTC
+from email.utils import format_datetime
+from unittest import TestCase, mock
+
+from openshift_metrics.concurrency import AdaptiveConcurrencyLimiter, parse_retry_after
+
+
+class TestParseRetryAfter(TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after("120"), 120)
+
+    def test_date(self):
+        retry_at = datetime.now(UTC) + timedelta(seconds=60)
+        self.assertAlmostEqual(parse_retry_after(format_datetime(retry_at, usegmt=True)), 60, delta=2)
+
+    def test_missing_or_invalid(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after("soon"))
+
+
+class TestAdaptiveConcurrencyLimiter(TestCase):
+
+    def test_additive_increase(self):
+        limiter = AdaptiveConcurrencyLimiter(max_limit=8)
+        limiter._limit = 2.0
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(latency=1.0)
+        self.assertEqual(limiter.limit, 3)
+
+    def test_never_exceeds_max_limit(self):
+        limiter = AdaptiveConcurrencyLimiter(max_limit=2)
+        for _ in range(10):
+            limiter.acquire()
+            limiter.release(latency=1.0)
+        self.assertEqual(limiter.limit, 2)
+
+    def test_multiplicative_decrease_when_throttled(self):
+        limiter = AdaptiveConcurrencyLimiter(max_limit=8)
+        limiter.acquire()
+        limiter.release(throttled=True)
+        self.assertEqual(limiter.limit, 4)
+        for _ in range(5):
+            limiter._not_before = 0
+            limiter.acquire()
+            limiter.release(throttled=True)
+        self.assertEqual(limiter.limit, 1)
+
+    def test_decrease_on_high_latency(self):
+        limiter = AdaptiveConcurrencyLimiter(max_limit=10)
+        limiter.acquire()
+        limiter.release(latency=1.0)
+        limiter.acquire()
+        limiter.release(latency=5.0)
+        self.assertEqual(limiter.limit, 9)
+
+    @mock.patch('time.sleep')
+    def test_waits_for_retry_after(self, mock_sleep):
+        limiter = AdaptiveConcurrencyLimiter(max_limit=4)
+        limiter.acquire()
+        limiter.release(throttled=True, retry_after=10)
+        limiter.acquire()
+        self.assertAlmostEqual(mock_sleep.call_args[0][0], 10, delta=1)
+
+    def test_queue_depth(self):
+        limiter = AdaptiveConcurrencyLimiter(max_limit=1)
+        limiter.acquire()
+        waiter = threading.Thread(target=limiter.acquire)
+        waiter.start()
+        while limiter.queue_depth == 0:
+            pass
+        self.assertEqual(limiter.in_flight, 1)
+        limiter.release(latency=1.0)
+        waiter.join(timeout=5)
+        self.assertEqual(limiter.queue_depth, 0)
+        self.assertEqual(limiter.in_flight, 1)
@@ -0,0 +1,93 @@
+import os
+import pickle
+import random
+import tempfile
+from unittest import TestCase
+
+from openshift_metrics.external_processor import ExternalMetricsProcessor
+from openshift_metrics.metrics_processor import MetricsProcessor
+from openshift_metrics.tests.test_columnar_processor import METRICS_TO_CHECK, merge, random_files
+
+# Small enough that every few series are spilled to a run
+TINY_BUDGET_MB = 0.05
+
+
+class TestExternalMetricsProcessor(TestCase):
+
+    def setUp(self):
+        self.spill_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.spill_dir.cleanup)
+
+    def processor(self, memory_budget_mb=TINY_BUDGET_MB):
+        return ExternalMetricsProcessor(memory_budget_mb=memory_budget_mb, spill_dir=self.spill_dir.name)
+
+    def test_same_as_dict_processor(self):
+        rng = random.Random(25)
+        for with_intervals in (False, True, True):
+            files = random_files(rng, 4, with_intervals=with_intervals)
+            rng.shuffle(files)
+            expected = merge(MetricsProcessor(), files)
+            external = merge(self.processor(), files)
+
+            self.assertGreater(len(external._runs), 1)
+            self.assertEqual(external.get_namespaces(), expected.get_namespaces())
+            condensed = external.condense_metrics(METRICS_TO_CHECK)
+            self.assertEqual(condensed, expected.condense_metrics(METRICS_TO_CHECK))
+            self.assertEqual(list(condensed), list(expected.condense_metrics(METRICS_TO_CHECK)))
+            self.assertEqual(
+                {namespace: list(pods) for namespace, pods in condensed.items()},
+                {namespace: list(pods) for namespace, pods in expected.merged_data.items()},
+            )
+
+    def test_without_spilling(self):
+        files = random_files(random.Random(26), 3, with_intervals=True)
+        expected = merge(MetricsProcessor(), files).condense_metrics(METRICS_TO_CHECK)
+        external = merge(self.processor(memory_budget_mb=64), files)
+        self.assertEqual(external._runs, [])
+        self.assertEqual(external.condense_metrics(METRICS_TO_CHECK), expected)
+
+    def test_combine(self):
+        files = random_files(random.Random(27), 6, with_intervals=True)
+        expected = merge(MetricsProcessor(), files).condense_metrics(METRICS_TO_CHECK)
+        combined = merge(self.processor(), files[:2])
+        combined.combine(pickle.loads(pickle.dumps(merge(self.processor(), files[2:3]))))
+        combined.combine(merge(self.processor(memory_budget_mb=64), files[3:]))
+        self.assertEqual(combined.condense_metrics(METRICS_TO_CHECK), expected)
+
+    def test_select_namespaces(self):
+        files = random_files(random.Random(28), 2, with_intervals=True)
+        external = merge(self.processor(), files)
+        condensed = external.condense_metrics(METRICS_TO_CHECK)
+
+        selected = pickle.loads(pickle.dumps(external.select_namespaces(["ns3", "ns1"])))
+        self.assertEqual(selected.get_namespaces(), ["ns1", "ns3"])
+        self.assertEqual(
+            selected.condense_metrics(METRICS_TO_CHECK),
+            {"ns1": condensed["ns1"], "ns3": condensed["ns3"]},
+        )
+        # The selection reads the runs of external, which are still there
+        self.assertEqual(external.condense_metrics(METRICS_TO_CHECK), condensed)
+
+    def test_iter_condensed_metrics(self):
+        files = random_files(random.Random(29), 3)
+        expected = merge(MetricsProcessor(), files).condense_metrics(METRICS_TO_CHECK)
+        external = merge(self.processor(), files)
+        self.assertEqual(
+            [(namespace, pod, interval.start, interval.metrics)
+             for namespace, pod, interval in external.iter_condensed_metrics(METRICS_TO_CHECK, consume=True)],
+            [(namespace, pod, start_time, metric_dict)
+             for namespace, pods in expected.items()
+             for pod, pod_dict in pods.items()
+             for start_time, metric_dict in pod_dict["metrics"].items()],
+        )
+
+    def test_runs_are_removed(self):
+        external = merge(self.processor(), random_files(random.Random(30), 2))
+        run_dir = external._spill_dir
+        self.assertTrue(os.listdir(run_dir))
+
+        unpickled = pickle.loads(pickle.dumps(external))
+        del external
+        self.assertTrue(os.path.isdir(run_dir))
+        del unpickled
+        self.assertFalse(os.path.exists(run_dir))
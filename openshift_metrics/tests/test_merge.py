@@ -0,0 +1,71 @@
+import json
+import os
+import random
+import tempfile
+from decimal import Decimal
+from unittest import TestCase, mock
+
+from openshift_metrics import invoice, merge, utils
+from openshift_metrics.tests.test_columnar_processor import METRICS_TO_CHECK, random_files
+
+RATES = invoice.Rates(
+    cpu=Decimal("0.013"),
+    gpu_a100=Decimal("1.803"),
+    gpu_a100sxm4=Decimal("2.078"),
+    gpu_v100=Decimal("1.214"),
+)
+
+
+class TestMergeFiles(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def _write_metrics_files(self, files):
+        paths = []
+        for index, file in enumerate(files):
+            path = os.path.join(self.tmp_dir.name, f"metrics-{index}.json")
+            with open(path, "w") as metrics_file:
+                json.dump(
+                    {
+                        "start_date": f"2024-01-{index + 1:02}",
+                        "end_date": f"2024-01-{index + 1:02}",
+                        "cpu_metrics": file["cpu_request"],
+                        "memory_metrics": file["memory_request"],
+                        "gpu_metrics": file["gpu_request"],
+                    },
+                    metrics_file,
+                )
+            paths.append(path)
+        return paths
+
+    def _write_reports(self, processor, name):
+        report_files = [os.path.join(self.tmp_dir.name, f"{name}-{report}") for report in ("invoice", "classes", "pod")]
+        utils.write_reports_from_intervals(
+            processor.iter_condensed_metrics(METRICS_TO_CHECK, consume=True),
+            *report_files,
+            report_month="2024-01",
+            rates=RATES,
+            namespaces_with_classes=["ns2"],
+        )
+        reports = []
+        for report_file in report_files:
+            with open(report_file) as report:
+                reports.append(report.read())
+        return reports
+
+    @mock.patch('openshift_metrics.utils.get_namespace_attributes')
+    def test_same_reports_with_jobs(self, mock_gna):
+        mock_gna.return_value = {"ns1": {"cf_pi": "PI1", "institution_code": "76"}}
+        paths = self._write_metrics_files(random_files(random.Random(16), 5, with_intervals=True))
+
+        for backend in merge.PROCESSOR_BACKENDS:
+            processor, file_dates = merge.merge_files(paths, jobs=1, backend=backend)
+            expected = self._write_reports(processor, f"{backend}-sequential")
+            self.assertGreater(len(expected[2].splitlines()), 1)
+
+            for jobs in (2, 3):
+                processor, parallel_file_dates = merge.merge_files(paths, jobs=jobs, backend=backend)
+                self.assertEqual(parallel_file_dates, file_dates)
+                self.assertEqual(self._write_reports(processor, f"{backend}-{jobs}"), expected, (backend, jobs))
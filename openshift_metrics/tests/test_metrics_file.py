@@ -0,0 +1,282 @@
+import fnmatch
+import gzip
+import json
+import os
+import tempfile
+from unittest import TestCase, mock, skipIf
+
+from openshift_metrics import metrics_file
+from openshift_metrics.metrics_file import BinaryMetricsWriter, MetricsWriter, SeriesSpool, load_metrics_file
+
+CPU = {"metric": {"pod": "pod1", "namespace": "ns1", "unit": "cores"}, "values": [[0, "1"], [900, "1"]]}
+MEMORY = {"metric": {"pod": "pod1", "namespace": "ns1", "unit": "bytes"}, "values": [[0, "2"]]}
+
+
+class TestSeriesSpool(TestCase):
+
+    def test_round_trip(self):
+        with SeriesSpool() as spool:
+            self.assertFalse(spool)
+            spool.append(CPU)
+            spool.append(MEMORY)
+            self.assertEqual(len(spool), 2)
+            self.assertEqual(list(spool), [CPU, MEMORY])
+            self.assertEqual(list(spool), [CPU, MEMORY])
+
+    @mock.patch('openshift_metrics.metrics_file.SPOOL_MAX_MEMORY_BYTES', 10)
+    def test_spools_to_disk(self):
+        with SeriesSpool() as spool:
+            spool.append(CPU)
+            self.assertTrue(spool._file._rolled)
+            spool.append(MEMORY)
+            self.assertEqual(list(spool), [CPU, MEMORY])
+
+
+class TestMetricsWriter(TestCase):
+
+    def test_same_as_json_dump(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = os.path.join(tmp_dir, "metrics.json")
+            with MetricsWriter(output_file, "2024-03-01", "2024-03-02") as writer:
+                writer.write_section("cpu_metrics", iter([CPU, CPU]))
+                writer.write_section("memory_metrics", [MEMORY])
+                writer.write_section("gpu_metrics", [])
+            with open(output_file) as file:
+                content = file.read()
+
+        self.assertEqual(
+            content,
+            json.dumps({
+                "start_date": "2024-03-01",
+                "end_date": "2024-03-02",
+                "cpu_metrics": [CPU, CPU],
+                "memory_metrics": [MEMORY],
+                "gpu_metrics": [],
+            }),
+        )
+
+    def test_nothing_written_on_failure(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = os.path.join(tmp_dir, "metrics.json")
+            with self.assertRaises(RuntimeError):
+                with MetricsWriter(output_file, "2024-03-01", "2024-03-02") as writer:
+                    writer.write_section("cpu_metrics", [CPU])
+                    raise RuntimeError()
+            self.assertEqual(os.listdir(tmp_dir), [])
+
+
+class TestBinaryMetricsFile(TestCase):
+
+    def _round_trip(self, sections, writer_class=BinaryMetricsWriter):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = os.path.join(tmp_dir, "metrics.bin")
+            with writer_class(output_file, "2024-03-01", "2024-03-02") as writer:
+                for name, series in sections.items():
+                    writer.write_section(name, series)
+            return load_metrics_file(output_file)
+
+    def test_round_trip(self):
+        gpu = {
+            "metric": {"pod": "pod2", "namespace": "ns1", "label_nvidia_com_gpu_machine": None},
+            "values": [[0, "1"], [900, "1"], [1800, "1"], [5400, "2"], [6300, "1"]],
+        }
+        sections = {"cpu_metrics": [CPU, CPU], "memory_metrics": [MEMORY], "gpu_metrics": [gpu]}
+        self.assertEqual(
+            self._round_trip(sections),
+            dict({"start_date": "2024-03-01", "end_date": "2024-03-02"}, **sections),
+        )
+
+    def test_intervals(self):
+        series = {"metric": {"pod": "pod1"}, "intervals": [[0, 2700, "1"], [3600, 900, "0.5"], [4500, 86400, "1"]]}
+        self.assertEqual(self._round_trip({"cpu_metrics": [series, CPU]})["cpu_metrics"], [series, CPU])
+
+    def test_values_keep_their_exact_string(self):
+        values = ["1", "0.5", "1.50", "-0", "1e-05", "2e-5", "NaN", "+Inf", "18446744073709551616", "01", "x"]
+        series = {"metric": {"pod": "pod1"}, "values": [[i * 900, value] for i, value in enumerate(values)]}
+        metrics_dict = self._round_trip({"cpu_metrics": [series]})
+        self.assertEqual(metrics_dict["cpu_metrics"], [series])
+
+    def test_irregular_timestamps(self):
+        series = {
+            "metric": {"pod": "pod1"},
+            "values": [[0, "1"], [0, "1"], [900, "1"], [2700, "1"], [1800, "1"], [1800.5, "1"]],
+        }
+        self.assertEqual(self._round_trip({"cpu_metrics": [series]})["cpu_metrics"], [series])
+        series["values"] = [[10, "1"], [0, "1"], [-10, "1"], [-5, "1"]]
+        self.assertEqual(self._round_trip({"cpu_metrics": [series]})["cpu_metrics"], [series])
+
+    def test_many_distinct_values(self):
+        series = {"metric": {"pod": "pod1"}, "values": [[i, str(i)] for i in range(70000)]}
+        self.assertEqual(self._round_trip({"cpu_metrics": [series]})["cpu_metrics"], [series])
+
+    def test_json_files_are_still_loaded(self):
+        metrics_dict = self._round_trip({"cpu_metrics": [CPU]}, writer_class=MetricsWriter)
+        self.assertEqual(metrics_dict["cpu_metrics"], [CPU])
+
+    def test_smaller_than_json(self):
+        series = [
+            {"metric": dict(CPU["metric"], pod=f"pod{i}"), "values": [[j * 900, "1"] for j in range(96)]}
+            for i in range(100)
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sizes = []
+            for writer_class in (MetricsWriter, BinaryMetricsWriter):
+                output_file = os.path.join(tmp_dir, writer_class.__name__)
+                with writer_class(output_file, "2024-03-01", "2024-03-01") as writer:
+                    writer.write_section("cpu_metrics", series)
+                sizes.append(os.path.getsize(output_file))
+        self.assertLess(sizes[1] * 10, sizes[0])
+
+    def test_truncated_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = os.path.join(tmp_dir, "metrics.bin")
+            with BinaryMetricsWriter(output_file, "2024-03-01", "2024-03-02") as writer:
+                writer.write_section("cpu_metrics", [CPU])
+            with open(output_file, "rb") as file:
+                data = file.read()
+            with open(output_file, "wb") as file:
+                file.write(data[:-1])
+            with self.assertRaises(ValueError):
+                load_metrics_file(output_file)
+
+
+class TestCompressedMetricsFile(TestCase):
+
+    def _round_trip(self, writer_class, compression):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = os.path.join(tmp_dir, "metrics")
+            with writer_class(output_file, "2024-03-01", "2024-03-02", compression) as writer:
+                writer.write_section("cpu_metrics", [CPU])
+            with open(output_file, "rb") as file:
+                data = file.read()
+            return data, load_metrics_file(output_file)
+
+    def test_gzip(self):
+        expected = {"start_date": "2024-03-01", "end_date": "2024-03-02", "cpu_metrics": [CPU]}
+        for writer_class in (MetricsWriter, BinaryMetricsWriter):
+            data, metrics_dict = self._round_trip(writer_class, "gzip")
+            self.assertTrue(data.startswith(metrics_file.GZIP_MAGIC))
+            self.assertEqual(metrics_dict, expected)
+        self.assertEqual(json.loads(gzip.decompress(self._round_trip(MetricsWriter, "gzip")[0])), expected)
+
+    @skipIf(metrics_file.zstandard is None, "zstandard is not installed")
+    def test_zstd(self):
+        for writer_class in (MetricsWriter, BinaryMetricsWriter):
+            data, metrics_dict = self._round_trip(writer_class, "zstd")
+            self.assertTrue(data.startswith(metrics_file.ZSTD_MAGIC))
+            self.assertEqual(metrics_dict["cpu_metrics"], [CPU])
+
+    def test_file_extension(self):
+        self.assertEqual(metrics_file.get_metrics_file_extension("json"), "json")
+        self.assertEqual(metrics_file.get_metrics_file_extension("json", "gzip"), "json.gz")
+        self.assertEqual(metrics_file.get_metrics_file_extension("binary", "zstd"), "bin.zst")
+
+
+class TestMetricsFileIndex(TestCase):
+
+    @staticmethod
+    def series(namespace, pod, value):
+        return {"metric": {"pod": pod, "namespace": namespace, "node": "wrk-1"}, "values": [[0, value], [900, "1"]]}
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        # The series of ns1 aren't all next to each other
+        self.sections = {
+            "cpu_metrics": [
+                self.series("ns1", "pod1", "1"),
+                self.series("ns1", "pod2", "2"),
+                self.series("ns2", "pod1", "0.5"),
+                self.series("ns1", "pod3", "3"),
+            ],
+            "memory_metrics": [self.series("ns2", "pod1", "2"), self.series("ns3", "pod1", "é")],
+            "gpu_metrics": [],
+        }
+
+    def write(self, writer_class, compression=None, write_index=True):
+        output_file = os.path.join(self.tmp_dir, f"metrics-{writer_class.__name__}-{compression}")
+        with writer_class(output_file, "2024-03-01", "2024-03-02", compression, write_index) as writer:
+            for name, series in self.sections.items():
+                writer.write_section(name, series)
+        return output_file
+
+    def expected(self, namespaces):
+        return {
+            "start_date": "2024-03-01",
+            "end_date": "2024-03-02",
+            **{
+                name: [metric for metric in series if metric["metric"]["namespace"] in namespaces]
+                for name, series in self.sections.items()
+            },
+        }
+
+    def test_load_namespaces(self):
+        for writer_class in (MetricsWriter, BinaryMetricsWriter):
+            for compression in (None, "gzip"):
+                output_file = self.write(writer_class, compression)
+                self.assertTrue(os.path.exists(metrics_file.get_index_file_name(output_file)))
+                self.assertEqual(load_metrics_file(output_file)["cpu_metrics"], self.sections["cpu_metrics"])
+                for namespaces in (["ns1"], ["ns3", "ns2"], ["ns4"], []):
+                    with mock.patch("openshift_metrics.metrics_file._decompress") as decompress:
+                        decompress.side_effect = metrics_file.gzip.decompress
+                        metrics_dict = load_metrics_file(output_file, namespaces)
+                    self.assertEqual(metrics_dict, self.expected(namespaces))
+                    # Uncompressed files are read through the index, without reading the whole file
+                    self.assertEqual(decompress.called, compression is not None)
+
+    def test_ranges(self):
+        output_file = self.write(MetricsWriter)
+        with open(metrics_file.get_index_file_name(output_file)) as file:
+            index = json.load(file)
+        ranges = index["sections"]["cpu_metrics"]
+        self.assertEqual(len(ranges["ns1"]), 2)
+        self.assertEqual(len(ranges["ns2"]), 1)
+        self.assertEqual(index["sections"]["gpu_metrics"], {})
+
+        with open(output_file, "rb") as file:
+            data = file.read()
+        start, end = ranges["ns2"][0]
+        self.assertEqual(json.loads(data[start:end]), self.sections["cpu_metrics"][2])
+
+    def test_without_index(self):
+        for writer_class in (MetricsWriter, BinaryMetricsWriter):
+            output_file = self.write(writer_class, write_index=False)
+            self.assertFalse(os.path.exists(metrics_file.get_index_file_name(output_file)))
+            self.assertEqual(load_metrics_file(output_file, ["ns2"]), self.expected(["ns2"]))
+
+    def test_out_of_date_index(self):
+        output_file = self.write(MetricsWriter)
+        self.sections["cpu_metrics"].reverse()
+        with MetricsWriter(output_file, "2024-03-01", "2024-03-02", write_index=False) as writer:
+            for name, series in self.sections.items():
+                writer.write_section(name, series)
+        self.assertFalse(os.path.exists(metrics_file.get_index_file_name(output_file)))
+        self.assertEqual(load_metrics_file(output_file, ["ns1"]), self.expected(["ns1"]))
+
+        output_file = self.write(BinaryMetricsWriter)
+        with open(output_file, "ab") as file:
+            file.write(b"E")
+        self.assertIsNone(metrics_file._load_index(output_file))
+        self.assertEqual(load_metrics_file(output_file, ["ns1"]), self.expected(["ns1"]))
+
+    def test_index_file_name(self):
+        index_file = metrics_file.get_index_file_name("/data/metrics-2024-03-01.json")
+        self.assertEqual(index_file, "/data/.metrics-2024-03-01.json.idx")
+        # globs of metrics files don't match the index
+        self.assertFalse(fnmatch.fnmatch(os.path.basename(index_file), "metrics-*"))
+        self.assertFalse(fnmatch.fnmatch(os.path.basename(index_file), "*.json"))
+        self.assertTrue(metrics_file.is_index_file(index_file))
+        self.assertFalse(metrics_file.is_index_file("/data/metrics-2024-03-01.json"))
+
+    def test_replace_metrics_file(self):
+        output_file = self.write(MetricsWriter)
+        moved_file = os.path.join(self.tmp_dir, "moved.json")
+        metrics_file.replace_metrics_file(output_file, moved_file)
+        self.assertFalse(os.path.exists(metrics_file.get_index_file_name(output_file)))
+        self.assertEqual(load_metrics_file(moved_file, ["ns2"]), self.expected(["ns2"]))
+
+        # a file without an index doesn't keep the index of the file it replaces
+        output_file = self.write(MetricsWriter, write_index=False)
+        metrics_file.replace_metrics_file(output_file, moved_file)
+        self.assertFalse(os.path.exists(metrics_file.get_index_file_name(moved_file)))
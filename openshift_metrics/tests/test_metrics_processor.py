@@ -1,5 +1,7 @@
+import random
 from unittest import TestCase, mock
 from openshift_metrics import metrics_processor, invoice
+from openshift_metrics.prometheus_client import intervals_to_values, values_to_intervals
 
 
 class TestMergeMetrics(TestCase):
@@ -756,3 +758,318 @@ class TestInsertNodeLabels(TestCase):
             },
         ]
         self.assertEqual(expected_metrics, metrics_with_labels)
+
+
+class TestSplitResourceRequests(TestCase):
+    def test_split_resource_requests(self):
+        cpu = {"metric": {"pod": "pod1", "resource": "cpu", "unit": "cores"}, "values": [[0, "1"]]}
+        memory = {"metric": {"pod": "pod1", "resource": "memory", "unit": "bytes"}, "values": [[0, "2"]]}
+        gpu = {"metric": {"pod": "pod1", "resource": "nvidia.com/gpu", "unit": "integer"}, "values": [[0, "1"]]}
+        mig = {"metric": {"pod": "pod2", "resource": "nvidia.com/mig-1g.5gb", "unit": "integer"}, "values": [[0, "1"]]}
+        other = {"metric": {"pod": "pod2", "resource": "example.com/nvidia.com", "unit": "integer"}, "values": [[0, "1"]]}
+
+        cpu_metrics, memory_metrics, gpu_metrics = metrics_processor.MetricsProcessor.split_resource_requests(
+            iter([cpu, gpu, memory, other, mig])
+        )
+        self.assertEqual(cpu_metrics, [cpu])
+        self.assertEqual(memory_metrics, [memory])
+        self.assertEqual(gpu_metrics, [gpu, mig])
+
+
+class TestCondenseIntervals(TestCase):
+
+    @staticmethod
+    def _random_series(rng, pod, metric_labels, step):
+        values = []
+        epoch_time = 0
+        while epoch_time < 96 * step:
+            if rng.random() < 0.1:
+                epoch_time += rng.choice([2, 3, 10]) * step
+            values.append([epoch_time, rng.choice(["1", "1", "1", "2", "0.5"])])
+            epoch_time += step
+        return {"metric": {"pod": pod, "namespace": "ns1", "node": "wrk-1", **metric_labels}, "values": values}
+
+    def test_same_as_condensing_samples(self):
+        rng = random.Random(42)
+        step = 900
+        metrics_to_check = ["cpu_request", "memory_request", "gpu_request", "gpu_type"]
+
+        for _ in range(20):
+            sections = {
+                "cpu_request": [self._random_series(rng, f"pod{i}", {}, step) for i in range(3)],
+                "memory_request": [self._random_series(rng, f"pod{i}", {}, step) for i in range(3)],
+                "gpu_request": [
+                    self._random_series(rng, "pod1", {"label_nvidia_com_gpu_product": "A100"}, step)
+                ],
+            }
+
+            dense = metrics_processor.MetricsProcessor(interval_minutes=15)
+            condensed = metrics_processor.MetricsProcessor(interval_minutes=15)
+            for metric_name, series in sections.items():
+                dense.merge_metrics(metric_name, series)
+                condensed.merge_metrics(
+                    metric_name, [values_to_intervals(metric, 15) for metric in series]
+                )
+
+            self.assertEqual(
+                dense.condense_metrics(metrics_to_check), condensed.condense_metrics(metrics_to_check)
+            )
+
+    def test_intervals_and_samples(self):
+        processor = metrics_processor.MetricsProcessor(interval_minutes=15)
+        processor.merge_metrics(
+            "cpu_request",
+            [{"metric": {"pod": "pod1", "namespace": "ns1"}, "intervals": [[0, 2700, "1"]]}],
+        )
+        processor.merge_metrics(
+            "cpu_request",
+            [{"metric": {"pod": "pod1", "namespace": "ns1"}, "values": [[2700, "1"], [3600, "2"]]}],
+        )
+        processor.merge_metrics(
+            "memory_request",
+            [{"metric": {"pod": "pod1", "namespace": "ns1"}, "intervals": [[0, 4500, "4"]]}],
+        )
+        self.assertEqual(
+            processor.condense_metrics(["cpu_request", "memory_request"]),
+            {
+                "ns1": {
+                    "pod1": {
+                        "metrics": {
+                            0: {"cpu_request": "1", "memory_request": "4", "duration": 3600},
+                            3600: {"cpu_request": "2", "memory_request": "4", "duration": 900},
+                        }
+                    }
+                }
+            },
+        )
+
+    def test_later_samples_override_intervals(self):
+        for incremental in (False, True):
+            processor = metrics_processor.MetricsProcessor(interval_minutes=15, incremental=incremental)
+            processor.merge_metrics(
+                "cpu_request",
+                [{"metric": {"pod": "pod1", "namespace": "ns1"}, "intervals": [[0, 2700, "1"]]}],
+            )
+            processor.merge_metrics(
+                "cpu_request",
+                [{"metric": {"pod": "pod1", "namespace": "ns1"}, "values": [[900, "2"]]}],
+            )
+            self.assertEqual(
+                processor.condense_metrics(["cpu_request"]),
+                {
+                    "ns1": {
+                        "pod1": {
+                            "metrics": {
+                                0: {"cpu_request": "1", "duration": 900},
+                                900: {"cpu_request": "2", "duration": 900},
+                                1800: {"cpu_request": "1", "duration": 900},
+                            }
+                        }
+                    }
+                },
+            )
+
+    def test_mixed_files_same_as_samples(self):
+        """Overlapping files with both intervals and samples condense like the samples of every file"""
+        rng = random.Random(14)
+        metrics_to_check = ["cpu_request", "memory_request"]
+
+        def merge(processor, files):
+            for file in files:
+                for metric_name, metric_list in file.items():
+                    processor.merge_metrics(metric_name, metric_list)
+            return processor
+
+        for _ in range(20):
+            files = []
+            for file_index in range(4):
+                file = {}
+                for metric_name in metrics_to_check:
+                    file[metric_name] = []
+                    for pod in range(2):
+                        series = self._random_series(rng, f"pod{pod}", {}, 900)
+                        series["values"] = [[t + file_index * 48 * 900, v] for t, v in series["values"]]
+                        file[metric_name].append(values_to_intervals(series, 15) if rng.random() < 0.5 else series)
+                files.append(file)
+            rng.shuffle(files)
+            samples = [
+                {
+                    metric_name: [intervals_to_values(series, 15) if "intervals" in series else series for series in metric_list]
+                    for metric_name, metric_list in file.items()
+                }
+                for file in files
+            ]
+
+            expected = merge(metrics_processor.MetricsProcessor(), samples).condense_metrics(metrics_to_check)
+            for incremental in (False, True):
+                processor = merge(metrics_processor.MetricsProcessor(incremental=incremental), files)
+                self.assertEqual(processor.condense_metrics(metrics_to_check), expected)
+
+            combined = merge(metrics_processor.MetricsProcessor(), files[:2])
+            combined.combine(merge(metrics_processor.MetricsProcessor(), files[2:]))
+            self.assertEqual(combined.condense_metrics(metrics_to_check), expected)
+
+
+class TestCombine(TestCase):
+
+    def test_same_as_merging_in_order(self):
+        rng = random.Random(7)
+        files = []
+        for file_index in range(6):
+            series = TestCondenseIntervals._random_series(rng, f"pod{file_index % 3}", {}, 900)
+            series["values"] = [[t + file_index * 3600, v] for t, v in series["values"]]
+            if file_index % 2:
+                series = values_to_intervals(series, 15)
+            labelled = dict(series, metric=dict(series["metric"], label_nerc_mghpcc_org_class=f"class{file_index}"))
+            files.append({"cpu_request": [labelled], "memory_request": [series]})
+
+        def merge(files):
+            processor = metrics_processor.MetricsProcessor(interval_minutes=15)
+            for file in files:
+                for metric_name, metric_list in file.items():
+                    processor.merge_metrics(metric_name, metric_list)
+            return processor
+
+        sequential = merge(files)
+        combined = merge(files[:2])
+        combined.combine(merge(files[2:3]))
+        combined.combine(merge(files[3:]))
+
+        # Samples merged after intervals get a different seq when combined
+        self.assertEqual(
+            combined.condense_metrics(["cpu_request", "memory_request"]),
+            sequential.condense_metrics(["cpu_request", "memory_request"]),
+        )
+
+
+class TestIncrementalMerge(TestCase):
+
+    @staticmethod
+    def _merge(processor, files):
+        for file in files:
+            for metric_name, metric_list in file.items():
+                processor.merge_metrics(metric_name, metric_list)
+        return processor
+
+    def test_same_as_merging_samples(self):
+        rng = random.Random(20)
+        metrics_to_check = ["cpu_request", "memory_request", "gpu_request", "gpu_type"]
+        for _ in range(20):
+            files = []
+            for file_index in range(4):
+                files.append({
+                    "cpu_request": [
+                        TestCondenseIntervals._random_series(rng, f"pod{pod}", {}, 900) for pod in range(2)
+                    ],
+                    "memory_request": [TestCondenseIntervals._random_series(rng, "pod0", {}, 900)],
+                    "gpu_request": [
+                        TestCondenseIntervals._random_series(
+                            rng, "pod1", {"label_nvidia_com_gpu_product": rng.choice(["A100", "V100"])}, 900
+                        )
+                    ],
+                })
+                for series in files[-1]["cpu_request"]:
+                    series["values"] = [[t + file_index * 43200, v] for t, v in series["values"]]
+            rng.shuffle(files)
+
+            expected = self._merge(metrics_processor.MetricsProcessor(), files)
+            incremental = self._merge(metrics_processor.MetricsProcessor(incremental=True), files)
+            self.assertEqual(
+                incremental.condense_metrics(metrics_to_check), expected.condense_metrics(metrics_to_check)
+            )
+
+    def test_extends_intervals_across_files(self):
+        processor = metrics_processor.MetricsProcessor(interval_minutes=15, incremental=True)
+        for day in range(3):
+            for metric_name in ["cpu_request", "memory_request"]:
+                processor.merge_metrics(
+                    metric_name,
+                    [{
+                        "metric": {"pod": "pod1", "namespace": "ns1", "node": "wrk-1"},
+                        "values": [[t * 900, "1"] for t in range(day * 96, day * 96 + 96)],
+                    }],
+                )
+
+        pod_dict = processor.merged_data["ns1"]["pod1"]
+        self.assertEqual(pod_dict["metrics"], {})
+        self.assertEqual([(i.start, i.end) for i in pod_dict["intervals"]], [(0, 259200), (0, 259200)])
+
+    def test_later_samples_take_precedence(self):
+        def cpu(node, value, start):
+            return [{
+                "metric": {"pod": "pod1", "namespace": "ns1", "node": node},
+                "values": [[start, value], [start + 900, value]],
+            }]
+
+        for processor in (
+            metrics_processor.MetricsProcessor(),
+            metrics_processor.MetricsProcessor(incremental=True),
+        ):
+            processor.merge_metrics("cpu_request", cpu("wrk-1", "1", 0))
+            processor.merge_metrics("cpu_request", cpu("wrk-2", "2", 0))
+            processor.merge_metrics("cpu_request", cpu("wrk-1", "1", 900))
+            self.assertEqual(
+                processor.condense_metrics(["cpu_request"]),
+                {
+                    "ns1": {
+                        "pod1": {
+                            "metrics": {
+                                0: {"cpu_request": "2", "node": "wrk-2", "duration": 900},
+                                900: {"cpu_request": "1", "node": "wrk-1", "duration": 1800},
+                            }
+                        }
+                    }
+                },
+            )
+
+
+class TestCondenseInPlace(TestCase):
+
+    def _merged_processor(self):
+        rng = random.Random(22)
+        processor = metrics_processor.MetricsProcessor(interval_minutes=15)
+        for metric_name in ["cpu_request", "memory_request"]:
+            processor.merge_metrics(
+                metric_name,
+                [TestCondenseIntervals._random_series(rng, f"pod{i}", {}, 900) for i in range(3)],
+            )
+        processor.merge_metrics(
+            "cpu_request",
+            [values_to_intervals(TestCondenseIntervals._random_series(rng, "pod3", {}, 900), 15)],
+        )
+        return processor
+
+    def test_in_place(self):
+        metrics_to_check = ["cpu_request", "memory_request"]
+        expected = self._merged_processor().condense_metrics(metrics_to_check)
+
+        processor = self._merged_processor()
+        raw_metrics_dict = processor.merged_data["ns1"]["pod0"]["metrics"]
+        start_time = min(raw_metrics_dict)
+        start_metric_dict = raw_metrics_dict[start_time]
+
+        condensed = processor.condense_metrics(metrics_to_check, in_place=True)
+        self.assertEqual(condensed, expected)
+        self.assertIs(condensed["ns1"]["pod0"], processor.merged_data["ns1"]["pod0"])
+        self.assertIs(condensed["ns1"]["pod0"]["metrics"][start_time], start_metric_dict)
+        self.assertNotIn("intervals", processor.merged_data["ns1"]["pod3"])
+
+    def test_iter_condensed_metrics(self):
+        metrics_to_check = ["cpu_request", "memory_request"]
+        expected = self._merged_processor().condense_metrics(metrics_to_check)
+        expected_intervals = [
+            (namespace, pod, metrics_processor.CondensedInterval(start_time, metric_dict, None))
+            for namespace, pods in expected.items()
+            for pod, pod_dict in pods.items()
+            for start_time, metric_dict in pod_dict["metrics"].items()
+        ]
+
+        processor = self._merged_processor()
+        self.assertEqual(list(processor.iter_condensed_metrics(metrics_to_check)), expected_intervals)
+        self.assertEqual(len(processor.merged_data["ns1"]), 4)
+
+        intervals = processor.iter_condensed_metrics(metrics_to_check, consume=True)
+        self.assertEqual(next(intervals), expected_intervals[0])
+        self.assertEqual(list(processor.merged_data["ns1"]), ["pod0", "pod1", "pod2", "pod3"])
+        self.assertEqual(list(intervals), expected_intervals[1:])
+        self.assertEqual(processor.merged_data, {})
@@ -0,0 +1,143 @@
+import json
+import os
+import random
+import sqlite3
+import tempfile
+from unittest import TestCase
+
+from openshift_metrics import utils
+from openshift_metrics.compact_processor import CompactMetricsProcessor
+from openshift_metrics.metrics_processor import MetricsProcessor
+from openshift_metrics.metrics_store import MetricsStore
+from openshift_metrics.tests.test_columnar_processor import METRICS_TO_CHECK, merge, random_files
+
+
+class TestMetricsStore(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.store = MetricsStore(os.path.join(self.tmp_dir.name, "metrics.db"))
+        self.addCleanup(self.store.close)
+
+    def test_query_same_as_condensed(self):
+        files = random_files(random.Random(31), 3, with_intervals=True)
+        processor = merge(MetricsProcessor(), files)
+        expected = processor.condense_metrics(METRICS_TO_CHECK)
+
+        count = self.store.add_intervals(processor.iter_condensed_metrics(METRICS_TO_CHECK))
+        self.assertEqual(count, sum(len(pod["metrics"]) for pods in expected.values() for pod in pods.values()))
+        self.assertEqual(self.store.query(), expected)
+        self.assertEqual(self.store.get_namespaces(), list(expected))
+
+    def test_decimal_values(self):
+        files = random_files(random.Random(32), 2)
+        expected = merge(MetricsProcessor(), files).condense_metrics(METRICS_TO_CHECK)
+        compact = merge(CompactMetricsProcessor(), files)
+        self.store.add_intervals(compact.iter_condensed_metrics(METRICS_TO_CHECK))
+        self.assertEqual(utils.get_pod_rows(self.store.query()), utils.get_pod_rows(expected))
+
+    def test_query_namespaces_and_time_range(self):
+        processor = merge(MetricsProcessor(), random_files(random.Random(33), 2))
+        condensed = processor.condense_metrics(METRICS_TO_CHECK)
+        self.store.add_intervals(processor.iter_condensed_metrics(METRICS_TO_CHECK))
+
+        self.assertEqual(self.store.query(["ns3"]), {"ns3": condensed["ns3"]})
+
+        start, end = 20 * 900, 50 * 900
+        expected = {}
+        for pod, pod_dict in condensed["ns1"].items():
+            for start_time, metric_dict in pod_dict["metrics"].items():
+                end_time = start_time + metric_dict["duration"]
+                if end_time > start and start_time < end:
+                    clipped_start = max(start_time, start)
+                    clipped = dict(metric_dict, duration=min(end_time, end) - clipped_start)
+                    pod_metrics = expected.setdefault(pod, {"metrics": {}})
+                    pod_metrics["metrics"][clipped_start] = clipped
+                    if "label_nerc_mghpcc_org_class" in pod_dict:
+                        pod_metrics["label_nerc_mghpcc_org_class"] = pod_dict["label_nerc_mghpcc_org_class"]
+
+        result = self.store.query(["ns1"], start, end)
+        self.assertEqual(result, {"ns1": expected})
+        for pod_dict in result["ns1"].values():
+            for start_time, metric_dict in pod_dict["metrics"].items():
+                self.assertGreaterEqual(start_time, start)
+                self.assertLessEqual(start_time + metric_dict["duration"], end)
+
+        self.assertEqual(self.store.query(["missing"]), {})
+        self.assertEqual(self.store.query([]), {})
+
+    def _write_metrics_files(self, files):
+        paths = []
+        for index, file in enumerate(files):
+            path = os.path.join(self.tmp_dir.name, f"metrics-{index}.json")
+            with open(path, "w") as metrics_file:
+                json.dump(
+                    {
+                        "start_date": f"2024-01-0{index + 1}",
+                        "end_date": f"2024-01-0{index + 1}",
+                        "cpu_metrics": file["cpu_request"],
+                        "memory_metrics": file["memory_request"],
+                        "gpu_metrics": file["gpu_request"],
+                    },
+                    metrics_file,
+                )
+            paths.append(path)
+        return paths
+
+    def test_ingest_files(self):
+        files = random_files(random.Random(34), 3)
+        paths = self._write_metrics_files(files)
+        expected = merge(MetricsProcessor(), files).condense_metrics(METRICS_TO_CHECK)
+
+        self.assertGreater(self.store.ingest_files(paths), 0)
+        self.assertEqual(self.store.ingest_files(paths), 0)
+        self.assertEqual(utils.get_pod_rows(self.store.query()), utils.get_pod_rows(expected))
+        self.assertEqual(self.store.get_date_range(), ("2024-01-01", "2024-01-03"))
+
+        with MetricsStore(self.store.path) as reopened:
+            self.assertEqual(reopened.query(["ns2"]), self.store.query(["ns2"]))
+
+    def test_ingest_same_file_by_another_path(self):
+        paths = self._write_metrics_files(random_files(random.Random(36), 2))
+        self.assertGreater(self.store.ingest_files(paths), 0)
+        intervals = list(self.store.iter_intervals())
+
+        link = os.path.join(self.tmp_dir.name, "link.json")
+        os.symlink(paths[0], link)
+        other_paths = [link, os.path.join(self.tmp_dir.name, ".", os.path.basename(paths[1]))]
+        self.assertEqual(self.store.ingest_files(other_paths), 0)
+        self.assertEqual(list(self.store.iter_intervals()), intervals)
+
+    def test_overlapping_ingestion_is_rejected(self):
+        files = random_files(random.Random(37), 3)
+        paths = self._write_metrics_files(files)
+        self.assertGreater(self.store.ingest_files(paths[:2]), 0)
+        intervals = list(self.store.iter_intervals())
+
+        # the same day as the second file, downloaded again
+        copy = os.path.join(self.tmp_dir.name, "copy.json")
+        with open(paths[1]) as metrics_file, open(copy, "w") as copy_file:
+            copy_file.write(metrics_file.read())
+        with self.assertRaisesRegex(ValueError, "metrics-1.json"):
+            self.store.ingest_files([paths[2], copy])
+        self.assertEqual(list(self.store.iter_intervals()), intervals)
+
+        self.assertGreater(self.store.ingest_files(paths[2:]), 0)
+
+    def test_query_rejects_intervals_with_the_same_start(self):
+        processor = merge(MetricsProcessor(), random_files(random.Random(38), 1))
+        self.store.add_intervals(processor.iter_condensed_metrics(METRICS_TO_CHECK))
+        self.store.add_intervals(processor.iter_condensed_metrics(METRICS_TO_CHECK))
+        with self.assertRaisesRegex(ValueError, "overlapping intervals"):
+            self.store.query()
+
+    def test_failed_ingestion_adds_nothing(self):
+        paths = self._write_metrics_files(random_files(random.Random(35), 2))
+        # the files rows fail after the intervals were inserted
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.store.ingest_files(paths + paths[:1])
+        self.assertEqual(self.store.query(), {})
+        self.assertEqual(self.store.get_date_range(), (None, None))
+
+        self.assertGreater(self.store.ingest_files(paths), 0)
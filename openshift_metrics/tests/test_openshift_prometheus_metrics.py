@@ -0,0 +1,153 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+from unittest import TestCase, mock
+
+from openshift_metrics import openshift_prometheus_metrics
+from openshift_metrics.utils import EmptyResultError, PartialResponseError, QueryLimitError
+
+CPU = {"metric": {"pod": "pod1", "namespace": "ns1", "node": "wrk-1", "unit": "cores", "resource": "cpu"}, "values": [[0, "1"]]}
+MEMORY = {"metric": {"pod": "pod1", "namespace": "ns1", "node": "wrk-1", "unit": "bytes", "resource": "memory"}, "values": [[0, "2"]]}
+GPU = {"metric": {"pod": "pod1", "namespace": "ns1", "node": "wrk-1", "unit": "integer", "resource": "nvidia.com/gpu"}, "values": [[0, "1"]]}
+POD_LABEL = {"metric": {"pod": "pod1", "namespace": "ns1", "label_nerc_mghpcc_org_class": "student"}, "values": [[0, "1"]]}
+NODE_LABEL = {"metric": {"node": "wrk-1", "label_nvidia_com_gpu_product": "A100"}, "values": [[0, "1"]]}
+
+
+def collect_metrics(prom_client, server_side_joins=False):
+    """Collects the metrics of 2024-03-01 into a metrics dict"""
+    metrics_dict = {"start_date": "2024-03-01", "end_date": "2024-03-01"}
+
+    def write_section(name, series):
+        metrics_dict[name] = list(series)
+
+    asyncio.run(
+        openshift_prometheus_metrics.collect_metrics_async(
+            prom_client, "2024-03-01", "2024-03-01", write_section, server_side_joins
+        )
+    )
+    return metrics_dict
+
+
+class TestCollectMetrics(TestCase):
+
+    def _mock_client(self, server_side_result):
+        def iter_metric(metric, start_date, end_date):
+            if metric == openshift_prometheus_metrics.RESOURCE_REQUEST_WITH_LABELS:
+                if isinstance(server_side_result, Exception):
+                    raise server_side_result
+                return iter(server_side_result)
+            return iter([dict(CPU, metric=dict(CPU["metric"])), MEMORY, dict(GPU, metric=dict(GPU["metric"]))])
+
+        def query_metric(metric, start_date, end_date):
+            if metric == openshift_prometheus_metrics.KUBE_POD_LABELS:
+                return [POD_LABEL]
+            return [NODE_LABEL]
+
+        prom_client = mock.Mock()
+        prom_client.iter_metric.side_effect = iter_metric
+        prom_client.query_metric.side_effect = query_metric
+        return prom_client
+
+    def test_client_side_joins(self):
+        prom_client = self._mock_client([])
+        metrics_dict = collect_metrics(prom_client)
+        self.assertEqual(metrics_dict["cpu_metrics"][0]["metric"]["label_nerc_mghpcc_org_class"], "student")
+        self.assertEqual(metrics_dict["memory_metrics"], [MEMORY])
+        self.assertEqual(metrics_dict["gpu_metrics"][0]["metric"]["label_nvidia_com_gpu_product"], "A100")
+        self.assertEqual(prom_client.query_metric.call_count, 2)
+
+    def test_server_side_joins(self):
+        joined_cpu = dict(CPU, metric=dict(CPU["metric"], label_nerc_mghpcc_org_class="student"))
+        prom_client = self._mock_client([joined_cpu, MEMORY])
+        metrics_dict = collect_metrics(prom_client, server_side_joins=True)
+        self.assertEqual(
+            metrics_dict,
+            {
+                "start_date": "2024-03-01",
+                "end_date": "2024-03-01",
+                "cpu_metrics": [joined_cpu],
+                "memory_metrics": [MEMORY],
+            },
+        )
+        prom_client.query_metric.assert_not_called()
+
+    def test_server_side_joins_fallback(self):
+        for error in (EmptyResultError(), QueryLimitError(), PartialResponseError()):
+            prom_client = self._mock_client(error)
+            metrics_dict = collect_metrics(prom_client, server_side_joins=True)
+            self.assertEqual(metrics_dict["cpu_metrics"][0]["metric"]["label_nerc_mghpcc_org_class"], "student")
+            self.assertEqual(metrics_dict["gpu_metrics"][0]["metric"]["label_nvidia_com_gpu_product"], "A100")
+
+    def test_server_side_joins_keep_unlabeled_requests(self):
+        # requests without a label series at a step are added back to each join
+        query = openshift_prometheus_metrics.RESOURCE_REQUEST_WITH_LABELS
+        pod_labels_join = openshift_prometheus_metrics.RESOURCE_REQUEST_WITH_POD_LABELS
+        self.assertTrue(
+            query.endswith(f"or ignoring(label_nvidia_com_gpu_product, label_nvidia_com_gpu_machine) ({pod_labels_join})")
+        )
+        self.assertTrue(
+            pod_labels_join.endswith(
+                f"or ignoring(label_nerc_mghpcc_org_class) ({openshift_prometheus_metrics.RESOURCE_REQUEST})"
+            )
+        )
+
+    def test_queries_run_concurrently(self):
+        prom_client = self._mock_client([])
+        iter_metric = prom_client.iter_metric.side_effect
+        query_metric = prom_client.query_metric.side_effect
+        labels_queried = threading.Event()
+
+        def wait_for_labels(metric, start_date, end_date):
+            self.assertTrue(labels_queried.wait(timeout=5))
+            return iter_metric(metric, start_date, end_date)
+
+        def query_labels(metric, start_date, end_date):
+            labels_queried.set()
+            return query_metric(metric, start_date, end_date)
+
+        prom_client.iter_metric.side_effect = wait_for_labels
+        prom_client.query_metric.side_effect = query_labels
+        metrics_dict = collect_metrics(prom_client)
+        self.assertEqual(metrics_dict["memory_metrics"], [MEMORY])
+
+
+class TestCollectMetricsToFile(TestCase):
+
+    def test_write_sections(self):
+        prom_client = TestCollectMetrics()._mock_client([])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = os.path.join(tmp_dir, "metrics.json")
+            openshift_prometheus_metrics.collect_metrics_to_file(prom_client, "2024-03-01", "2024-03-01", output_file)
+            with open(output_file) as file:
+                metrics_dict = json.load(file)
+
+        self.assertEqual(metrics_dict["start_date"], "2024-03-01")
+        self.assertEqual(metrics_dict["end_date"], "2024-03-01")
+        self.assertEqual(metrics_dict["memory_metrics"], [MEMORY])
+        self.assertEqual(metrics_dict["cpu_metrics"][0]["metric"]["label_nerc_mghpcc_org_class"], "student")
+        self.assertEqual(metrics_dict["gpu_metrics"][0]["metric"]["label_nvidia_com_gpu_product"], "A100")
+
+    def test_write_intervals(self):
+        prom_client = TestCollectMetrics()._mock_client([])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = os.path.join(tmp_dir, "metrics.json")
+            openshift_prometheus_metrics.collect_metrics_to_file(
+                prom_client, "2024-03-01", "2024-03-01", output_file, intervals_step_min=15
+            )
+            with open(output_file) as file:
+                metrics_dict = json.load(file)
+
+        self.assertEqual(
+            metrics_dict["memory_metrics"], [{"metric": MEMORY["metric"], "intervals": [[0, 900, "2"]]}]
+        )
+
+    def test_no_file_on_failure(self):
+        prom_client = TestCollectMetrics()._mock_client([])
+        prom_client.iter_metric.side_effect = EmptyResultError()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = os.path.join(tmp_dir, "metrics.json")
+            with self.assertRaises(EmptyResultError):
+                openshift_prometheus_metrics.collect_metrics_to_file(prom_client, "2024-03-01", "2024-03-01", output_file)
+            self.assertEqual(os.listdir(tmp_dir), [])
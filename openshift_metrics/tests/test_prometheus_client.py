@@ -1,21 +1,35 @@
+import json
+from datetime import datetime, timedelta
 from requests.exceptions import ConnectionError
 from unittest import TestCase, mock
 
-from openshift_metrics.prometheus_client import PrometheusClient
+from openshift_metrics.prometheus_client import (
+    PrometheusClient, QueryRangeStream, ChangePointClient, intervals_to_values, values_to_intervals
+)
+from openshift_metrics.metrics_processor import MetricsProcessor
+from openshift_metrics.openshift_prometheus_metrics import RESOURCE_REQUEST_WITH_LABELS
+from openshift_metrics.utils import EmptyResultError, PartialResponseError, QueryLimitError
+
+
+def mock_query_range_response(result, chunk_size=7):
+    body = json.dumps({"status": "success", "data": {"resultType": "matrix", "result": result}}).encode()
+    mock_response = mock.Mock(status_code=200)
+    mock_response.iter_content.return_value = [
+        body[i:i + chunk_size] for i in range(0, len(body), chunk_size)
+    ]
+    mock_response.raw.tell.return_value = len(body) // 4
+    return mock_response
+
 
 class TestQueryMetric(TestCase):
 
     @mock.patch('requests.Session.get')
     @mock.patch('time.sleep')
     def test_query_metric(self, mock_sleep, mock_get):
-        mock_response = mock.Mock(status_code=200)
-        mock_response.json.return_value = {"data": {
-            "result": "this is data"
-        }}
-        mock_get.return_value = mock_response
+        mock_get.return_value = mock_query_range_response(["this is data"])
         prom_client = PrometheusClient('https://fake-url', 'fake-token')
         metrics = prom_client.query_metric('fake-metric', '2022-03-14', '2022-03-14')
-        self.assertEqual(metrics, "this is data")
+        self.assertEqual(metrics, ["this is data"])
         self.assertEqual(mock_get.call_count, 1)
 
     @mock.patch('requests.Session.get')
@@ -35,3 +49,450 @@ class TestQueryMetric(TestCase):
         self.assertRaises(ConnectionError, prom_client.query_metric,
                   'fake-metric', '2022-03-14', '2022-03-14')
         self.assertEqual(mock_get.call_count, 1)
+
+    @mock.patch('requests.Session.get')
+    @mock.patch('time.sleep')
+    def test_query_metric_windows(self, mock_sleep, mock_get):
+        def fake_get(url, **kwargs):
+            if "start=2022-03-14T00:00:00Z&end=2022-03-14T11:59:59Z" in url:
+                result = [
+                    {"metric": {"pod": "pod1"}, "values": [[1647216000, "1"]]},
+                ]
+            else:
+                result = [
+                    {"metric": {"pod": "pod2"}, "values": [[1647259200, "3"]]},
+                    {"metric": {"pod": "pod1"}, "values": [[1647259200, "2"]]},
+                ]
+            return mock_query_range_response(result)
+
+        mock_get.side_effect = fake_get
+        prom_client = PrometheusClient('https://fake-url', 'fake-token', window_hours=12)
+        metrics = prom_client.query_metric('fake-metric', '2022-03-14', '2022-03-14')
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(metrics, [
+            {"metric": {"pod": "pod1"}, "values": [[1647216000, "1"], [1647259200, "2"]]},
+            {"metric": {"pod": "pod2"}, "values": [[1647259200, "3"]]},
+        ])
+
+    def test_get_windows(self):
+        prom_client = PrometheusClient('https://fake-url', 'fake-token', window_hours=5)
+        windows = prom_client._get_windows('2022-03-14', '2022-03-14')
+        self.assertEqual(len(windows), 5)
+        self.assertEqual(windows[0], (1647216000, 1647216000 + 5 * 3600 - 1))
+        self.assertEqual(windows[-1], (1647216000 + 20 * 3600, 1647302399))
+
+        prom_client = PrometheusClient('https://fake-url', 'fake-token', step_min=25, window_hours=1)
+        windows = prom_client._get_windows('2022-03-14', '2022-03-14')
+        self.assertEqual(windows[0], (1647216000, 1647216000 + 50 * 60 - 1))
+
+        # the days don't start on a multiple of 7 minutes since the epoch
+        prom_client = PrometheusClient('https://fake-url', 'fake-token', step_min=7)
+        range_start, range_end = prom_client._get_range('2022-03-14', '2022-03-15')
+        windows = prom_client._get_windows('2022-03-14', '2022-03-15')
+        self.assertEqual(windows[0][0], range_start)
+        self.assertEqual(windows[-1][1], range_end)
+        for (_, window_end), (next_start, _) in zip(windows, windows[1:]):
+            self.assertEqual(next_start, window_end + 1)
+            self.assertEqual((next_start - range_start) % (7 * 60), 0)
+
+    @mock.patch('requests.Session.get')
+    @mock.patch('time.sleep')
+    def test_query_metric_reuses_session(self, mock_sleep, mock_get):
+        mock_get.side_effect = lambda *args, **kwargs: mock_query_range_response(["data"])
+        prom_client = PrometheusClient('https://fake-url', 'fake-token')
+        session = prom_client.session
+        prom_client.query_metric('fake-metric', '2022-03-14', '2022-03-14')
+        prom_client.query_metric('other-metric', '2022-03-14', '2022-03-14')
+        self.assertIs(prom_client.session, session)
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(session.headers["Authorization"], "Bearer fake-token")
+
+    @mock.patch('requests.Session.get')
+    @mock.patch('time.sleep')
+    def test_iter_metric(self, mock_sleep, mock_get):
+        mock_get.side_effect = lambda *args, **kwargs: mock_query_range_response(
+            [{"metric": {"pod": "pod1"}, "values": [[0, "1"]]}]
+        )
+        prom_client = PrometheusClient('https://fake-url', 'fake-token')
+        metrics = prom_client.iter_metric('fake-metric', '2022-03-14', '2022-03-15')
+        self.assertEqual(mock_get.call_count, 0)
+        self.assertEqual(list(metrics), [
+            {"metric": {"pod": "pod1"}, "values": [[0, "1"]]},
+            {"metric": {"pod": "pod1"}, "values": [[0, "1"]]},
+        ])
+        self.assertEqual(mock_get.call_count, 2)
+
+    @mock.patch('requests.Session.get')
+    @mock.patch('time.sleep')
+    def test_iter_metric_empty(self, mock_sleep, mock_get):
+        mock_get.side_effect = lambda *args, **kwargs: mock_query_range_response([])
+        prom_client = PrometheusClient('https://fake-url', 'fake-token')
+        with self.assertRaises(EmptyResultError):
+            list(prom_client.iter_metric('fake-metric', '2022-03-14', '2022-03-14'))
+        self.assertEqual(mock_get.call_count, 3)
+
+
+class TestQueryRangeStream(TestCase):
+
+    def test_stream_series(self):
+        response = {
+            "status": "success",
+            "data": {
+                "resultType": "matrix",
+                "result": [
+                    {"metric": {"pod": "pod1", "label": "weird \\\"]} value"}, "values": [[0, "1"], [60, "2"]]},
+                    {"metric": {"pod": "pöd2"}, "values": [[0, "3"]]},
+                ],
+            },
+            "warnings": ["partial response"],
+        }
+        body = json.dumps(response, indent=1, ensure_ascii=False).encode()
+
+        for chunk_size in [1, 5, len(body)]:
+            chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+            stream = QueryRangeStream(chunks)
+            self.assertEqual(list(stream), response["data"]["result"])
+            self.assertEqual(stream.envelope["warnings"], ["partial response"])
+            self.assertEqual(stream.envelope["data"]["result"], [])
+
+    def test_stream_error_response(self):
+        body = b'{"status": "error", "errorType": "bad_data", "error": "parse error"}'
+        stream = QueryRangeStream([body[:10], body[10:]])
+        self.assertEqual(list(stream), [])
+        self.assertEqual(stream.envelope["error"], "parse error")
+
+    def test_stream_truncated(self):
+        body = b'{"status": "success", "data": {"result": [{"metric": {}, "values": [[0, "1"]'
+        with self.assertRaises(ValueError):
+            list(QueryRangeStream([body]))
+
+
+class TestConnectionStats(TestCase):
+
+    def test_connection_stats(self):
+        prom_client = PrometheusClient('https://fake-url', 'fake-token')
+        adapter = prom_client.session.get_adapter('https://fake-url')
+        pool = adapter.poolmanager.connection_from_url('https://fake-url')
+        pool.num_requests = 5
+        pool.num_connections = 2
+        self.assertEqual(
+            prom_client.connection_stats(),
+            {
+                "requests": 5,
+                "connections": 2,
+                "reused": 3,
+                "concurrency_limit": 4,
+                "queue_depth": 0,
+                "compressed_bytes": 0,
+                "uncompressed_bytes": 0,
+            },
+        )
+
+
+    @mock.patch('requests.Session.get')
+    def test_transfer_stats(self, mock_get):
+        result = [{"metric": {"pod": "pod1"}, "values": [[0, "1"]]}]
+        mock_get.return_value = mock_query_range_response(result)
+        prom_client = PrometheusClient('https://fake-url', 'fake-token')
+        prom_client.query_metric('fake-metric', '2024-01-01', '2024-01-01')
+
+        body_size = len(json.dumps({"status": "success", "data": {"resultType": "matrix", "result": result}}))
+        stats = prom_client.connection_stats()
+        self.assertEqual(stats["uncompressed_bytes"], body_size)
+        self.assertEqual(stats["compressed_bytes"], body_size // 4)
+        self.assertIn("gzip", prom_client.session.headers["Accept-Encoding"])
+
+
+class TestThrottling(TestCase):
+
+    @mock.patch('time.sleep')
+    @mock.patch('requests.Session.get')
+    def test_retry_after(self, mock_get, mock_sleep):
+        throttled = mock.Mock(status_code=429, reason="Too Many Requests", headers={"Retry-After": "30"})
+        mock_get.side_effect = [throttled, mock_query_range_response([{"metric": {"pod": "pod1"}, "values": [[0, "1"]]}])]
+        prom_client = PrometheusClient('https://fake-url', 'fake-token', max_workers=4)
+
+        result = prom_client.query_metric('fake-metric', '2024-01-01', '2024-01-01')
+
+        self.assertEqual(result, [{"metric": {"pod": "pod1"}, "values": [[0, "1"]]}])
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertAlmostEqual(mock_sleep.call_args[0][0], 30, delta=1)
+        self.assertEqual(prom_client.limiter.limit, 2)
+
+
+    @mock.patch('time.sleep')
+    @mock.patch('requests.Session.get')
+    def test_slot_held_until_body_is_read(self, mock_get, mock_sleep):
+        result = [{"metric": {"pod": f"pod{i}"}, "values": [[0, "1"]]} for i in range(3)]
+        prom_client = PrometheusClient('https://fake-url', 'fake-token', max_workers=4)
+        in_flight = []
+
+        def fake_get(url, **kwargs):
+            response = mock_query_range_response(result)
+            chunks = response.iter_content.return_value
+
+            def iter_content(chunk_size):
+                for chunk in chunks:
+                    in_flight.append(prom_client.limiter.in_flight)
+                    yield chunk
+
+            response.iter_content.side_effect = iter_content
+            return response
+
+        mock_get.side_effect = fake_get
+        self.assertEqual(len(list(prom_client.iter_metric('fake-metric', '2024-01-01', '2024-01-01'))), 3)
+        self.assertEqual(set(in_flight), {1})
+        self.assertEqual(prom_client.limiter.in_flight, 0)
+
+
+class TestChangePoints(TestCase):
+
+    @staticmethod
+    def _change_points(samples, range_start, range_end, step):
+        """Returns what prometheus would for the instant and change points queries"""
+        values = dict(samples)
+        initial = []
+        if range_start in values:
+            initial.append({"metric": {"__name__": "m", "pod": "pod1"}, "value": [range_start, values[range_start]]})
+
+        change_points = {"start": [], "change": [], "end": []}
+        for epoch_time in range(range_start, range_end + 1, step):
+            current = values.get(epoch_time)
+            previous = values.get(epoch_time - step)
+            if current is not None and previous is None:
+                change_points["start"].append([epoch_time, current])
+            elif current is not None and current != previous:
+                change_points["change"].append([epoch_time, current])
+            elif current is None and previous is not None:
+                change_points["end"].append([epoch_time, previous])
+        return initial, [
+            {"metric": {"pod": "pod1", "change_point": change_point}, "values": values}
+            for change_point, values in change_points.items() if values
+        ]
+
+    def test_change_points_to_intervals(self):
+        step = 900
+        range_start = 1647216000
+        range_end = range_start + 86399
+        last_step = range_end - range_end % step
+        grid = list(range(range_start - 2 * step, last_step + step, step))
+
+        test_cases = [
+            [(t, "1") for t in grid],
+            [(t, "1") for t in grid[5:20]],
+            [(t, "1") for t in grid[:10]] + [(t, "2") for t in grid[10:30]] + [(t, "2") for t in grid[40:]],
+            [(t, "1") for t in grid[2:3]] + [(t, "3") for t in grid[3:4]] + [(t, "1") for t in grid[4:-1]],
+            [(t, "1") for t in grid[:2]] + [(t, "4") for t in grid[2:50]],
+        ]
+        for samples in test_cases:
+            initial, change_points = self._change_points(samples, range_start, range_end, step)
+            intervals = PrometheusClient._change_points_to_intervals(
+                initial, change_points, range_start, last_step, step
+            )
+
+            processor = MetricsProcessor(interval_minutes=15)
+            processor.merge_metrics(
+                "cpu_request",
+                [{"metric": {"pod": "pod1", "namespace": "ns"}, "values": [s for s in samples if s[0] >= range_start]}],
+            )
+            condensed = processor.condense_metrics(["cpu_request"])["ns"]["pod1"]["metrics"]
+            expected = [[start, metric["duration"], metric["cpu_request"]] for start, metric in condensed.items()]
+
+            self.assertEqual(intervals, [{"metric": {"pod": "pod1"}, "intervals": expected}])
+            self.assertEqual(
+                intervals_to_values(intervals[0], 15)["values"],
+                [list(s) for s in samples if s[0] >= range_start],
+            )
+            self.assertEqual(
+                values_to_intervals(intervals_to_values(intervals[0], 15), 15),
+                intervals[0],
+            )
+
+    @mock.patch('requests.Session.get')
+    @mock.patch('time.sleep')
+    def test_change_point_client(self, mock_sleep, mock_get):
+        def fake_get(url, **kwargs):
+            if "/api/v1/query?" in url:
+                return mock_query_range_response(
+                    [{"metric": {"pod": "pod1"}, "value": [1647216000, "1"]}]
+                )
+            return mock_query_range_response([
+                {"metric": {"pod": "pod1", "change_point": "change"}, "values": [[1647217800, "2"]]},
+                {"metric": {"pod": "pod1", "change_point": "end"}, "values": [[1647219600, "2"]]},
+            ])
+
+        mock_get.side_effect = fake_get
+        prom_client = PrometheusClient('https://fake-url', 'fake-token')
+        metrics = list(ChangePointClient(prom_client).iter_metric('fake-metric', '2022-03-14', '2022-03-14'))
+        self.assertEqual(metrics, [{
+            "metric": {"pod": "pod1"},
+            "values": [[1647216000, "1"], [1647216900, "1"], [1647217800, "2"], [1647218700, "2"]],
+        }])
+        self.assertIn("change_point", mock_get.call_args_list[0].args[0])
+
+        mock_get.reset_mock()
+        metrics = list(
+            ChangePointClient(prom_client, expand_intervals=False).iter_metric('fake-metric', '2022-03-14', '2022-03-14')
+        )
+        self.assertEqual(metrics, [{
+            "metric": {"pod": "pod1"},
+            "intervals": [[1647216000, 1800, "1"], [1647217800, 1800, "2"]],
+        }])
+
+    def test_values_to_intervals(self):
+        series = {
+            "metric": {"pod": "pod1"},
+            "values": [[0, "1"], [900, "1"], [1800, "2"], [3600, "2"], [4500, "2"], [5400, "1"]],
+        }
+        self.assertEqual(
+            values_to_intervals(series, 15),
+            {"metric": {"pod": "pod1"}, "intervals": [[0, 1800, "1"], [1800, 900, "2"], [3600, 1800, "2"], [5400, 900, "1"]]},
+        )
+
+
+class TestQueryLimits(TestCase):
+
+    @mock.patch('requests.Session.get')
+    @mock.patch('time.sleep')
+    def test_split_window_on_limit_error(self, mock_sleep, mock_get):
+        def fake_get(url, **kwargs):
+            if "start=2022-03-14T00:00:00Z&end=2022-03-14T23:59:59Z" in url:
+                mock_response = mock.Mock(status_code=422, reason="Unprocessable Entity")
+                mock_response.json.return_value = {
+                    "status": "error",
+                    "error": "query processing would load too many samples into memory in query execution",
+                }
+                return mock_response
+            if "start=2022-03-14T00:00:00Z&end=2022-03-14T11:59:59Z" in url:
+                return mock_query_range_response([{"metric": {"pod": "pod1"}, "values": [[1647216000, "1"]]}])
+            if "start=2022-03-14T12:00:00Z&end=2022-03-14T23:59:59Z" in url:
+                return mock_query_range_response([{"metric": {"pod": "pod1"}, "values": [[1647259200, "2"]]}])
+            raise AssertionError(f"Unexpected url {url}")
+
+        mock_get.side_effect = fake_get
+        prom_client = PrometheusClient('https://fake-url', 'fake-token')
+        expected = [{"metric": {"pod": "pod1"}, "values": [[1647216000, "1"], [1647259200, "2"]]}]
+        self.assertEqual(prom_client.query_metric('fake-metric', '2022-03-14', '2022-03-14'), expected)
+        self.assertEqual(mock_get.call_count, 3)
+
+        self.assertEqual(
+            list(prom_client.iter_metric('fake-metric', '2022-03-14', '2022-03-14')),
+            [{"metric": {"pod": "pod1"}, "values": [[1647216000, "1"]]},
+             {"metric": {"pod": "pod1"}, "values": [[1647259200, "2"]]}],
+        )
+
+    @mock.patch('requests.Session.get')
+    @mock.patch('time.sleep')
+    def test_split_window_on_partial_response(self, mock_sleep, mock_get):
+        def fake_get(url, **kwargs):
+            result = [{"metric": {"pod": "pod1"}, "values": [[1647216000, "1"]]}]
+            mock_response = mock_query_range_response(result)
+            if "end=2022-03-14T23:59:59Z" in url and "start=2022-03-14T00:00:00Z" in url:
+                body = json.dumps({"status": "success", "data": {"result": result}, "warnings": ["store unavailable"]})
+                mock_response.iter_content.return_value = [body.encode()]
+            return mock_response
+
+        mock_get.side_effect = fake_get
+        prom_client = PrometheusClient('https://fake-url', 'fake-token', min_window_minutes=720)
+        self.assertEqual(
+            prom_client.query_metric('fake-metric', '2022-03-14', '2022-03-14'),
+            [{"metric": {"pod": "pod1"}, "values": [[1647216000, "1"], [1647216000, "1"]]}],
+        )
+        self.assertEqual(mock_get.call_count, 3)
+
+        # the series of the partial response aren't yielded, only those of its halves
+        self.assertEqual(
+            list(prom_client.iter_metric('fake-metric', '2022-03-14', '2022-03-14')),
+            [{"metric": {"pod": "pod1"}, "values": [[1647216000, "1"]]}] * 2,
+        )
+        self.assertEqual(mock_get.call_count, 6)
+
+    @mock.patch('requests.Session.get')
+    @mock.patch('time.sleep')
+    def test_partial_response_after_limit_splits(self, mock_sleep, mock_get):
+        def fake_get(url, **kwargs):
+            start, end = (datetime.strptime(url.split(f"{name}=")[1][:20], "%Y-%m-%dT%H:%M:%SZ") for name in ("start", "end"))
+            if end - start > timedelta(hours=6):
+                mock_response = mock.Mock(status_code=422, reason="Unprocessable Entity")
+                mock_response.json.return_value = {"status": "error", "error": "exceeded maximum resolution"}
+                return mock_response
+            mock_response = mock_query_range_response([{"metric": {"pod": "pod1"}, "values": [[1647216000, "1"]]}])
+            if "start=2022-03-14T00:00:00Z&end=2022-03-14T05:59:59Z" in url:
+                body = json.dumps({"status": "success", "data": {"result": []}, "warnings": ["store unavailable"]})
+                mock_response.iter_content.return_value = [body.encode()]
+            return mock_response
+
+        mock_get.side_effect = fake_get
+        prom_client = PrometheusClient('https://fake-url', 'fake-token')
+        # two splits for the limits don't count against the splits of the partial response
+        self.assertEqual(len(list(prom_client.iter_metric('fake-metric', '2022-03-14', '2022-03-14'))), 3 + 2)
+        self.assertEqual(mock_get.call_count, 1 + 2 + 4 + 2)
+
+    @mock.patch('requests.Session.get')
+    @mock.patch('time.sleep')
+    def test_persistent_partial_response(self, mock_sleep, mock_get):
+        def fake_get(url, **kwargs):
+            mock_response = mock_query_range_response([])
+            body = json.dumps({"status": "success", "data": {"result": []}, "warnings": ["store unavailable"]})
+            mock_response.iter_content.return_value = [body.encode()]
+            return mock_response
+
+        mock_get.side_effect = fake_get
+        prom_client = PrometheusClient('https://fake-url', 'fake-token', namespace_shards=2)
+        with self.assertRaises(PartialResponseError):
+            list(prom_client.iter_metric('kube_pod_resource_request', '2022-03-14', '2022-03-14'))
+        # the window, its first half and the first quarter, which isn't split again
+        self.assertEqual(mock_get.call_count, 3)
+
+    @mock.patch('requests.Session.get')
+    @mock.patch('time.sleep')
+    def test_shard_by_namespace(self, mock_sleep, mock_get):
+        def fake_get(url, **kwargs):
+            if "namespace" not in url:
+                mock_response = mock.Mock(status_code=400, reason="Bad Request")
+                mock_response.json.return_value = {"error": "exceeded maximum resolution of 11,000 points"}
+                return mock_response
+            return mock_query_range_response([{"metric": {"pod": url.split('namespace=~"[')[1][0]}, "values": []}])
+
+        mock_get.side_effect = fake_get
+        prom_client = PrometheusClient('https://fake-url', 'fake-token', min_window_minutes=1440, namespace_shards=2)
+        metrics = prom_client.query_metric('kube_pod_resource_request{unit="cores"}', '2022-03-14', '2022-03-14')
+        self.assertEqual([m["metric"]["pod"] for m in metrics], ["0", "i"])
+
+        # a query without namespaced selectors isn't sharded, each shard would return every series
+        mock_get.reset_mock()
+        self.assertRaises(QueryLimitError, prom_client.query_metric, 'kube_node_labels', '2022-03-14', '2022-03-14')
+        self.assertEqual(mock_get.call_count, 1)
+
+        prom_client = PrometheusClient('https://fake-url', 'fake-token', min_window_minutes=1440)
+        self.assertRaises(
+            QueryLimitError, prom_client.query_metric, 'kube_pod_resource_request{}', '2022-03-14', '2022-03-14'
+        )
+
+    def test_shard_query(self):
+        self.assertEqual(
+            PrometheusClient._shard_query(
+                'kube_pod_resource_request{unit="cores"} unless on(pod) kube_pod_labels or kube_pod_labels{ }',
+                "[a-m].*",
+            ),
+            'kube_pod_resource_request{namespace=~"[a-m].*", unit="cores"} unless on(pod) '
+            'kube_pod_labels{namespace=~"[a-m].*"} or kube_pod_labels{namespace=~"[a-m].*"}',
+        )
+        self.assertIsNone(PrometheusClient._shard_query('kube_node_labels{label_x!=""}', "[a-m].*"))
+
+    def test_shard_query_with_label_joins(self):
+        sharded = PrometheusClient._shard_query(RESOURCE_REQUEST_WITH_LABELS, "[a-m].*")
+        matcher = 'namespace=~"[a-m].*"'
+        self.assertEqual(sharded.count(matcher), sharded.count("kube_pod_resource_request") + sharded.count("kube_pod_labels"))
+        # kube_node_labels has no namespace label, so its selectors are left as they are
+        self.assertEqual(sharded.count("kube_node_labels"), RESOURCE_REQUEST_WITH_LABELS.count("kube_node_labels"))
+        self.assertIn('kube_node_labels{label_nvidia_com_gpu_product!=""}', sharded)
+        self.assertIn("group by (node) (kube_node_labels)", sharded)
+        self.assertIn("kube_pod_status_unschedulable", sharded)
+        self.assertIn(f'kube_pod_resource_request{{{matcher}, unit=~"cores|bytes", node!=""}}', sharded)
+        self.assertIn(f"group by (namespace, pod) (kube_pod_labels{{{matcher}}})", sharded)
+        prom_client = PrometheusClient('https://fake-url', 'fake-token', namespace_shards=4)
+        self.assertEqual(
+            prom_client._namespace_shard_patterns(),
+            ["[012345678].*", "[9abcdefgh].*", "[ijklmnopq].*", "[rstuvwxyz].*"],
+        )
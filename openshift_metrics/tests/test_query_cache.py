@@ -0,0 +1,97 @@
+import os
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from openshift_metrics.query_cache import QueryCache
+from openshift_metrics.prometheus_client import PrometheusClient
+from openshift_metrics.tests.test_prometheus_client import mock_query_range_response
+
+SOURCE = "https://prometheus/api/v1/query_range?partial_response=false"
+
+
+class TestQueryCache(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = QueryCache(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_put_get(self):
+        series = [{"metric": {"pod": "pod1"}, "values": [[0, "1"]]}]
+        self.assertIsNone(self.cache.get(SOURCE, "query", 15, 0, 899))
+        self.cache.put(SOURCE, "query", 15, 0, 899, series)
+        self.assertEqual(self.cache.get(SOURCE, "query", 15, 0, 899), series)
+        self.assertIsNone(self.cache.get(SOURCE, "query", 5, 0, 899))
+        self.assertIsNone(self.cache.get(SOURCE, "other-query", 15, 0, 899))
+        self.assertIsNone(self.cache.get("https://other/api/v1/query_range?partial_response=false", "query", 15, 0, 899))
+        self.assertIsNone(self.cache.get("https://prometheus/api/v1/query_range?partial_response=true", "query", 15, 0, 899))
+
+    def test_get_window_evicted_after_reading(self):
+        series = [{"metric": {"pod": "pod1"}, "values": [[0, "1"]]}]
+        self.cache.put(SOURCE, "query", 15, 0, 899, series)
+        with mock.patch("os.utime", side_effect=FileNotFoundError):
+            self.assertEqual(self.cache.get(SOURCE, "query", 15, 0, 899), series)
+
+    def test_put_skips_recent_and_empty_windows(self):
+        now = int(time.time())
+        self.cache.put(SOURCE, "query", 15, now - 900, now, [{"metric": {}, "values": []}])
+        self.cache.put(SOURCE, "query", 15, 0, 899, [])
+        self.assertIsNone(self.cache.get(SOURCE, "query", 15, now - 900, now))
+        self.assertIsNone(self.cache.get(SOURCE, "query", 15, 0, 899))
+
+    def test_invalidate(self):
+        self.cache.put(SOURCE, "query", 15, 0, 899, ["data"])
+        self.cache.put("other-source", "query", 15, 0, 899, ["data"])
+        self.cache.put(SOURCE, "other-query", 15, 0, 899, ["data"])
+        self.cache.invalidate("query")
+        self.assertIsNone(self.cache.get(SOURCE, "query", 15, 0, 899))
+        self.assertIsNone(self.cache.get("other-source", "query", 15, 0, 899))
+        self.assertEqual(self.cache.get(SOURCE, "other-query", 15, 0, 899), ["data"])
+        self.cache.invalidate()
+        self.assertIsNone(self.cache.get(SOURCE, "other-query", 15, 0, 899))
+        self.assertEqual(self.cache.size(), 0)
+
+    def test_evict_least_recently_used(self):
+        self.cache.put(SOURCE, "query", 15, 0, 899, ["data"])
+        self.cache.put(SOURCE, "query", 15, 900, 1799, ["data"])
+        self.cache.put(SOURCE, "query", 15, 1800, 2699, ["data"])
+        entry_size = self.cache.size() // 3
+        for i, path in enumerate(
+            [self.cache._path(SOURCE, "query", 15, 900, 1799), self.cache._path(SOURCE, "query", 15, 0, 899),
+             self.cache._path(SOURCE, "query", 15, 1800, 2699)]
+        ):
+            os.utime(path, (1000 + i, 1000 + i))
+
+        self.cache.evict(entry_size * 2)
+        self.assertIsNone(self.cache.get(SOURCE, "query", 15, 900, 1799))
+        self.assertEqual(self.cache.get(SOURCE, "query", 15, 0, 899), ["data"])
+        self.assertEqual(self.cache.get(SOURCE, "query", 15, 1800, 2699), ["data"])
+
+    @mock.patch('requests.Session.get')
+    @mock.patch('time.sleep')
+    def test_client_fetches_missing_windows(self, mock_sleep, mock_get):
+        mock_get.side_effect = lambda *args, **kwargs: mock_query_range_response(
+            [{"metric": {"pod": "pod1"}, "values": [[1647302400, "2"]]}]
+        )
+        source = "https://fake-url/api/v1/query_range?partial_response=false"
+        self.cache.put(
+            source, "fake-metric", 15, 1647216000, 1647302399,
+            [{"metric": {"pod": "pod1"}, "values": [[1647216000, "1"]]}],
+        )
+        prom_client = PrometheusClient('https://fake-url', 'fake-token', cache=self.cache)
+        metrics = prom_client.query_metric('fake-metric', '2022-03-14', '2022-03-15')
+
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertIn("start=2022-03-15T00:00:00Z", mock_get.call_args.args[0])
+        self.assertEqual(metrics, [
+            {"metric": {"pod": "pod1"}, "values": [[1647216000, "1"], [1647302400, "2"]]},
+        ])
+        self.assertIsNotNone(self.cache.get(source, "fake-metric", 15, 1647302400, 1647388799))
+
+        # results cached for another prometheus aren't used
+        prom_client = PrometheusClient('https://other-url', 'fake-token', cache=self.cache)
+        prom_client.query_metric('fake-metric', '2022-03-14', '2022-03-15')
+        self.assertEqual(mock_get.call_count, 3)
@@ -0,0 +1,146 @@
+import os
+import random
+import tempfile
+from decimal import Decimal
+from unittest import TestCase, mock
+
+from openshift_metrics import invoice, sharded_report, utils
+from openshift_metrics.columnar_processor import ColumnarMetricsProcessor
+from openshift_metrics.compact_processor import CompactMetricsProcessor
+from openshift_metrics.external_processor import ExternalMetricsProcessor
+from openshift_metrics.metrics_processor import MetricsProcessor
+
+RATES = invoice.Rates(
+    cpu=Decimal("0.013"),
+    gpu_a100=Decimal("1.803"),
+    gpu_a100sxm4=Decimal("2.078"),
+    gpu_v100=Decimal("1.214"),
+)
+METRICS_TO_CHECK = ["cpu_request", "memory_request", "gpu_request", "gpu_type"]
+
+
+class TestShardedReport(TestCase):
+
+    def test_shard_namespaces(self):
+        namespaces = [f"namespace{i}" for i in range(20)]
+        shards = sharded_report.shard_namespaces(namespaces, 3)
+        self.assertEqual(len(shards), 3)
+        self.assertEqual(sorted(sum(shards, [])), sorted(namespaces))
+        self.assertEqual(shards, sharded_report.shard_namespaces(namespaces, 3))
+
+    @mock.patch('openshift_metrics.utils.get_namespace_attributes')
+    def test_same_reports_as_single_process(self, mock_gna):
+        mock_gna.return_value = {"namespace1": {"cf_pi": "PI1", "institution_code": "76"}}
+        rng = random.Random(3)
+
+        def merged_processor(processor_class=MetricsProcessor):
+            processor = processor_class()
+            for namespace in ["namespace1", "rhods-notebooks", "namespace2", "namespace3"]:
+                for pod in range(3):
+                    metric = {
+                        "metric": {
+                            "pod": f"pod{pod}",
+                            "namespace": namespace,
+                            "node": "wrk-1",
+                            "label_nerc_mghpcc_org_class": rng.choice(["student", None]),
+                        },
+                    }
+                    values = [[i * 900, rng.choice(["1", "2"])] for i in range(200) if rng.random() < 0.9]
+                    processor.merge_metrics("cpu_request", [dict(metric, values=values)])
+                    processor.merge_metrics("memory_request", [dict(metric, values=[[t, "1073741824"] for t, _ in values])])
+            return processor
+
+        state = rng.getstate()
+        processor = merged_processor()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            expected_files = [os.path.join(tmp_dir, f"expected-{name}") for name in ("invoice", "classes", "pod")]
+            sharded_files = [os.path.join(tmp_dir, f"sharded-{name}") for name in ("invoice", "classes", "pod")]
+
+            condensed_metrics_dict = processor.condense_metrics(METRICS_TO_CHECK)
+            utils.write_metrics_by_namespace(condensed_metrics_dict, expected_files[0], "2024-01", RATES)
+            utils.write_metrics_by_classes(condensed_metrics_dict, expected_files[1], "2024-01", RATES, ["rhods-notebooks"])
+            utils.write_metrics_by_pod(condensed_metrics_dict, expected_files[2])
+
+            for processor_class in (MetricsProcessor, ColumnarMetricsProcessor, CompactMetricsProcessor):
+                rng.setstate(state)
+                sharded_processor = merged_processor(processor_class)
+                sharded_report.write_reports(
+                    sharded_processor,
+                    jobs=2,
+                    metrics_to_check=METRICS_TO_CHECK,
+                    invoice_file=sharded_files[0],
+                    classes_invoice_file=sharded_files[1],
+                    pod_report_file=sharded_files[2],
+                    report_month="2024-01",
+                    rates=RATES,
+                    namespaces_with_classes=["rhods-notebooks"],
+                )
+
+                for expected_file, sharded_file in zip(expected_files, sharded_files):
+                    with open(expected_file) as expected, open(sharded_file) as sharded:
+                        expected_content = expected.read()
+                        self.assertEqual(sharded.read(), expected_content)
+                        self.assertGreater(len(expected_content.splitlines()), 1)
+
+    @mock.patch('openshift_metrics.utils.get_namespace_attributes')
+    def test_same_streamed_reports_for_each_backend(self, mock_gna):
+        """Pods of a namespace first merged in a later file are reported with their namespace"""
+        mock_gna.return_value = {"namespace1": {"cf_pi": "PI1", "institution_code": "76"}}
+        rng = random.Random(4)
+        files = []
+        for file_index in range(3):
+            file = {"cpu_request": [], "memory_request": []}
+            for namespace in ["namespace1", "rhods-notebooks", "namespace2"]:
+                for pod in range(file_index + 1):
+                    metric = {
+                        "metric": {
+                            "pod": f"pod{pod}",
+                            "namespace": namespace,
+                            "node": "wrk-1",
+                            "label_nerc_mghpcc_org_class": rng.choice(["student", None]),
+                        },
+                    }
+                    start = file_index * 96
+                    values = [[i * 900, rng.choice(["1", "2"])] for i in range(start, start + 96) if rng.random() < 0.9]
+                    file["cpu_request"].append(dict(metric, values=values))
+                    file["memory_request"].append(dict(metric, values=[[t, "1073741824"] for t, _ in values]))
+            files.append(file)
+
+        def merged_processor(processor):
+            for file in files:
+                for metric_name, metric_list in file.items():
+                    processor.merge_metrics(metric_name, metric_list)
+            return processor
+
+        def write_reports(processor, report_files):
+            utils.write_reports_from_intervals(
+                processor.iter_condensed_metrics(METRICS_TO_CHECK, consume=True),
+                *report_files,
+                report_month="2024-01",
+                rates=RATES,
+                namespaces_with_classes=["rhods-notebooks"],
+            )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            expected_files = [os.path.join(tmp_dir, f"expected-{name}") for name in ("invoice", "classes", "pod")]
+            write_reports(merged_processor(MetricsProcessor()), expected_files)
+            with open(expected_files[2]) as pod_report:
+                namespaces = [row.split(",")[0] for row in pod_report.read().splitlines()[1:]]
+            self.assertEqual(namespaces, sorted(namespaces, key=["namespace1", "rhods-notebooks", "namespace2"].index))
+
+            processors = [
+                ColumnarMetricsProcessor(),
+                CompactMetricsProcessor(),
+                MetricsProcessor(incremental=True),
+                ExternalMetricsProcessor(memory_budget_mb=0.01, spill_dir=tmp_dir),
+            ]
+            for processor in processors:
+                report_files = [os.path.join(tmp_dir, f"{type(processor).__name__}-{name}") for name in ("invoice", "classes", "pod")]
+                write_reports(merged_processor(processor), report_files)
+
+                for expected_file, report_file in zip(expected_files, report_files):
+                    with open(expected_file) as expected, open(report_file) as report:
+                        expected_content = expected.read()
+                        self.assertEqual(report.read(), expected_content, report_file)
+                        self.assertGreater(len(expected_content.splitlines()), 1)
@@ -15,7 +15,7 @@ import tempfile
 from unittest import TestCase, mock
 from decimal import Decimal
 
-from openshift_metrics import utils, invoice
+from openshift_metrics import utils, invoice, metrics_processor
 import os
 from datetime import datetime, UTC
 
@@ -680,3 +680,60 @@ class TestGetServiceUnit(TestCase):
         self.assertIsInstance(su_count, int)
         self.assertEqual(su_count, 2)
         self.assertEqual(su_type, invoice.SU_A100_GPU)
+
+
+class TestWriteReportsFromIntervals(TestCase):
+
+    @mock.patch('openshift_metrics.utils.get_namespace_attributes')
+    def test_same_as_writing_condensed_metrics(self, mock_gna):
+        mock_gna.return_value = {"namespace1": {"cf_pi": "PI1", "institution_code": "76"}}
+        metrics_to_check = ["cpu_request", "memory_request", "gpu_request", "gpu_type"]
+        ignore_hours = [(datetime(1970, 1, 1, 2, 0, 0, tzinfo=UTC), datetime(1970, 1, 1, 3, 0, 0, tzinfo=UTC))]
+
+        def merged_processor():
+            processor = metrics_processor.MetricsProcessor()
+            for namespace in ["namespace1", "rhods-notebooks", "namespace2"]:
+                for pod in range(3):
+                    metric = {
+                        "metric": {
+                            "pod": f"pod{pod}",
+                            "namespace": namespace,
+                            "node": "wrk-1",
+                            "label_nerc_mghpcc_org_class": "student" if pod else None,
+                        },
+                    }
+                    values = [[i * 900, "2" if i % 40 < 10 else "1"] for i in range(200) if i % 70]
+                    processor.merge_metrics("cpu_request", [dict(metric, values=values)])
+                    processor.merge_metrics("memory_request", [dict(metric, values=[[t, "1073741824"] for t, _ in values])])
+                    if pod == 1:
+                        gpu_metric = dict(metric, metric=dict(metric["metric"], resource=invoice.WHOLE_GPU))
+                        processor.merge_metrics("gpu_request", [dict(gpu_metric, values=values[:50])])
+            return processor
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            expected_files = [os.path.join(tmp_dir, f"expected-{name}") for name in ("invoice", "classes", "pod")]
+            streamed_files = [os.path.join(tmp_dir, f"streamed-{name}") for name in ("invoice", "classes", "pod")]
+
+            condensed_metrics_dict = merged_processor().condense_metrics(metrics_to_check)
+            utils.write_metrics_by_namespace(condensed_metrics_dict, expected_files[0], "2024-01", RATES, ignore_hours)
+            utils.write_metrics_by_classes(
+                condensed_metrics_dict, expected_files[1], "2024-01", RATES, ["rhods-notebooks"], ignore_hours
+            )
+            utils.write_metrics_by_pod(condensed_metrics_dict, expected_files[2], ignore_hours)
+
+            processor = merged_processor()
+            utils.write_reports_from_intervals(
+                processor.iter_condensed_metrics(metrics_to_check, consume=True),
+                *streamed_files,
+                report_month="2024-01",
+                rates=RATES,
+                namespaces_with_classes=["rhods-notebooks"],
+                ignore_hours=ignore_hours,
+            )
+            self.assertEqual(processor.merged_data, {})
+
+            for expected_file, streamed_file in zip(expected_files, streamed_files):
+                with open(expected_file) as expected, open(streamed_file) as streamed:
+                    expected_content = expected.read()
+                    self.assertEqual(streamed.read(), expected_content)
+                    self.assertGreater(len(expected_content.splitlines()), 1)
@@ -18,8 +18,10 @@ import csv
 import requests
 import boto3
 import logging
+from datetime import datetime
 
 from openshift_metrics import invoice
+from openshift_metrics.metrics_file import get_index_file_name
 from decimal import Decimal
 
 logging.basicConfig(level=logging.INFO)
@@ -30,6 +32,14 @@ class EmptyResultError(Exception):
     """Raise when no results are retrieved for a query"""
 
 
+class QueryLimitError(Exception):
+    """Raise when prometheus rejects a query for exceeding its resource limits"""
+
+
+class PartialResponseError(Exception):
+    """Raise when prometheus returns a partial response with warnings"""
+
+
 class ColdFrontClient(object):
 
     def __init__(self, keycloak_url, keycloak_client_id, keycloak_client_secret):
@@ -77,6 +87,27 @@ def upload_to_s3(file, bucket, location):
     response = s3.upload_file(file, Bucket=bucket, Key=location)
 
 
+def upload_metrics_file_to_s3(file, bucket, location):
+    """Uploads a metrics file to location, and its index next to it if it has one"""
+    upload_to_s3(file, bucket, location)
+    index_file = get_index_file_name(file)
+    if os.path.exists(index_file):
+        upload_to_s3(index_file, bucket, get_index_file_name(location))
+
+
+def get_metrics_file_name(report_start_date, report_end_date, extension="json"):
+    """Returns the default name of the metrics file for the period"""
+    if report_start_date == report_end_date:
+        return f"metrics-{report_start_date}.{extension}"
+    return f"metrics-{report_start_date}-to-{report_end_date}.{extension}"
+
+
+def get_metrics_s3_location(report_start_date, report_end_date, extension="json"):
+    """Returns where the metrics file for the period is uploaded in the metrics bucket"""
+    month_year = datetime.strptime(report_start_date, "%Y-%m-%d").strftime("%Y-%m")
+    return f"data_{month_year}/{get_metrics_file_name(report_start_date, report_end_date, extension)}"
+
+
 def get_namespace_attributes():
     """
     Returns allocation attributes from coldfront associated
@@ -114,29 +145,60 @@ def csv_writer(rows, file_name):
         csvwriter.writerows(rows)
 
 
+INVOICE_HEADERS = [
+    "Invoice Month",
+    "Project - Allocation",
+    "Project - Allocation ID",
+    "Manager (PI)",
+    "Invoice Email",
+    "Invoice Address",
+    "Institution",
+    "Institution - Specific Code",
+    "SU Hours (GBhr or SUhr)",
+    "SU Type",
+    "Rate",
+    "Cost",
+]
+
+POD_REPORT_HEADERS = [
+    "Namespace",
+    "Pod Start Time",
+    "Pod End Time",
+    "Duration (Hours)",
+    "Pod Name",
+    "CPU Request",
+    "GPU Request",
+    "GPU Type",
+    "GPU Resource",
+    "Node",
+    "Node Model",
+    "Memory Request (GiB)",
+    "Determining Resource",
+    "SU Type",
+    "SU Count",
+]
+
+
 def write_metrics_by_namespace(condensed_metrics_dict, file_name, report_month, rates, ignore_hours=None):
     """
     Process metrics dictionary to aggregate usage by namespace and then write that to a file
     """
+    rows = [INVOICE_HEADERS]
+    rows.extend(
+        get_invoice_rows_by_namespace(
+            condensed_metrics_dict, report_month, rates, get_namespace_attributes(), ignore_hours
+        )
+    )
+    csv_writer(rows, file_name)
+
+
+def get_invoice_rows_by_namespace(condensed_metrics_dict, report_month, rates, namespace_annotations, ignore_hours=None):
+    """
+    Aggregates usage by namespace and returns the invoice rows, in the order
+    of the namespaces
+    """
     invoices = {}
     rows = []
-    namespace_annotations = get_namespace_attributes()
-    headers = [
-        "Invoice Month",
-        "Project - Allocation",
-        "Project - Allocation ID",
-        "Manager (PI)",
-        "Invoice Email",
-        "Invoice Address",
-        "Institution",
-        "Institution - Specific Code",
-        "SU Hours (GBhr or SUhr)",
-        "SU Type",
-        "Rate",
-        "Cost",
-    ]
-
-    rows.append(headers)
 
     for namespace, pods in condensed_metrics_dict.items():
         namespace_annotation_dict = namespace_annotations.get(namespace, {})
@@ -180,32 +242,21 @@ def write_metrics_by_namespace(condensed_metrics_dict, file_name, report_month,
     for project_invoice in invoices.values():
         rows.extend(project_invoice.generate_invoice_rows(report_month))
 
-    csv_writer(rows, file_name)
+    return rows
 
 
 def write_metrics_by_pod(condensed_metrics_dict, file_name, ignore_hours=None):
     """
     Generates metrics report by pod.
     """
+    rows = [POD_REPORT_HEADERS]
+    rows.extend(get_pod_rows(condensed_metrics_dict, ignore_hours))
+    csv_writer(rows, file_name)
+
+
+def get_pod_rows(condensed_metrics_dict, ignore_hours=None):
+    """Returns the rows of the pod report, in the order of the namespaces"""
     rows = []
-    headers = [
-        "Namespace",
-        "Pod Start Time",
-        "Pod End Time",
-        "Duration (Hours)",
-        "Pod Name",
-        "CPU Request",
-        "GPU Request",
-        "GPU Type",
-        "GPU Resource",
-        "Node",
-        "Node Model",
-        "Memory Request (GiB)",
-        "Determining Resource",
-        "SU Type",
-        "SU Count",
-    ]
-    rows.append(headers)
 
     for namespace, pods in condensed_metrics_dict.items():
         for pod_name, pod_dict in pods.items():
@@ -226,7 +277,8 @@ def write_metrics_by_pod(condensed_metrics_dict, file_name, ignore_hours=None):
                 )
                 rows.append(pod_obj.generate_pod_row(ignore_hours))
 
-    csv_writer(rows, file_name)
+    return rows
+
 
 def write_metrics_by_classes(condensed_metrics_dict, file_name, report_month, rates, namespaces_with_classes, ignore_hours=None):
     """
@@ -235,24 +287,22 @@ def write_metrics_by_classes(condensed_metrics_dict, file_name, report_month, ra
     If a pod has a class label, then the project name is composed of namespace:class_name
     otherwise it's namespace:noclass.
     """
+    rows = [INVOICE_HEADERS]
+    rows.extend(
+        get_invoice_rows_by_classes(
+            condensed_metrics_dict, report_month, rates, namespaces_with_classes, ignore_hours
+        )
+    )
+    csv_writer(rows, file_name)
+
+
+def get_invoice_rows_by_classes(condensed_metrics_dict, report_month, rates, namespaces_with_classes, ignore_hours=None):
+    """
+    Aggregates usage by the class label and returns the invoice rows, in the
+    order of the namespaces
+    """
     invoices = {}
     rows = []
-    headers = [
-        "Invoice Month",
-        "Project - Allocation",
-        "Project - Allocation ID",
-        "Manager (PI)",
-        "Invoice Email",
-        "Invoice Address",
-        "Institution",
-        "Institution - Specific Code",
-        "SU Hours (GBhr or SUhr)",
-        "SU Type",
-        "Rate",
-        "Cost",
-    ]
-
-    rows.append(headers)
 
     for namespace, pods in condensed_metrics_dict.items():
         if namespace not in namespaces_with_classes:
@@ -300,4 +350,94 @@ def write_metrics_by_classes(condensed_metrics_dict, file_name, report_month, ra
     for project_invoice in invoices.values():
         rows.extend(project_invoice.generate_invoice_rows(report_month))
 
-    csv_writer(rows, file_name)
+    return rows
+
+
+def write_reports_from_intervals(
+    condensed_intervals,
+    invoice_file,
+    classes_invoice_file,
+    pod_report_file,
+    report_month,
+    rates,
+    namespaces_with_classes,
+    ignore_hours=None,
+):
+    """
+    Writes the same reports as write_metrics_by_namespace, write_metrics_by_classes
+    and write_metrics_by_pod in a single pass over the (namespace, pod, interval)
+    tuples of MetricsProcessor.iter_condensed_metrics, so the condensed metrics
+    don't have to be kept in memory. The rows of the pod report are written as
+    the intervals are read.
+    """
+    namespace_annotations = get_namespace_attributes()
+    namespace_invoices = {}
+    class_invoices = {}
+
+    logger.info(f"Writing report to {pod_report_file}")
+    with open(pod_report_file, "w") as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(POD_REPORT_HEADERS)
+
+        for namespace, pod, interval in condensed_intervals:
+            pod_metric_dict = interval.metrics
+            pod_kwargs = dict(
+                pod_name=pod,
+                namespace=namespace,
+                start_time=interval.start,
+                duration=pod_metric_dict["duration"],
+                cpu_request=Decimal(pod_metric_dict.get("cpu_request", 0)),
+                gpu_request=Decimal(pod_metric_dict.get("gpu_request", 0)),
+                memory_request=Decimal(pod_metric_dict.get("memory_request", 0)) / 2**30,
+                gpu_type=pod_metric_dict.get("gpu_type"),
+                gpu_resource=pod_metric_dict.get("gpu_resource"),
+                node_hostname=pod_metric_dict.get("node"),
+                node_model=pod_metric_dict.get("node_model"),
+            )
+            pod_obj = invoice.Pod(**pod_kwargs)
+
+            if namespace not in namespace_invoices:
+                namespace_annotation_dict = namespace_annotations.get(namespace, {})
+                namespace_invoices[namespace] = invoice.ProjectInvoce(
+                    invoice_month=report_month,
+                    project=namespace,
+                    project_id=namespace,
+                    pi=namespace_annotation_dict.get("cf_pi"),
+                    invoice_email="",
+                    invoice_address="",
+                    intitution="",
+                    institution_specific_code=namespace_annotation_dict.get("institution_code", ""),
+                    rates=rates,
+                    ignore_hours=ignore_hours,
+                )
+            namespace_invoices[namespace].add_pod(pod_obj)
+
+            if namespace in namespaces_with_classes:
+                if interval.class_name:
+                    project_name = f"{namespace}:{interval.class_name}"
+                else:
+                    project_name = f"{namespace}:noclass"
+                if project_name not in class_invoices:
+                    class_invoices[project_name] = invoice.ProjectInvoce(
+                        invoice_month=report_month,
+                        project=project_name,
+                        project_id=project_name,
+                        pi="",
+                        invoice_email="",
+                        invoice_address="",
+                        intitution="",
+                        institution_specific_code="",
+                        rates=rates,
+                        ignore_hours=ignore_hours,
+                    )
+                class_invoices[project_name].add_pod(invoice.Pod(**dict(pod_kwargs, namespace=project_name)))
+
+            pod_kwargs["node_hostname"] = pod_metric_dict.get("node", "Unknown Node")
+            pod_kwargs["node_model"] = pod_metric_dict.get("node_model", "Unknown Model")
+            csvwriter.writerow(invoice.Pod(**pod_kwargs).generate_pod_row(ignore_hours))
+
+    for file_name, invoices in ((invoice_file, namespace_invoices), (classes_invoice_file, class_invoices)):
+        rows = [INVOICE_HEADERS]
+        for project_invoice in invoices.values():
+            rows.extend(project_invoice.generate_invoice_rows(report_month))
+        csv_writer(rows, file_name)